@@ -6,13 +6,11 @@ conditions specifically from the SDK C library are indicated by errors of type :
 :func:`Camera.capture()` errors are signalled by :class:`ZWO_CaptureError`."""
 
 import ctypes as c
-from ctypes.util import find_library
 import logging
-import numpy as np
+import os
 import sys
 import time
 import traceback
-import logging
 
 __author__ = 'Steve Marple'
 __version__ = '0.2.0'
@@ -96,8 +94,9 @@ def _get_roi_format(id_):
     return [roi_width.value, roi_height.value, bins.value, image_type.value]
 
 
-def _set_roi_format(id_, width, height, bins, image_type):
-    cam_info = _get_camera_property(id_)
+def _set_roi_format(id_, width, height, bins, image_type, cam_info=None):
+    if cam_info is None:
+        cam_info = _get_camera_property(id_)
 
     if width < 8:
         raise ValueError('ROI width too small')
@@ -181,16 +180,11 @@ def _stop_video_capture(id_):
 
 def _get_video_data(id_, timeout, buffer_=None):
     if buffer_ is None:
-        whbi = _get_roi_format(id_)
-        sz = whbi[0] * whbi[1]
-        if whbi[3] == ASI_IMG_RGB24:
-            sz *= 3
-        elif whbi[3] == ASI_IMG_RAW16:
-            sz *= 2
+        sz = buffer_size(_get_roi_format(id_))
         buffer_ = bytearray(sz)
     else:
-        if not isinstance(buffer_, bytearray):
-            raise TypeError('Supplied buffer must be a bytearray')
+        if not isinstance(buffer_, (bytearray, memoryview)):
+            raise TypeError('Supplied buffer must be a bytearray or memoryview')
         sz = len(buffer_)
     
     cbuf_type = c.c_char * len(buffer_)
@@ -240,16 +234,11 @@ def _get_exposure_status(id_):
 
 def _get_data_after_exposure(id_, buffer_=None):
     if buffer_ is None:
-        whbi = _get_roi_format(id_)
-        sz = whbi[0] * whbi[1]
-        if whbi[3] == ASI_IMG_RGB24:
-            sz *= 3
-        elif whbi[3] == ASI_IMG_RAW16:
-            sz *= 2
+        sz = buffer_size(_get_roi_format(id_))
         buffer_ = bytearray(sz)
     else:
-        if not isinstance(buffer_, bytearray):
-            raise TypeError('Supplied buffer must be a bytearray')
+        if not isinstance(buffer_, (bytearray, memoryview)):
+            raise TypeError('Supplied buffer must be a bytearray or memoryview')
         sz = len(buffer_)
     
     cbuf_type = c.c_char * len(buffer_)
@@ -338,14 +327,196 @@ def _send_soft_trigger(id_, bStart):
         raise zwo_errors[r]
     return
 
+def buffer_size(whbi):
+    """Size in bytes of an image with the ROI format `whbi`, as returned by :func:`Camera.get_roi_format()`.
+    Type :class:`int`."""
+    sz = whbi[0] * whbi[1]
+    if whbi[3] == ASI_IMG_RGB24:
+        sz *= 3
+    elif whbi[3] == ASI_IMG_RAW16:
+        sz *= 2
+    return sz
+
+
+def image_from_buffer(data, whbi):
+    """View of `data`, image data from the SDK with the ROI format `whbi`, as an image. Type :class:`numpy.ndarray`.
+
+    The array shares memory with `data`, which may be a :class:`bytearray` or a :class:`memoryview`."""
+    import numpy as np  # Deferred so that programs which do not capture images need not import numpy
+    shape = [whbi[1], whbi[0]]
+    if whbi[3] == ASI_IMG_RAW8 or whbi[3] == ASI_IMG_Y8:
+        img = np.frombuffer(data, dtype=np.uint8)
+    elif whbi[3] == ASI_IMG_RAW16:
+        img = np.frombuffer(data, dtype=np.uint16)
+    elif whbi[3] == ASI_IMG_RGB24:
+        img = np.frombuffer(data, dtype=np.uint8)
+        shape.append(3)
+    else:
+        raise ValueError('Unsupported image type')
+    return img.reshape(shape)
+
+
+def save_image(img, image_type, filename):
+    """Save `img`, an image of the SDK `image_type`, to `filename` using :py:meth:`PIL.Image.Image.save()`."""
+    from PIL import Image
+    mode = None
+    if len(img.shape) == 3:
+        img = img[:, :, ::-1]  # Convert BGR to RGB
+    if image_type == ASI_IMG_RAW16:
+        mode = 'I;16'
+    image = Image.fromarray(img, mode=mode)
+    image.save(filename)
+    logger.debug('wrote %s', filename)
+
+
+def _get_serial_number(id_):
+    serial = _ASI_SN()
+    r = zwolib.ASIGetSerialNumber(id_, serial)
+    if r:
+        raise zwo_errors[r]
+    return serial.get_serial_number()
+
+
+class _CameraRegistry(object):
+    """Cache of the properties and identities of the connected cameras.
+
+    Camera properties are queried once per scan. Serial numbers and user IDs can only be read from an open camera so
+    are fetched on demand, opening the camera briefly if necessary, and then cached. The cache is rebuilt by
+    :func:`rescan()` or when the number of connected cameras is seen to change."""
+    def __init__(self):
+        self._entries = None
+        self._open = set()  # Indices of cameras held open by Camera objects
+
+    def rescan(self):
+        self._entries = []
+        for n in range(get_num_cameras()):
+            self._entries.append({'index': n,
+                                  'property': _get_camera_property(n),
+                                  'serial': None,
+                                  'user_id': None})
+        logger.debug('found %d camera(s)', len(self._entries))
+        return self._entries
+
+    def entries(self, check=True):
+        if self._entries is None or (check and get_num_cameras() != len(self._entries)):
+            return self.rescan()
+        return self._entries
+
+    def get_property(self, id_):
+        entries = self.entries(check=False)
+        if id_ >= len(entries):
+            entries = self.rescan()
+        return entries[id_]['property']
+
+    def _identify(self, entry):
+        if entry['serial'] is not None:
+            return
+        n = entry['index']
+        opened = n not in self._open
+        if opened:
+            _open_camera(n)
+        try:
+            try:
+                entry['serial'] = _get_serial_number(n)
+            except ZWO_IOError:
+                entry['serial'] = ''  # Not supported by this model
+            entry['user_id'] = _get_id(n)
+        finally:
+            if opened:
+                _close_camera(n)
+
+    def find(self, name=None, serial=None, user_id=None):
+        matches = []
+        for entry in self.entries():
+            if name is not None and entry['property']['Name'] not in (name, 'ZWO ' + name):
+                continue
+            if serial is not None or user_id is not None:
+                self._identify(entry)
+                if serial is not None and entry['serial'].lower() != serial.lower():
+                    continue
+                if user_id is not None and entry['user_id'] != user_id:
+                    continue
+            matches.append(entry['index'])
+        return matches
+
+
+_registry = _CameraRegistry()
+
+
+def rescan_cameras():
+    """Rebuild the cache of connected cameras. Returns the number of cameras found. Type :class:`int`.
+
+    The cache is also rebuilt automatically when the number of connected cameras changes, but a rescan is needed to
+    notice a camera being exchanged for another."""
+    return len(_registry.rescan())
+
+
+def get_camera_info(id_, identify=False):
+    """Retrieves cached information about a connected camera. Type :class:`dict`.
+
+    The dictionary contains the ``index``, the camera ``property`` dictionary (as returned by
+    :func:`Camera.get_camera_property()`), the ``serial`` number and the ``user_id`` set with
+    :func:`Camera.set_id()`. The serial number and user ID are ``None`` until known; if `identify` is true they are
+    read from the camera, which is briefly opened if necessary."""
+    entries = _registry.entries()
+    if id_ < 0 or id_ >= len(entries):
+        raise IndexError('Invalid id')
+    if identify:
+        _registry._identify(entries[id_])
+    return dict(entries[id_])
+
+
+def find_camera(name=None, serial=None, user_id=None):
+    """Find a connected camera by model `name`, `serial` number and/or `user_id`. Type :class:`int`.
+
+    Returns the ID of the first camera matching all of the given criteria. A :class:`ValueError` is raised if no
+    camera matches. Matching by serial number or user ID requires the identity of each candidate camera to be read
+    once; the result is cached."""
+    matches = _registry.find(name, serial, user_id)
+    if not matches:
+        criteria = ', '.join('%s=%s' % (k, v) for k, v in (('name', name), ('serial', serial), ('user_id', user_id))
+                             if v is not None)
+        raise ValueError('Could not find camera with %s' % criteria)
+    return matches[0]
+
+
+def convert_image(img, bit_depth=16, right_justify=False, normalize=False, rgb=False, out=None):
+    """Convert an image returned by :func:`Camera.capture()` or :func:`Camera.capture_video_frame()`.
+    Type :class:`numpy.ndarray`.
+
+    16 bit images from the SDK are left-justified, i.e. a sensor of `bit_depth` bits fills the most significant
+    bits. With `right_justify` the values are shifted down to the range ``0`` to ``2**bit_depth - 1``. With
+    `normalize` a ``float32`` image scaled to the range 0 to 1 is produced (the shift is then implicit). With `rgb`
+    the channel order of colour images is converted from the SDK's BGR to RGB; on its own this returns a view
+    without copying.
+
+    If `out` is given the result is written into it with in-place operations and `out` is returned, so that
+    repeated conversions need not allocate memory. Otherwise a new array is allocated when required."""
+    import numpy as np
+    if rgb and img.ndim == 3:
+        img = img[:, :, ::-1]
+    shift = 16 - bit_depth if img.dtype == np.uint16 else 0
+
+    if normalize:
+        full_scale = 255 if img.dtype == np.uint8 else ((1 << bit_depth) - 1) << shift
+        if out is None:
+            out = np.empty(img.shape, dtype=np.float32)
+        np.multiply(img, np.float32(1.0 / full_scale), out=out)
+        return out
+    if right_justify and shift > 0:
+        if out is None:
+            out = np.empty(img.shape, dtype=img.dtype)
+        np.right_shift(img, shift, out=out)
+        return out
+    if out is not None:
+        np.copyto(out, img)
+        return out
+    return img
 
 
 def list_cameras():
     """Retrieves model names of all connected ZWO ASI cameras. Type :class:`list` of :class:`str`."""
-    r = []
-    for id_ in range(get_num_cameras()):
-        r.append(_get_camera_property(id_)['Name'])
-    return r
+    return [entry['property']['Name'] for entry in _registry.entries()]
 
 
 class ZWO_Error(Exception):
@@ -361,6 +532,12 @@ class ZWO_IOError(ZWO_Error):
         self.error_code = error_code
 
 
+class ZWO_CameraRemovedError(ZWO_IOError):
+    """Exception class for SDK errors indicating that the camera has been removed or closed, or that its ID is no
+    longer valid."""
+    pass
+
+
 class ZWO_CaptureError(ZWO_Error):
     """Exception class for when :func:`Camera.capture()` fails."""
     def __init__(self, message, exposure_status=None):
@@ -368,35 +545,146 @@ class ZWO_CaptureError(ZWO_Error):
         self.exposure_status = exposure_status
 
 
+class Frame(object):
+    """A captured image together with its acquisition metadata.
+
+    Returned by :func:`Camera.capture()` and :func:`Camera.capture_video_frame()` when ``metadata=True``. The
+    attributes are:
+
+    ``image``
+        The image data, type :class:`numpy.ndarray`, or ``None`` where the image is not kept with the metadata.
+    ``sequence``
+        Frame sequence number, counting all frames captured by the :class:`Camera` object.
+    ``monotonic_start``, ``monotonic_end``
+        Values of :func:`time.monotonic()` taken immediately before and after the SDK acquired the data.
+    ``timestamp``
+        Wall-clock time (seconds since the epoch) taken at the same moment as ``monotonic_end``.
+    ``roi``
+        Region of interest as ``[start_x, start_y, width, height]``.
+    ``bins``, ``image_type``
+        Pixel binning and image type in use.
+    ``exposure``, ``gain``
+        Values of the ``ASI_EXPOSURE`` (microseconds) and ``ASI_GAIN`` controls in effect.
+    ``dropped_frames``
+        Number of frames dropped by the SDK since the previous frame, for video frames.
+
+    Frames are usually created with :class:`FrameMetadata`."""
+    def __init__(self, image, sequence=None, monotonic_start=None, monotonic_end=None, timestamp=None,
+                 roi=None, bins=None, image_type=None, exposure=None, gain=None, dropped_frames=0):
+        self.image = image
+        self.sequence = sequence
+        self.monotonic_start = monotonic_start
+        self.monotonic_end = monotonic_end
+        self.timestamp = timestamp
+        self.roi = roi
+        self.bins = bins
+        self.image_type = image_type
+        self.exposure = exposure
+        self.gain = gain
+        self.dropped_frames = dropped_frames
+
+    def __repr__(self):
+        return '<Frame sequence=%s timestamp=%s shape=%s dropped_frames=%s>' % \
+            (self.sequence, self.timestamp, None if self.image is None else self.image.shape, self.dropped_frames)
+
+
+class FrameMetadata(object):
+    """Create :class:`Frame` objects for the images captured by `camera` with the ROI format `whbi`.
+
+    The ROI start position, and the exposure and gain unless they are under automatic control, are read once when
+    the object is created. For each frame only the automatically controlled values and, if `video` is true, the SDK
+    dropped frame count are read. `dropped_frames` is the dropped frame count from which the first frame's
+    ``dropped_frames`` is measured; by default it is read now. Create a new object whenever the settings are
+    changed, and reset :attr:`dropped_frames` to zero when video capture is restarted."""
+    def __init__(self, camera, whbi=None, video=True, dropped_frames=None):
+        if whbi is None:
+            whbi = camera.get_roi_format()
+        self.camera = camera
+        self.whbi = list(whbi)
+        self.video = video
+        start_x, start_y = camera.get_roi_start_position()
+        self.roi = [start_x, start_y, whbi[0], whbi[1]]
+        self._values = {}
+        self._auto = []
+        for control_type in (ASI_EXPOSURE, ASI_GAIN):
+            value, auto = camera.get_control_value(control_type)
+            self._values[control_type] = value
+            if auto:
+                self._auto.append(control_type)
+        if video and dropped_frames is None:
+            dropped_frames = camera.get_dropped_frames()
+        self.dropped_frames = dropped_frames
+
+    @property
+    def exposure(self):
+        """Exposure of the most recent frame, or when the object was created, in microseconds."""
+        return self._values[ASI_EXPOSURE]
+
+    @property
+    def gain(self):
+        """Gain of the most recent frame, or when the object was created."""
+        return self._values[ASI_GAIN]
+
+    def frame(self, image, monotonic_start=None, monotonic_end=None, timestamp=None, sequence=None):
+        """Create the metadata for `image`, the frame just captured. Type :class:`Frame`.
+
+        `sequence` defaults to the camera's current frame sequence number."""
+        camera = self.camera
+        for control_type in self._auto:
+            self._values[control_type] = camera.get_control_value(control_type)[0]
+        dropped_delta = 0
+        if self.video:
+            dropped = camera.get_dropped_frames()
+            dropped_delta = max(dropped - self.dropped_frames, 0)
+            self.dropped_frames = dropped
+        return Frame(image,
+                     sequence=camera.get_frame_sequence() if sequence is None else sequence,
+                     monotonic_start=monotonic_start,
+                     monotonic_end=monotonic_end,
+                     timestamp=timestamp,
+                     roi=list(self.roi),
+                     bins=self.whbi[2],
+                     image_type=self.whbi[3],
+                     exposure=self.exposure,
+                     gain=self.gain,
+                     dropped_frames=dropped_delta)
+
+
 class Camera(object):
     """Representation of ZWO ASI camera.
 
-    The constructor for a camera object requires the camera ID number or model. The camera destructor automatically
-    closes the camera."""
+    The constructor for a camera object requires the camera ID number, model, serial number or user ID (see
+    :func:`find_camera()`); a string is first matched against the camera models, then the serial numbers and then
+    the user IDs. The camera destructor automatically closes the camera."""
     def __init__(self, id_):
         if isinstance(id_, int):
-            if id_ >= get_num_cameras() or id_ < 0:
+            if id_ >= len(_registry.entries()) or id_ < 0:
                 raise IndexError('Invalid id')
         elif isinstance(id_, str):
-            # Find first matching camera model
-            found = False
-            for n in range(get_num_cameras()):
-                model = _get_camera_property(n)['Name']
-                if model in (id_, 'ZWO ' + id_):
-                    found = True
-                    id_ = n
-                    break
-            if not found:
-                raise ValueError('Could not find camera model %s' % id_)
+            matches = (_registry.find(name=id_) or _registry.find(serial=id_) or _registry.find(user_id=id_))
+            if not matches:
+                raise ValueError('Could not find camera %s' % id_)
+            id_ = matches[0]
 
         else:
             raise TypeError('Unknown type for id')
 
-        self.id = id_
         self.default_timeout = -1
+        self.video_frames = 0  # Frames retrieved with get_video_data(), by any capture method
+        self._frame_sequence = 0
+        self._last_dropped_frames = 0
+        self._hooks = {}
+        self._open(id_)
+
+    def _open(self, id_):
+        self.id = id_
+        self.video_active = False
+        self._frame_metadata = {}  # FrameMetadata for video and still frames, discarded when settings change
+        self._camera_info = _registry.get_property(id_)
         try:
             _open_camera(id_)
             self.closed = False
+            _registry._open.add(id_)
 
             _init_camera(id_)
         except Exception:
@@ -405,19 +693,34 @@ class Camera(object):
             logger.error('could not open camera ' + str(id_))
             logger.debug(traceback.format_exc())
             raise
+
+    def reopen(self, id_=None):
+        """Close and reopen the camera, optionally at a different camera ID.
+
+        Used to recover after a camera has been disconnected or reset, when it may have been enumerated with a new
+        ID. Camera settings are not preserved; see :class:`zwoasi.supervisor.CameraSupervisor`."""
+        if id_ is None:
+            id_ = self.id
+        try:
+            self.close()
+        except ZWO_Error:
+            logger.debug(traceback.format_exc())
+        self._open(id_)
             
     def __del__(self):
-        self.close()
-
-    def get_serial_number(self, id_):
-        serial = _ASI_SN()
-        r = zwolib.ASIGetSerialNumber(id_, serial)
-        if r:
-            raise zwo_errors[r]
-        return serial.get_serial_number()
+        if not getattr(self, 'closed', True):  # Construction may have failed before the camera was opened
+            self.close()
+
+    def get_serial_number(self, id_=None):
+        if id_ is None:
+            id_ = self.id
+        return _get_serial_number(id_)
             
     def get_camera_property(self):
-        return _get_camera_property(self.id)
+        """Retrieves the camera properties. Type :class:`dict`.
+
+        The properties are read once when the camera is opened; a copy of the cached values is returned."""
+        return dict(self._camera_info)
 
     def get_num_controls(self):
         return _get_num_controls(self.id)
@@ -436,17 +739,30 @@ class Camera(object):
         return _get_roi_format(self.id)
 
     def set_roi_format(self, width, height, bins, image_type):
-        _set_roi_format(self.id, width, height, bins, image_type)
+        _set_roi_format(self.id, width, height, bins, image_type, self._camera_info)
+        self._frame_metadata.clear()
 
     def get_roi_start_position(self):
         return _get_start_position(self.id)
         
     def set_roi_start_position(self, start_x, start_y):
         _set_start_position(self.id, start_x, start_y)
+        self._frame_metadata.clear()
 
     def get_dropped_frames(self):
         return _get_dropped_frames(self.id)
 
+    def get_frame_sequence(self):
+        """Retrieves the sequence number of the most recently captured frame, as used for :attr:`Frame.sequence`.
+        Type :class:`int`."""
+        return self._frame_sequence
+
+    def next_frame_sequence(self):
+        """Advances the frame sequence number for a frame captured with the low-level exposure or video functions,
+        so that it is numbered consistently with those from the capture methods. Type :class:`int`."""
+        self._frame_sequence += 1
+        return self._frame_sequence
+
     def get_camera_support_mode(self):
         return _get_camera_support_mode(self.id)
 
@@ -473,6 +789,7 @@ class Camera(object):
             _close_camera(self.id)
         finally:
             self.closed = True
+            _registry._open.discard(self.id)
 
     def get_roi(self):
         """Retrieves the region of interest (ROI).
@@ -530,8 +847,16 @@ class Camera(object):
     def get_control_value(self, control_type):
         return _get_control_value(self.id, control_type)
 
+    def convert_image(self, img, right_justify=False, normalize=False, rgb=False, out=None):
+        """Convert an image captured by this camera. Type :class:`numpy.ndarray`.
+
+        See :func:`zwoasi.convert_image()`; the bit depth is taken from the camera properties."""
+        return convert_image(img, self._camera_info['BitDepth'], right_justify, normalize, rgb, out)
+
     def set_control_value(self, control_type, value, auto=False):
         _set_control_value(self.id, control_type, value, auto)
+        if control_type in (ASI_EXPOSURE, ASI_GAIN):
+            self._frame_metadata.clear()
     
     def get_bin(self):
         """Retrieves the pixel binning. Type :class:`int`.
@@ -562,20 +887,28 @@ class Camera(object):
         """Enable video capture mode.
 
         Retrieve video frames with :func:`capture_video_frame()`."""
-        return _start_video_capture(self.id)
+        r = _start_video_capture(self.id)
+        self._last_dropped_frames = 0  # The SDK resets its counter when video capture starts
+        self._frame_metadata.pop(True, None)
+        self.video_active = True
+        return r
     
     def stop_video_capture(self):
         """Leave video capture mode."""
-        return _stop_video_capture(self.id)
+        r = _stop_video_capture(self.id)
+        self.video_active = False
+        return r
 
     def get_video_data(self, timeout=None, buffer_=None):
         """Retrieve a single video frame. Type :class:`bytearray`.
 
         Low-level function to retrieve data. See :func:`capture_video_frame()` for a more convenient method to
-        acquire an image (and optionally save it)."""
+        acquire an image (and optionally save it). Each frame retrieved increments :attr:`video_frames`."""
         if timeout is None:
             timeout = self.default_timeout
-        return _get_video_data(self.id, timeout, buffer_)
+        data = _get_video_data(self.id, timeout, buffer_)
+        self.video_frames += 1
+        return data
 
     def pulse_guide_on(self, direction):
         _pulse_guide_on(self.id, direction)
@@ -601,8 +934,21 @@ class Camera(object):
         self.set_roi_format(*whbi)
 
     def capture(self, initial_sleep=0.01, poll=0.01, buffer_=None,
-                filename=None):
-        """Capture a still image. Type :class:`numpy.ndarray`."""
+                filename=None, metadata=False):
+        """Capture a still image. Type :class:`numpy.ndarray`.
+
+        If `metadata` is true a :class:`Frame` is returned instead; its ``monotonic_start`` timestamp is taken
+        immediately before the exposure is started and ``monotonic_end`` immediately after the image data has been
+        transferred."""
+        whbi = self.get_roi_format()
+        if buffer_ is None:
+            buffer_ = bytearray(buffer_size(whbi))
+        hooks = bool(self._hooks)  # Decided once, so that hooks added during the capture cannot unbalance it
+        if hooks:
+            info = {'sequence': self._frame_sequence + 1, 'mode': 'still', 'whbi': whbi, 'filename': filename}
+            self._run_hooks(HOOK_EXPOSURE_START, info)
+        if metadata:
+            t_start = time.monotonic()
         self.start_exposure()
         if initial_sleep:
             time.sleep(initial_sleep)
@@ -614,68 +960,278 @@ class Camera(object):
         status = self.get_exposure_status()
         if status != ASI_EXP_SUCCESS:
             raise ZWO_CaptureError('Could not capture image', status)
-        
+        if hooks:
+            self._run_hooks(HOOK_EXPOSURE_END, info)
+            self._run_hooks(HOOK_TRANSFER_START, info)
+
         data = self.get_data_after_exposure(buffer_)
-        whbi = self.get_roi_format()
-        shape = [whbi[1], whbi[0]]
-        if whbi[3] == ASI_IMG_RAW8 or whbi[3] == ASI_IMG_Y8:
-            img = np.frombuffer(data, dtype=np.uint8)
-        elif whbi[3] == ASI_IMG_RAW16:
-            img = np.frombuffer(data, dtype=np.uint16)
-        elif whbi[3] == ASI_IMG_RGB24:
-            img = np.frombuffer(data, dtype=np.uint8)
-            shape.append(3)
-        else:
-            raise ValueError('Unsupported image type')
-        img = img.reshape(shape)
+        if metadata:
+            t_end = time.monotonic()
+            wall_clock = time.time()
+        if hooks:
+            self._run_hooks(HOOK_TRANSFER_END, info)
+        img = image_from_buffer(data, whbi)
+        self._frame_sequence += 1
+        if hooks:
+            self._run_hooks(HOOK_CONVERT_END, info)
 
         if filename is not None:
-            from PIL import Image
-            mode = None
-            if len(img.shape) == 3:
-                img = img[:, :, ::-1]  # Convert BGR to RGB
-            if whbi[3] == ASI_IMG_RAW16:
-                mode = 'I;16'
-            image = Image.fromarray(img, mode=mode)
-            image.save(filename)
-            logger.debug('wrote %s', filename)
+            save_image(img, whbi[3], filename)
+            if hooks:
+                self._run_hooks(HOOK_SAVE_END, info)
+        if metadata:
+            return self._make_frame(img, whbi, t_start, t_end, wall_clock, False)
         return img
 
-    def capture_video_frame(self, buffer_=None, filename=None, timeout=None):
+    def capture_video_frame(self, buffer_=None, filename=None, timeout=None, metadata=False):
         """Capture a single frame from video. Type :class:`numpy.ndarray`.
 
         Video mode must have been started previously otherwise a :class:`ZWO_Error` will be raised. A new buffer
-        will be used to store the image unless one has been supplied with the `buffer` keyword argument.
+        will be used to store the image unless one has been supplied with the `buffer` keyword argument; this may be
+        a :class:`bytearray` or a writable :class:`memoryview`, for instance of shared memory.
         If `filename` is not ``None`` the image is saved using :py:meth:`PIL.Image.Image.save()`.
         :func:`capture_video_frame()` will wait indefinitely unless a `timeout` has been given.
-        The SDK suggests that the `timeout` value, in milliseconds, should be twice the exposure plus 500 ms."""
-        data = self.get_video_data(buffer_=buffer_, timeout=timeout)
+        The SDK suggests that the `timeout` value, in milliseconds, should be twice the exposure plus 500 ms.
+
+        If `metadata` is true a :class:`Frame` is returned instead, with timestamps taken immediately before and
+        after the call to ``ASIGetVideoData``. The ROI start position, exposure and gain are read with the first such
+        frame and reused until they are changed through this object (see :class:`FrameMetadata`), so that only the
+        dropped frame count is read for each frame."""
         whbi = self.get_roi_format()
-        shape = [whbi[1], whbi[0]]
-        if whbi[3] == ASI_IMG_RAW8 or whbi[3] == ASI_IMG_Y8:
-            img = np.frombuffer(data, dtype=np.uint8)
-        elif whbi[3] == ASI_IMG_RAW16:
-            img = np.frombuffer(data, dtype=np.uint16)
-        elif whbi[3] == ASI_IMG_RGB24:
-            img = np.frombuffer(data, dtype=np.uint8)
-            shape.append(3)
-        else:
-            raise ValueError('Unsupported image type')
-        img = img.reshape(shape)
+        if buffer_ is None:
+            buffer_ = bytearray(buffer_size(whbi))
+        hooks = bool(self._hooks)  # Decided once, so that hooks added during the capture cannot unbalance it
+        if hooks:
+            info = {'sequence': self._frame_sequence + 1, 'mode': 'video', 'whbi': whbi, 'filename': filename}
+            self._run_hooks(HOOK_TRANSFER_START, info)
+        if metadata:
+            t_start = time.monotonic()
+        data = self.get_video_data(buffer_=buffer_, timeout=timeout)
+        if metadata:
+            t_end = time.monotonic()
+            wall_clock = time.time()
+        if hooks:
+            self._run_hooks(HOOK_TRANSFER_END, info)
+        img = image_from_buffer(data, whbi)
+        self._frame_sequence += 1
+        if hooks:
+            self._run_hooks(HOOK_CONVERT_END, info)
 
         if filename is not None:
-            from PIL import Image
-            mode = None
-            if len(img.shape) == 3:
-                img = img[:, :, ::-1]  # Convert BGR to RGB
-            if whbi[3] == ASI_IMG_RAW16:
-                mode = 'I;16'
-            image = Image.fromarray(img, mode=mode)
-            image.save(filename)
-            logger.debug('wrote %s', filename)
-
+            save_image(img, whbi[3], filename)
+            if hooks:
+                self._run_hooks(HOOK_SAVE_END, info)
+        if metadata:
+            return self._make_frame(img, whbi, t_start, t_end, wall_clock, True)
         return img
 
+    def add_hook(self, event, func):
+        """Register a callback for a point in the capture path.
+
+        `event` is one of ``HOOK_EXPOSURE_START``, ``HOOK_EXPOSURE_END``, ``HOOK_TRANSFER_START``,
+        ``HOOK_TRANSFER_END``, ``HOOK_CONVERT_END`` or ``HOOK_SAVE_END``. The callback is called as
+        ``func(camera, event, timestamp, info)`` where `timestamp` is from :func:`time.monotonic()` and `info` is a
+        :class:`dict` describing the frame being captured. The same `info` object is passed to every callback for a
+        given frame. Exposure hooks are only called for still images. Callbacks run synchronously in the capturing
+        thread so should return quickly; when no hooks are registered the capture path is unchanged."""
+        if event not in _hook_events:
+            raise ValueError('Unknown hook event %s' % repr(event))
+        self._hooks.setdefault(event, []).append(func)
+
+    def remove_hook(self, event, func):
+        """Unregister a callback previously registered with :func:`add_hook()`."""
+        funcs = self._hooks.get(event, [])
+        funcs.remove(func)
+        if not funcs:
+            del self._hooks[event]
+
+    def _run_hooks(self, event, info):
+        funcs = self._hooks.get(event)
+        if funcs:
+            t = time.monotonic()
+            for func in funcs:
+                func(self, event, t, info)
+
+    def capture_sequence(self, n, initial_sleep=0.01, poll=0.01, buffers=3, is_dark=False, metadata=False):
+        """Capture a sequence of `n` still images. Generator of :class:`numpy.ndarray`.
+
+        The exposures are pipelined: a background thread starts the next exposure as soon as the data from the
+        previous one has been retrieved, so that the sensor is exposing while the caller processes the previous
+        image. Images are stored in a pool of `buffers` preallocated buffers which are recycled; each image yielded
+        is only valid until the next image is requested and must be copied if it is to be kept. If the caller is
+        slower than the camera the background thread waits for a free buffer.
+
+        If `metadata` is true :class:`Frame` objects are yielded instead, with ``monotonic_start`` taken immediately
+        before each exposure was started. The ROI, image type and controls must not be altered while the sequence
+        is in progress."""
+        import queue
+        import threading
+
+        if n < 1:
+            raise ValueError('At least one image is required')
+        if buffers < 2:
+            raise ValueError('At least two buffers are required')
+        whbi = self.get_roi_format()
+        sz = buffer_size(whbi)
+        free = queue.Queue()
+        for i in range(buffers):
+            free.put(bytearray(sz))
+        ready = queue.Queue()
+        stop = threading.Event()
+        if metadata:
+            frame_metadata = FrameMetadata(self, whbi, video=False)
+        first_sequence = self._frame_sequence + 1
+
+        def new_info(sequence):
+            # Each frame has its own info so that hooks storing per-frame state in it do not overwrite each other
+            return {'sequence': sequence, 'mode': 'sequence', 'whbi': whbi, 'filename': None}
+
+        def acquire():
+            try:
+                info = None
+                if self._hooks:
+                    info = new_info(first_sequence)
+                    self._run_hooks(HOOK_EXPOSURE_START, info)
+                t_start = time.monotonic()
+                self.start_exposure(is_dark)
+                for i in range(n):
+                    if initial_sleep:
+                        time.sleep(initial_sleep)
+                    while self.get_exposure_status() == ASI_EXP_WORKING:
+                        if stop.is_set():
+                            return
+                        if poll:
+                            time.sleep(poll)
+                    status = self.get_exposure_status()
+                    if status != ASI_EXP_SUCCESS:
+                        raise ZWO_CaptureError('Could not capture image', status)
+                    buf = free.get()
+                    if stop.is_set():
+                        return
+                    if info is not None:
+                        self._run_hooks(HOOK_EXPOSURE_END, info)
+                        self._run_hooks(HOOK_TRANSFER_START, info)
+                    self.get_data_after_exposure(buf)
+                    t_end = time.monotonic()
+                    wall_clock = time.time()
+                    this_info = info
+                    if i + 1 < n:
+                        # Restart the sensor before handing the data over
+                        if this_info is not None:
+                            info = new_info(first_sequence + i + 1)
+                            self._run_hooks(HOOK_EXPOSURE_START, info)
+                        t_next = time.monotonic()
+                        self.start_exposure(is_dark)
+                    if this_info is not None:
+                        self._run_hooks(HOOK_TRANSFER_END, this_info)
+                    ready.put((buf, t_start, t_end, wall_clock, this_info))
+                    if i + 1 < n:
+                        t_start = t_next
+            except Exception as e:
+                ready.put(e)
+                return
+            ready.put(None)
+
+        thread = threading.Thread(target=acquire, name='zwoasi-sequence-%d' % self.id)
+        thread.daemon = True
+        thread.start()
+        previous = None
+        try:
+            while True:
+                item = ready.get()
+                if previous is not None:
+                    free.put(previous)
+                    previous = None
+                if item is None:
+                    break
+                elif isinstance(item, Exception):
+                    raise item
+                buf, t_start, t_end, wall_clock, info = item
+                img = image_from_buffer(buf, whbi)
+                self._frame_sequence += 1
+                if info is not None:
+                    self._run_hooks(HOOK_CONVERT_END, info)
+                previous = buf
+                if metadata:
+                    yield frame_metadata.frame(img, t_start, t_end, wall_clock)
+                else:
+                    yield img
+        finally:
+            if thread.is_alive():
+                stop.set()
+                free.put(bytearray(sz))  # Release the thread if it is waiting for a buffer
+                thread.join()
+                try:
+                    self.stop_exposure()
+                except ZWO_Error:
+                    logger.debug(traceback.format_exc())
+
+    def capture_bracket(self, exposures, gains=None, merge=True, saturation=None, initial_sleep=0.01, poll=0.01):
+        """Capture an exposure bracket of still images.
+
+        `exposures` is a sequence of exposure times in microseconds and `gains` an optional sequence, of the same
+        length, of ``ASI_GAIN`` values; if omitted the current gain is used throughout. The ``ASI_EXPOSURE`` and
+        ``ASI_GAIN`` controls are only changed when they differ from the previous step, and are restored afterwards.
+
+        If `merge` is true the images are merged as they arrive into a high dynamic range image, returned as a
+        :class:`numpy.ndarray` of ``float32`` in ADU per second at unity gain; see :class:`zwoasi.hdr.HDRMerger`.
+        Only one capture buffer is used. Otherwise a :class:`list` of the images is returned."""
+        from zwoasi.hdr import HDRMerger
+
+        if not len(exposures):
+            raise ValueError('At least one exposure is required')
+        if gains is None:
+            gains = [None] * len(exposures)
+        elif len(gains) != len(exposures):
+            raise ValueError('exposures and gains must have the same length')
+        whbi = self.get_roi_format()
+        sz = buffer_size(whbi)
+        original = [self.get_control_value(ASI_EXPOSURE), self.get_control_value(ASI_GAIN)]
+        current_exposure, auto_exposure = original[0]
+        current_gain, auto_gain = original[1]
+
+        merger = None
+        if merge:
+            max_value = 65535 if whbi[3] == ASI_IMG_RAW16 else 255
+            buffers = [bytearray(sz)] * len(exposures)
+        else:
+            buffers = [bytearray(sz) for i in range(len(exposures))]
+        images = []
+        try:
+            for exposure, gain, buffer_ in zip(exposures, gains, buffers):
+                if exposure != current_exposure or auto_exposure:
+                    self.set_control_value(ASI_EXPOSURE, int(exposure))
+                    current_exposure, auto_exposure = exposure, False
+                if gain is None:
+                    gain = current_gain
+                elif gain != current_gain or auto_gain:
+                    self.set_control_value(ASI_GAIN, int(gain))
+                    current_gain, auto_gain = gain, False
+                img = self.capture(initial_sleep=initial_sleep, poll=poll, buffer_=buffer_)
+                if merge:
+                    if merger is None:
+                        merger = HDRMerger(img.shape, max_value, saturation)
+                    merger.add(img, exposure / 1e6, gain)
+                else:
+                    images.append(img)
+        finally:
+            self.set_control_value(ASI_EXPOSURE, original[0][0], original[0][1])
+            self.set_control_value(ASI_GAIN, original[1][0], original[1][1])
+        if merge:
+            return merger.result()
+        return images
+
+    def _make_frame(self, img, whbi, t_start, t_end, wall_clock, video):
+        # Settings are read once and reused until changed through this object; see FrameMetadata
+        metadata = self._frame_metadata.get(video)
+        if metadata is None or metadata.whbi != whbi:
+            metadata = FrameMetadata(self, whbi, video, self._last_dropped_frames if video else None)
+            self._frame_metadata[video] = metadata
+        frame = metadata.frame(img, t_start, t_end, wall_clock)
+        if video:
+            self._last_dropped_frames = metadata.dropped_frames
+        return frame
+
     def get_control_values(self):
         controls = self.get_controls()
         r = {}
@@ -803,151 +1359,130 @@ class _ASI_SUPPORTED_MODE(c.Structure):
         return base_dict
 
 
+# Argument and return types of the SDK functions, applied by _LazyLibrary when each function is first used
+_prototypes = {
+    'ASIGetSerialNumber': ([c.c_int, c.POINTER(_ASI_SN)], c.c_int),
+    'ASIGetNumOfConnectedCameras': ([], c.c_int),
+    'ASIGetCameraProperty': ([c.POINTER(_ASI_CAMERA_INFO), c.c_int], c.c_int),
+    'ASIOpenCamera': ([c.c_int], c.c_int),
+    'ASIInitCamera': ([c.c_int], c.c_int),
+    'ASICloseCamera': ([c.c_int], c.c_int),
+    'ASIGetNumOfControls': ([c.c_int, c.POINTER(c.c_int)], c.c_int),
+    'ASIGetControlCaps': ([c.c_int, c.c_int, c.POINTER(_ASI_CONTROL_CAPS)], c.c_int),
+    'ASIGetControlValue': ([c.c_int, c.c_int, c.POINTER(c.c_long), c.POINTER(c.c_int)], c.c_int),
+    'ASISetControlValue': ([c.c_int, c.c_int, c.c_long, c.c_int], c.c_int),
+    'ASIGetROIFormat': ([c.c_int, c.POINTER(c.c_int), c.POINTER(c.c_int), c.POINTER(c.c_int), c.POINTER(c.c_int)],
+                        c.c_int),
+    'ASISetROIFormat': ([c.c_int, c.c_int, c.c_int, c.c_int, c.c_int], c.c_int),
+    'ASIGetStartPos': ([c.c_int, c.POINTER(c.c_int), c.POINTER(c.c_int)], c.c_int),
+    'ASISetStartPos': ([c.c_int, c.c_int, c.c_int], c.c_int),
+    'ASIGetDroppedFrames': ([c.c_int, c.POINTER(c.c_int)], c.c_int),
+    'ASIEnableDarkSubtract': ([c.c_int, c.POINTER(c.c_char)], c.c_int),
+    'ASIDisableDarkSubtract': ([c.c_int], c.c_int),
+    'ASIStartVideoCapture': ([c.c_int], c.c_int),
+    'ASIStopVideoCapture': ([c.c_int], c.c_int),
+    'ASIGetVideoData': ([c.c_int, c.POINTER(c.c_char), c.c_long, c.c_int], c.c_int),
+    'ASIPulseGuideOn': ([c.c_int, c.c_int], c.c_int),
+    'ASIPulseGuideOff': ([c.c_int, c.c_int], c.c_int),
+    'ASIStartExposure': ([c.c_int, c.c_int], c.c_int),
+    'ASIStopExposure': ([c.c_int], c.c_int),
+    'ASIGetExpStatus': ([c.c_int, c.POINTER(c.c_int)], c.c_int),
+    'ASIGetDataAfterExp': ([c.c_int, c.POINTER(c.c_char), c.c_long], c.c_int),
+    'ASIGetID': ([c.c_int, c.POINTER(_ASI_ID)], c.c_int),
+    'ASISetID': ([c.c_int, _ASI_ID], c.c_int),
+    'ASIGetGainOffset': ([c.c_int, c.POINTER(c.c_int), c.POINTER(c.c_int), c.POINTER(c.c_int), c.POINTER(c.c_int)],
+                         c.c_int),
+    'ASISetCameraMode': ([c.c_int, c.c_int], c.c_int),
+    'ASIGetCameraMode': ([c.c_int, c.POINTER(c.c_int)], c.c_int),
+    'ASIGetCameraSupportMode': ([c.c_int, c.POINTER(_ASI_SUPPORTED_MODE)], c.c_int),
+    'ASISendSoftTrigger': ([c.c_int, c.c_int], c.c_int),
+    'ASISetTriggerOutputIOConf': ([c.c_int, c.c_int, c.c_int, c.c_long, c.c_long], c.c_int),
+    'ASIGetTriggerOutputIOConf': ([c.c_int, c.c_int, c.POINTER(c.c_int), c.POINTER(c.c_long), c.POINTER(c.c_long)],
+                                  c.c_int),
+}
+
+
+class _LazyLibrary(object):
+    """Wrapper for the SDK library which defers loading the library until it is first needed, and resolves and
+    types each function on first use."""
+    def __init__(self):
+        self._library = None
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if self._library is None:
+            init()
+        func = getattr(self._library, name)
+        if name in _prototypes and isinstance(self._library, c.CDLL):
+            # Objects given to init() in place of the SDK provide ordinary Python callables, which take no prototype
+            func.argtypes, func.restype = _prototypes[name]
+        # Cache so that subsequent lookups do not pass through __getattr__
+        setattr(self, name, func)
+        return func
+
+
+class _LibraryProxy(object):
+    """Base class for objects which replace :data:`zwolib` and intercept every ``ASI*`` call of `library`.
+
+    Subclasses implement ``_call(name, func, args)``, which must call ``func(*args)`` and return its result."""
+    def __init__(self, library):
+        self._library = library
+
+    def __getattr__(self, name):
+        func = getattr(self._library, name)
+        if not name.startswith('ASI'):
+            return func
+
+        def wrapper(*args):
+            return self._call(name, func, args)
+
+        wrapper.__name__ = name
+        # Cache so that subsequent lookups do not pass through __getattr__
+        setattr(self, name, wrapper)
+        return wrapper
+
+    def _call(self, name, func, args):
+        raise NotImplementedError
+
+
+def _camera_id(name, args):
+    # Camera ID argument of an SDK call: its position differs for ASIGetCameraProperty and it is absent for the
+    # camera count
+    if name == 'ASIGetNumOfConnectedCameras':
+        return None
+    elif name == 'ASIGetCameraProperty':
+        return args[1] if len(args) > 1 else None
+    return args[0] if args else None
+
+
 def init(library_file=None):
-    global zwolib
+    """Load the ASI SDK library.
+
+    If `library_file` is ``None`` the library is located with :func:`ctypes.util.find_library()`. Calling
+    :func:`init()` is optional; the library is loaded automatically the first time it is used. Once loaded
+    subsequent calls have no effect.
+
+    `library_file` may instead be an object providing the SDK functions, such as
+    :class:`zwoasi.replay.ReplayLibrary`, which is then used in place of the SDK library. It must be given before the
+    library is first used."""
+    if library_file is not None and not isinstance(library_file, (str, bytes, os.PathLike)):
+        if _sdk._library is not None:
+            raise ZWO_Error('ASI SDK library already loaded')
+        _sdk._library = library_file
+        return
 
-    if zwolib is not None:
-        return # Library already initialized. do nothing
+    if _sdk._library is not None:
+        return  # Library already initialized. do nothing
 
     if library_file is None:
+        from ctypes.util import find_library  # Deferred, it is slow to import
         library_file = find_library('ASICamera2')
 
     if library_file is None:
         raise ZWO_Error('ASI SDK library not found')
 
-    zwolib = c.cdll.LoadLibrary(library_file)
-
-    zwolib.ASIGetSerialNumber.argtypes = [c.c_int, c.POINTER(_ASI_SN)]
-    zwolib.ASIGetSerialNumber.restype = c.c_int
-
-    zwolib.ASIGetNumOfConnectedCameras.argtypes = []
-    zwolib.ASIGetNumOfConnectedCameras.restype = c.c_int
-
-    zwolib.ASIGetCameraProperty.argtypes = [c.POINTER(_ASI_CAMERA_INFO), c.c_int]
-    zwolib.ASIGetCameraProperty.restype = c.c_int
-
-    zwolib.ASIOpenCamera.argtypes = [c.c_int]
-    zwolib.ASIOpenCamera.restype = c.c_int
-
-    zwolib.ASIInitCamera.argtypes = [c.c_int]
-    zwolib.ASIInitCamera.restype = c.c_int
-
-    zwolib.ASICloseCamera.argtypes = [c.c_int]
-    zwolib.ASICloseCamera.restype = c.c_int
-
-    zwolib.ASIGetNumOfControls.argtypes = [c.c_int, c.POINTER(c.c_int)]
-    zwolib.ASIGetNumOfControls.restype = c.c_int
-
-    zwolib.ASIGetControlCaps.argtypes = [c.c_int, c.c_int,
-                                         c.POINTER(_ASI_CONTROL_CAPS)]
-    zwolib.ASIGetControlCaps.restype = c.c_int
-
-    zwolib.ASIGetControlValue.argtypes = [c.c_int,
-                                          c.c_int,
-                                          c.POINTER(c.c_long),
-                                          c.POINTER(c.c_int)]
-    zwolib.ASIGetControlValue.restype = c.c_int
-
-    zwolib.ASISetControlValue.argtypes = [c.c_int, c.c_int, c.c_long, c.c_int]
-    zwolib.ASISetControlValue.restype = c.c_int
-
-    zwolib.ASIGetROIFormat.argtypes = [c.c_int,
-                                       c.POINTER(c.c_int),
-                                       c.POINTER(c.c_int),
-                                       c.POINTER(c.c_int),
-                                       c.POINTER(c.c_int)]
-    zwolib.ASIGetROIFormat.restype = c.c_int
-
-    zwolib.ASISetROIFormat.argtypes = [c.c_int, c.c_int, c.c_int, c.c_int, c.c_int]
-    zwolib.ASISetROIFormat.restype = c.c_int
-
-    zwolib.ASIGetStartPos.argtypes = [c.c_int,
-                                      c.POINTER(c.c_int),
-                                      c.POINTER(c.c_int)]
-    zwolib.ASIGetStartPos.restype = c.c_int
-
-    zwolib.ASISetStartPos.argtypes = [c.c_int, c.c_int, c.c_int]
-    zwolib.ASISetStartPos.restype = c.c_int
-
-    zwolib.ASIGetDroppedFrames.argtypes = [c.c_int, c.POINTER(c.c_int)]
-    zwolib.ASIGetDroppedFrames.restype = c.c_int
-
-    zwolib.ASIEnableDarkSubtract.argtypes = [c.c_int, c.POINTER(c.c_char)]
-    zwolib.ASIEnableDarkSubtract.restype = c.c_int
-
-    zwolib.ASIDisableDarkSubtract.argtypes = [c.c_int]
-    zwolib.ASIDisableDarkSubtract.restype = c.c_int
-
-    zwolib.ASIStartVideoCapture.argtypes = [c.c_int]
-    zwolib.ASIStartVideoCapture.restype = c.c_int
-
-    zwolib.ASIStopVideoCapture.argtypes = [c.c_int]
-    zwolib.ASIStopVideoCapture.restype = c.c_int
-
-    zwolib.ASIGetVideoData.argtypes = [c.c_int,
-                                       c.POINTER(c.c_char),
-                                       c.c_long,
-                                       c.c_int]
-    zwolib.ASIGetVideoData.restype = c.c_int
-
-    zwolib.ASIPulseGuideOn.argtypes = [c.c_int, c.c_int]
-    zwolib.ASIPulseGuideOn.restype = c.c_int
-
-    zwolib.ASIPulseGuideOff.argtypes = [c.c_int, c.c_int]
-    zwolib.ASIPulseGuideOff.restype = c.c_int
-
-    zwolib.ASIStartExposure.argtypes = [c.c_int, c.c_int]
-    zwolib.ASIStartExposure.restype = c.c_int
-
-    zwolib.ASIStopExposure.argtypes = [c.c_int]
-    zwolib.ASIStopExposure.restype = c.c_int
-
-    zwolib.ASIGetExpStatus.argtypes = [c.c_int, c.POINTER(c.c_int)]
-    zwolib.ASIGetExpStatus.restype = c.c_int
-
-    zwolib.ASIGetDataAfterExp.argtypes = [c.c_int, c.POINTER(c.c_char), c.c_long]
-    zwolib.ASIGetDataAfterExp.restype = c.c_int
-
-    zwolib.ASIGetID.argtypes = [c.c_int, c.POINTER(_ASI_ID)]
-    zwolib.ASIGetID.restype = c.c_int
-
-    zwolib.ASISetID.argtypes = [c.c_int, _ASI_ID]
-    zwolib.ASISetID.restype = c.c_int
-
-
-    zwolib.ASIGetGainOffset.argtypes = [c.c_int,
-                                        c.POINTER(c.c_int),
-                                        c.POINTER(c.c_int),
-                                        c.POINTER(c.c_int),
-                                        c.POINTER(c.c_int)]
-    zwolib.ASIGetGainOffset.restype = c.c_int
-
-    zwolib.ASISetCameraMode.argtypes = [c.c_int, c.c_int]
-    zwolib.ASISetCameraMode.restype = c.c_int
-
-    zwolib.ASIGetCameraMode.argtypes = [c.c_int, c.POINTER(c.c_int)]
-    zwolib.ASIGetCameraMode.restype = c.c_int
-
-    zwolib.ASIGetCameraSupportMode.argtypes = [c.c_int, c.POINTER(_ASI_SUPPORTED_MODE)]
-    zwolib.ASIGetCameraSupportMode.restype = c.c_int
-
-    zwolib.ASISendSoftTrigger.argtypes = [c.c_int, c.c_int]
-    zwolib.ASISendSoftTrigger.restype = c.c_int
-
-    zwolib.ASISetTriggerOutputIOConf.argtypes = [c.c_int,
-                                                 c.c_int,
-                                                 c.c_int,
-                                                 c.c_long,
-                                                 c.c_long]
-    zwolib.ASISetTriggerOutputIOConf.restype = c.c_int
-
-    zwolib.ASIGetTriggerOutputIOConf.argtypes = [c.c_int,
-                                                 c.c_int,
-                                                 c.POINTER(c.c_int),
-                                                 c.POINTER(c.c_long),
-                                                 c.POINTER(c.c_long)]
-    zwolib.ASIGetTriggerOutputIOConf.restype = c.c_int
-
+    _sdk._library = c.cdll.LoadLibrary(library_file)
 
 
 logger = logging.getLogger(__name__)
@@ -1016,14 +1551,25 @@ ASI_EXP_WORKING = 1
 ASI_EXP_SUCCESS = 2
 ASI_EXP_FAILED = 3
 
+# Capture path hook events, see Camera.add_hook()
+HOOK_EXPOSURE_START = 'exposure_start'
+HOOK_EXPOSURE_END = 'exposure_end'
+HOOK_TRANSFER_START = 'transfer_start'
+HOOK_TRANSFER_END = 'transfer_end'
+HOOK_CONVERT_END = 'convert_end'
+HOOK_SAVE_END = 'save_end'
+
+_hook_events = (HOOK_EXPOSURE_START, HOOK_EXPOSURE_END, HOOK_TRANSFER_START, HOOK_TRANSFER_END,
+                HOOK_CONVERT_END, HOOK_SAVE_END)
+
 
 # Mapping of error numbers to exceptions. Zero is used for success.
 zwo_errors = [None,
               ZWO_IOError('Invalid index', 1),
-              ZWO_IOError('Invalid ID', 2),
+              ZWO_CameraRemovedError('Invalid ID', 2),
               ZWO_IOError('Invalid control type', 3),
-              ZWO_IOError('Camera closed', 4),
-              ZWO_IOError('Camera removed', 5),
+              ZWO_CameraRemovedError('Camera closed', 4),
+              ZWO_CameraRemovedError('Camera removed', 5),
               ZWO_IOError('Invalid path', 6),
               ZWO_IOError('Invalid file format', 7),
               ZWO_IOError('Invalid size', 8),
@@ -1038,8 +1584,6 @@ zwo_errors = [None,
               ZWO_IOError('Invalid mode', 17)
               ]
 
-zwolib = None
-try:
-    init() # Initialize library on import, will only run once.
-except ZWO_Error as e:
-    logging.warning(str(e))
+# The SDK library is loaded on first use so that importing zwoasi is fast
+_sdk = _LazyLibrary()
+zwolib = _sdk
@@ -0,0 +1,290 @@
+"""Command line interface to :mod:`zwoasi`.
+
+Lists cameras, captures still images, records video to SER, raw or archive files, reports live frame rate and
+dropped frame statistics, and runs benchmarks. Run ``python -m zwoasi --help`` for usage. The SDK library is taken
+from the ``--sdk-lib`` option or the ``ZWO_ASI_LIB`` environment variable if set."""
+
+import argparse
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+
+import zwoasi
+import zwoasi.benchmark
+
+__author__ = 'Steve Marple'
+__license__ = 'MIT'
+
+logger = logging.getLogger('zwoasi')
+
+image_types = {'raw8': zwoasi.ASI_IMG_RAW8,
+               'raw16': zwoasi.ASI_IMG_RAW16,
+               'rgb24': zwoasi.ASI_IMG_RGB24,
+               'y8': zwoasi.ASI_IMG_Y8}
+
+
+def _open_camera(args):
+    camera = zwoasi.Camera(int(args.camera) if args.camera.isdigit() else args.camera)
+    if args.roi or args.bins or args.image_type:
+        x, y, w, h = args.roi if args.roi else (None, None, None, None)
+        camera.set_roi(x, y, w, h, bins=args.bins,
+                       image_type=image_types[args.image_type] if args.image_type else None)
+    controls = camera.get_controls()
+    for name, control_type, value in (('Exposure', zwoasi.ASI_EXPOSURE, args.exposure),
+                                      ('Gain', zwoasi.ASI_GAIN, args.gain),
+                                      ('BandWidth', zwoasi.ASI_BANDWIDTHOVERLOAD, args.bandwidth),
+                                      ('HighSpeedMode', zwoasi.ASI_HIGH_SPEED_MODE, args.high_speed)):
+        if value is None:
+            continue
+        if name not in controls:
+            logger.warning('camera does not support %s', name)
+            continue
+        camera.set_control_value(control_type, int(value))
+    return camera
+
+
+def _numbered_filename(filename, n):
+    if '%' in filename:
+        return filename % n
+    root, ext = os.path.splitext(filename)
+    return '%s_%04d%s' % (root, n, ext)
+
+
+def cmd_list(args):
+    n = zwoasi.get_num_cameras()
+    if n == 0:
+        print('No cameras found')
+        return 1
+    for i in range(n):
+        info = zwoasi.get_camera_info(i, identify=True)
+        prop = info['property']
+        print('%d: %s %dx%d %s %d bit, serial %s, id %s'
+              % (i, prop['Name'], prop['MaxWidth'], prop['MaxHeight'], 'colour' if prop['IsColorCam'] else 'mono',
+                 prop['BitDepth'], info['serial'], repr(info['user_id'])))
+    return 0
+
+
+def cmd_capture(args):
+    camera = _open_camera(args)
+    try:
+        image_type = camera.get_image_type()
+        t0 = time.monotonic()
+        if args.count == 1:
+            camera.capture(filename=args.filename)
+        else:
+            for n, img in enumerate(camera.capture_sequence(args.count)):
+                zwoasi.save_image(img, image_type, _numbered_filename(args.filename, n))
+        elapsed = time.monotonic() - t0
+    finally:
+        camera.close()
+    print('Captured %d image(s) in %.3f s' % (args.count, elapsed), file=sys.stderr)
+    return 0
+
+
+def _video(camera, args, sink=None):
+    """Capture video at the maximum rate, passing each raw buffer and timestamp to `sink` in a writer thread.
+
+    Progress is printed every ``args.interval`` seconds. Returns a :class:`dict` of statistics."""
+    whbi = camera.get_roi_format()
+    sz = zwoasi.buffer_size(whbi)
+    exposure = camera.get_control_value(zwoasi.ASI_EXPOSURE)[0]
+    timeout = int(exposure / 1000) * 2 + 500
+    free = queue.Queue()
+    for i in range(args.buffers if sink else 1):
+        free.put(bytearray(sz))
+    ready = queue.Queue()
+    errors = []
+
+    def writer():
+        while True:
+            item = ready.get()
+            if item is None:
+                return
+            try:
+                sink(*item)
+            except Exception as e:
+                errors.append(e)
+            free.put(item[0])
+
+    thread = None
+    if sink is not None:
+        thread = threading.Thread(target=writer, name='zwoasi-cli-writer')
+        thread.start()
+
+    frames = 0
+    failures = 0
+    waits = 0.0
+    camera.start_video_capture()
+    t0 = time.monotonic()
+    last_report = t0
+    last_frames = 0
+    dropped = 0
+    try:
+        while not errors:
+            now = time.monotonic()
+            if (args.frames and frames >= args.frames) or (args.duration and now - t0 >= args.duration):
+                break
+            t = time.monotonic()
+            buffer_ = free.get()
+            waits += time.monotonic() - t
+            try:
+                camera.get_video_data(timeout=timeout, buffer_=buffer_)
+            except zwoasi.ZWO_IOError as e:
+                failures += 1
+                free.put(buffer_)
+                logger.debug('video frame failed: %s', e)
+                continue
+            frames += 1
+            if sink is None:
+                free.put(buffer_)
+            else:
+                ready.put((buffer_, time.time()))
+            if now - last_report >= args.interval:
+                dropped = camera.get_dropped_frames()
+                print('%6d frames  %7.2f fps  %8.2f MB/s  dropped %d  failed %d'
+                      % (frames, (frames - last_frames) / (now - last_report),
+                         (frames - last_frames) * sz / (now - last_report) / 1e6, dropped, failures),
+                      file=sys.stderr)
+                last_report = now
+                last_frames = frames
+    except KeyboardInterrupt:
+        pass
+    finally:
+        elapsed = time.monotonic() - t0
+        dropped = camera.get_dropped_frames()
+        camera.stop_video_capture()
+        if thread is not None:
+            ready.put(None)
+            thread.join()
+    if errors:
+        raise errors[0]
+    return {'frames': frames,
+            'elapsed': elapsed,
+            'fps': frames / elapsed if elapsed else 0.0,
+            'bytes_per_second': frames * sz / elapsed if elapsed else 0.0,
+            'dropped_frames': dropped,
+            'failed_frames': failures,
+            'buffer_wait': waits}
+
+
+def cmd_record(args):
+    camera = _open_camera(args)
+    ext = os.path.splitext(args.filename)[1].lower()
+    if ext == '.ser':
+        from zwoasi.ser import SerWriter
+        writer = SerWriter.for_camera(camera, args.filename)
+
+        def sink(buffer_, timestamp):
+            writer.write(buffer_, timestamp)
+    elif ext == '.zwa':
+        from zwoasi.archive import ArchiveWriter
+        whbi = camera.get_roi_format()
+        writer = ArchiveWriter(args.filename, metadata={'camera': camera.get_camera_property()['Name'],
+                                                        'roi_format': whbi})
+
+        def sink(buffer_, timestamp):
+            writer.write(zwoasi.image_from_buffer(buffer_, whbi), timestamp=timestamp)
+    else:
+        writer = open(args.filename, 'wb')
+
+        def sink(buffer_, timestamp):
+            writer.write(buffer_)
+    try:
+        results = _video(camera, args, sink)
+    finally:
+        writer.close()
+        camera.close()
+    zwoasi.benchmark.print_results('record', results)
+    return 0
+
+
+def cmd_stats(args):
+    camera = _open_camera(args)
+    try:
+        results = _video(camera, args)
+    finally:
+        camera.close()
+    zwoasi.benchmark.print_results('stats', results)
+    return 0
+
+
+def cmd_benchmark(args):
+    zwoasi.benchmark.print_results('startup', zwoasi.benchmark.startup_benchmark(args.repeat, args.sdk_lib))
+    if args.video:
+        if not zwoasi.get_num_cameras():
+            print('No cameras found, video benchmark skipped', file=sys.stderr)
+            return 0
+        args.duration = args.video
+        camera = _open_camera(args)
+        try:
+            zwoasi.benchmark.print_results('video', _video(camera, args))
+        finally:
+            camera.close()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m zwoasi', description='ZWO ASI camera utility')
+    parser.add_argument('--sdk-lib', default=os.getenv('ZWO_ASI_LIB'), help='ASI SDK library file')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Log debugging messages')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    camera_parser = argparse.ArgumentParser(add_help=False)
+    camera_parser.add_argument('-c', '--camera', default='0', help='Camera index, model, serial number or user ID')
+    camera_parser.add_argument('-e', '--exposure', type=int, help='Exposure time (microseconds)')
+    camera_parser.add_argument('-g', '--gain', type=int, help='Gain')
+    camera_parser.add_argument('--bins', type=int, help='Binning')
+    camera_parser.add_argument('--image-type', choices=sorted(image_types), help='Image type')
+    camera_parser.add_argument('--roi', type=int, nargs=4, metavar=('X', 'Y', 'WIDTH', 'HEIGHT'),
+                               help='Region of interest')
+    camera_parser.add_argument('--bandwidth', type=int, help='USB bandwidth (percent)')
+    camera_parser.add_argument('--high-speed', type=int, choices=(0, 1), help='High speed mode')
+
+    video_parser = argparse.ArgumentParser(add_help=False)
+    video_parser.add_argument('-n', '--frames', type=int, default=0, help='Number of frames (default unlimited)')
+    video_parser.add_argument('-d', '--duration', type=float, default=0, help='Duration (seconds)')
+    video_parser.add_argument('--interval', type=float, default=1.0, help='Progress report interval (seconds)')
+    video_parser.add_argument('--buffers', type=int, default=16, help='Number of frame buffers')
+
+    p = subparsers.add_parser('list', help='List connected cameras')
+    p.set_defaults(func=cmd_list)
+
+    p = subparsers.add_parser('capture', parents=[camera_parser], help='Capture still images')
+    p.add_argument('-n', '--count', type=int, default=1, help='Number of images')
+    p.add_argument('filename', help='Output file; numbered if more than one image is captured')
+    p.set_defaults(func=cmd_capture)
+
+    p = subparsers.add_parser('record', parents=[camera_parser, video_parser],
+                              help='Record video to a .ser, .zwa (compressed archive) or raw file')
+    p.add_argument('filename', help='Output file')
+    p.set_defaults(func=cmd_record)
+
+    p = subparsers.add_parser('stats', parents=[camera_parser, video_parser],
+                              help='Capture video and report frame rate and dropped frames')
+    p.set_defaults(func=cmd_stats, duration=10.0)
+
+    p = subparsers.add_parser('benchmark', parents=[camera_parser, video_parser], help='Run benchmarks')
+    p.add_argument('--repeat', type=int, default=10, help='Number of startup measurements')
+    p.add_argument('--video', type=float, default=0, metavar='SECONDS',
+                   help='Also measure video throughput for this duration')
+    p.set_defaults(func=cmd_benchmark)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(levelname)s: %(message)s')
+    if args.sdk_lib:
+        zwoasi.init(args.sdk_lib)
+
+    try:
+        return args.func(args)
+    except (zwoasi.ZWO_Error, ValueError) as e:
+        print('Error: %s' % e, file=sys.stderr)
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
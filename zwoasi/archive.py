@@ -0,0 +1,327 @@
+"""Lossless compressed archives of raw image sequences.
+
+:class:`ArchiveWriter` compresses frames in a pool of worker threads so that compression keeps up with video capture,
+while a writer thread appends the compressed frames to the file in order. Before compression each frame is delta
+encoded along rows and its bytes are shuffled so that the high and low bytes of 16 bit pixels are stored separately;
+both steps make raw sensor data much more compressible by the standard library codecs. A frame index written when
+the archive is closed gives random access; :class:`ArchiveReader` rebuilds the index by scanning if the archive was not
+closed cleanly. Example::
+
+    with ArchiveWriter('capture.zwa') as archive:
+        camera.start_video_capture()
+        for n in range(1000):
+            archive.write(camera.capture_video_frame(metadata=True))
+
+    reader = ArchiveReader('capture.zwa')
+    img = reader[500]
+
+File layout, all integers little-endian: an 8 byte magic string, the length of the header as an unsigned 32 bit
+integer and the header as JSON. Each frame is stored as a record tag ``FRAM``, sequence number (unsigned 64 bit),
+timestamp (64 bit float), compressed length (unsigned 32 bit) and the compressed data. The index is stored as a
+record tag ``INDX`` followed by the number of frames (unsigned 64 bit) and the index entries, and the file ends with
+the offset of the index (unsigned 64 bit) and an 8 byte trailer string."""
+
+import bz2
+import concurrent.futures
+import json
+import logging
+import lzma
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+
+__author__ = 'Steve Marple'
+__license__ = 'MIT'
+
+logger = logging.getLogger(__name__)
+
+_MAGIC = b'ZWOARC\x00\x01'
+_TRAILER = b'ZWOAIDX\x00'
+_header_length = struct.Struct('<I')
+_record = struct.Struct('<4sQdI')
+_index_header = struct.Struct('<4sQ')
+_footer = struct.Struct('<Q8s')
+_index_dtype = np.dtype([('offset', '<u8'), ('sequence', '<u8'), ('timestamp', '<f8'), ('length', '<u4')])
+
+_compressors = {
+    'none': lambda data, level: data,
+    'zlib': lambda data, level: zlib.compress(data, level),
+    'bz2': lambda data, level: bz2.compress(data, level),
+    'lzma': lambda data, level: lzma.compress(data, preset=level),
+}
+
+_decompressors = {
+    'none': lambda data: data,
+    'zlib': zlib.decompress,
+    'bz2': bz2.decompress,
+    'lzma': lzma.decompress,
+}
+
+
+def encode_frame(img, codec='zlib', level=1, delta=1, shuffle=True):
+    """Compress an image losslessly. Returns :class:`bytes`.
+
+    If `delta` is non-zero each pixel is replaced by its difference from the pixel `delta` columns to the left,
+    using wrap-around integer arithmetic; use ``delta=2`` for raw Bayer images so that pixels of the same colour are
+    differenced. If `shuffle` is true the bytes of multi-byte pixels are grouped by significance."""
+    if delta:
+        d = np.empty_like(img)
+        d[:, :delta] = img[:, :delta]
+        np.subtract(img[:, delta:], img[:, :-delta], out=d[:, delta:])
+    else:
+        d = np.ascontiguousarray(img)
+    if shuffle and d.itemsize > 1:
+        data = d.view(np.uint8).reshape(-1, d.itemsize).T.tobytes()
+    else:
+        data = d.tobytes()
+    return _compressors[codec](data, level)
+
+
+def decode_frame(data, shape, dtype, codec='zlib', delta=1, shuffle=True):
+    """Decompress an image compressed by :func:`encode_frame()`. Type :class:`numpy.ndarray`."""
+    dtype = np.dtype(dtype)
+    raw = _decompressors[codec](data)
+    if shuffle and dtype.itemsize > 1:
+        b = np.frombuffer(raw, dtype=np.uint8).reshape(dtype.itemsize, -1)
+        img = np.ascontiguousarray(b.T).view(dtype).reshape(shape)
+    else:
+        img = np.frombuffer(raw, dtype=dtype).reshape(shape).copy()
+    if delta:
+        for k in range(delta):
+            view = img[:, k::delta]
+            np.cumsum(view, axis=1, dtype=dtype, out=view)
+    return img
+
+
+class ArchiveWriter(object):
+    """Write frames to a compressed archive.
+
+    `codec` is one of ``'zlib'``, ``'lzma'``, ``'bz2'`` or ``'none'`` and `level` its compression level; the fastest
+    settings (``'zlib'``, level 1) usually suffice since most of the gain comes from the delta encoding. See
+    :func:`encode_frame()` for `delta` and `shuffle`. The codecs release the GIL, so `workers` threads compress
+    frames in parallel. At most `max_pending` frames may be waiting for compression; further calls to :func:`write()`
+    block so that memory use stays bounded. `metadata` is an optional JSON serializable :class:`dict` stored in the
+    header.
+
+    The frame shape and data type are taken from the first frame written; all frames must match it."""
+    def __init__(self, filename, codec='zlib', level=1, delta=1, shuffle=True, workers=None, max_pending=None,
+                 metadata=None):
+        if codec not in _compressors:
+            raise ValueError('Unknown codec %s' % repr(codec))
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if max_pending is None:
+            max_pending = 4 * workers
+        self.filename = filename
+        self.codec = codec
+        self.level = level
+        self.delta = delta
+        self.shuffle = shuffle
+        self.metadata = metadata or {}
+        self.shape = None
+        self.dtype = None
+        self.frames = 0
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self._sequence = 0
+        self._index = []
+        self._error = None
+        self._file = open(filename, 'wb')
+        self._executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix='zwoasi-archive')
+        self._pending = queue.Queue(max_pending)
+        self._thread = threading.Thread(target=self._run, name='zwoasi-archive-writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def _write_header(self):
+        header = {'shape': list(self.shape),
+                  'dtype': self.dtype.str,
+                  'codec': self.codec,
+                  'delta': self.delta,
+                  'shuffle': self.shuffle,
+                  'created': time.time(),
+                  'metadata': self.metadata}
+        data = json.dumps(header).encode()
+        self._file.write(_MAGIC + _header_length.pack(len(data)) + data)
+
+    def write(self, img, sequence=None, timestamp=None):
+        """Queue a frame to be compressed and written.
+
+        `img` is a :class:`numpy.ndarray` or a :class:`zwoasi.Frame`, in which case its sequence number and
+        timestamp are used unless given. The image is copied so its buffer may be reused as soon as this returns."""
+        if self._error is not None:
+            raise self._error
+        if hasattr(img, 'image'):
+            if sequence is None:
+                sequence = img.sequence
+            if timestamp is None:
+                timestamp = img.timestamp
+            img = img.image
+        if self.shape is None:
+            if img.ndim < 2 or img.dtype.kind != 'u':
+                raise ValueError('Image must be an unsigned integer array of 2 or more dimensions')
+            self.shape = img.shape
+            self.dtype = img.dtype
+            self._write_header()
+        elif img.shape != self.shape or img.dtype != self.dtype:
+            raise ValueError('Image shape or type differs from previous frames')
+        if sequence is None:
+            sequence = self._sequence
+        self._sequence = sequence + 1
+        if timestamp is None:
+            timestamp = time.time()
+        future = self._executor.submit(encode_frame, img.copy(), self.codec, self.level, self.delta, self.shuffle)
+        self._pending.put((future, sequence, timestamp))
+        self.raw_bytes += img.nbytes
+
+    def _run(self):
+        while True:
+            item = self._pending.get()
+            try:
+                if item is None:
+                    return
+                if self._error is None:
+                    self._write_record(*item)
+            finally:
+                self._pending.task_done()
+
+    def _write_record(self, future, sequence, timestamp):
+        try:
+            data = future.result()
+            offset = self._file.tell()
+            self._file.write(_record.pack(b'FRAM', sequence, timestamp, len(data)))
+            self._file.write(data)
+        except Exception as e:
+            logger.exception('could not write to archive %s', self.filename)
+            self._error = e  # Later frames are discarded so that write() does not block
+            return
+        self._index.append((offset, sequence, timestamp, len(data)))
+        self.compressed_bytes += len(data)
+        self.frames += 1
+
+    def flush(self):
+        """Wait until all queued frames have been written."""
+        self._pending.join()
+        self._file.flush()
+
+    def close(self):
+        """Write the remaining frames and the index, and close the file."""
+        if self._file is None:
+            return
+        self._pending.put(None)
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+        if self.shape is not None:
+            index = np.array(self._index, dtype=_index_dtype)
+            offset = self._file.tell()
+            self._file.write(_index_header.pack(b'INDX', len(index)))
+            self._file.write(index.tobytes())
+            self._file.write(_footer.pack(offset, _TRAILER))
+        self._file.close()
+        self._file = None
+        if self.raw_bytes:
+            logger.debug('archive %s: %d frames, compression ratio %.2f', self.filename, self.frames,
+                         self.raw_bytes / float(max(self.compressed_bytes, 1)))
+        if self._error is not None:
+            raise self._error
+
+
+class ArchiveReader(object):
+    """Read frames from an archive written by :class:`ArchiveWriter`.
+
+    Frames can be accessed by index (``reader[i]``) or read sequentially by iterating over the reader. If the
+    archive has no index, for instance because the writer did not close it, the index is rebuilt by scanning the
+    frame records; a partially written final frame is ignored."""
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(filename, 'rb')
+        magic = self._file.read(len(_MAGIC))
+        if magic != _MAGIC:
+            self._file.close()
+            raise ValueError('%s is not a zwoasi archive' % filename)
+        n, = _header_length.unpack(self._file.read(_header_length.size))
+        header = json.loads(self._file.read(n).decode())
+        self.header = header
+        self.shape = tuple(header['shape'])
+        self.dtype = np.dtype(header['dtype'])
+        self.codec = header['codec']
+        self.delta = header['delta']
+        self.shuffle = header['shuffle']
+        self.metadata = header['metadata']
+        self._data_start = self._file.tell()
+        self.index = self._read_index()
+        if self.index is None:
+            self.index = self._scan()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        return self.read(i)[0]
+
+    def __iter__(self):
+        for img, sequence, timestamp in self.read_frames():
+            yield img
+
+    def _read_index(self):
+        f = self._file
+        size = f.seek(0, os.SEEK_END)
+        if size < self._data_start + _footer.size:
+            return None
+        f.seek(size - _footer.size)
+        offset, trailer = _footer.unpack(f.read(_footer.size))
+        if trailer != _TRAILER or offset >= size:
+            return None
+        f.seek(offset)
+        tag, n = _index_header.unpack(f.read(_index_header.size))
+        if tag != b'INDX':
+            return None
+        return np.frombuffer(f.read(n * _index_dtype.itemsize), dtype=_index_dtype)
+
+    def _scan(self):
+        logger.debug('archive %s has no index, scanning', self.filename)
+        f = self._file
+        size = f.seek(0, os.SEEK_END)
+        offset = self._data_start
+        entries = []
+        while offset + _record.size <= size:
+            f.seek(offset)
+            tag, sequence, timestamp, length = _record.unpack(f.read(_record.size))
+            if tag != b'FRAM' or offset + _record.size + length > size:
+                break
+            entries.append((offset, sequence, timestamp, length))
+            offset += _record.size + length
+        return np.array(entries, dtype=_index_dtype)
+
+    def read(self, i):
+        """Read frame `i`. Returns a tuple ``(image, sequence, timestamp)``."""
+        entry = self.index[i]
+        self._file.seek(int(entry['offset']) + _record.size)
+        data = self._file.read(int(entry['length']))
+        img = decode_frame(data, self.shape, self.dtype, self.codec, self.delta, self.shuffle)
+        return img, int(entry['sequence']), float(entry['timestamp'])
+
+    def read_frames(self, start=0, stop=None):
+        """Read frames sequentially, yielding tuples ``(image, sequence, timestamp)``."""
+        for i in range(start, len(self.index) if stop is None else stop):
+            yield self.read(i)
@@ -0,0 +1,183 @@
+"""Adaptive control of USB bandwidth during video capture.
+
+When several cameras share one USB controller the best ``ASI_BANDWIDTHOVERLOAD`` setting depends on the hub, the
+other cameras and the host, and a value which is too high shows up as dropped frames. :class:`BandwidthController`
+monitors the dropped frame rate reported by the SDK and the delivered frame rate, and adjusts the bandwidth within the
+camera's limits: it backs off quickly when frames are dropped and probes slowly while capture is clean, upwards while
+an increase raises the delivered frame rate and then downwards while a decrease does not lower it. Each camera
+therefore settles near the lowest bandwidth giving its best frame rate, leaving the rest of the bus to other cameras.
+Example::
+
+    camera.start_video_capture()
+    controller = BandwidthController(camera)
+    controller.start()
+    while True:
+        img = camera.capture_video_frame()
+"""
+
+import logging
+import threading
+import time
+
+import zwoasi
+
+__author__ = 'Steve Marple'
+__license__ = 'MIT'
+
+logger = logging.getLogger(__name__)
+
+
+class BandwidthController(object):
+    """Adjust ``ASI_BANDWIDTHOVERLOAD`` of `camera` to keep the dropped frame rate below `max_drop_rate` frames per
+    second.
+
+    Every `interval` seconds the dropped frame rate is measured. If it exceeds `max_drop_rate` the bandwidth is
+    reduced by `decrease_step`, and the value which caused the drops is avoided for `hold` intervals. After `clean`
+    consecutive intervals without drops the bandwidth is increased by `increase_step`; if the delivered frame rate
+    in the following interval has not risen by at least the fraction `min_fps_gain` the increase is undone and
+    that value is likewise avoided. When no increase can be tried the bandwidth is instead decreased by
+    `increase_step`; if the frame rate then falls by more than the fraction `min_fps_gain` the decrease is undone
+    and no lower value is tried for `hold` intervals. If `high_speed` is true and frames are still dropped at the
+    minimum bandwidth, ``ASI_HIGH_SPEED_MODE`` is switched off.
+
+    The delivered frame rate is taken from :attr:`zwoasi.Camera.video_frames`, so it counts frames read by any
+    capture method. No adjustment is made in intervals when no frames were read.
+
+    When video is read from another thread the controller's SDK calls are concurrent with it; wrap the camera in
+    :class:`zwoasi.threadsafe.ThreadSafeCamera` if the calls must be serialized."""
+    def __init__(self, camera, interval=2.0, max_drop_rate=0.5, decrease_step=10, increase_step=2, clean=5,
+                 hold=30, high_speed=False, min_fps_gain=0.02):
+        self.camera = camera
+        self.interval = interval
+        self.max_drop_rate = max_drop_rate
+        self.decrease_step = decrease_step
+        self.increase_step = increase_step
+        self.clean = clean
+        self.hold = hold
+        self.high_speed = high_speed
+        self.min_fps_gain = min_fps_gain
+
+        controls = camera.get_controls()
+        if 'BandWidth' not in controls:
+            raise zwoasi.ZWO_Error('Camera does not support bandwidth control')
+        self.min_value = controls['BandWidth']['MinValue']
+        self.max_value = controls['BandWidth']['MaxValue']
+        self._has_high_speed = 'HighSpeedMode' in controls and controls['HighSpeedMode']['IsWritable']
+        self.value = camera.get_control_value(zwoasi.ASI_BANDWIDTHOVERLOAD)[0]
+        self.drop_rate = 0.0
+        self.fps = 0.0
+        self.adjustments = 0
+        self._ceiling = None
+        self._ceiling_hold = 0
+        self._floor = None
+        self._floor_hold = 0
+        self._clean_intervals = 0
+        self._probe = None  # Bandwidth and frame rate before the last probe
+        self._last = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start adjusting in a background thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._last = None
+        self._probe = None
+        self._thread = threading.Thread(target=self._run, name='zwoasi-bandwidth-%d' % self.camera.id)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop adjusting. The bandwidth is left at its current value."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            try:
+                self.update()
+            except zwoasi.ZWO_Error as e:
+                logger.warning('bandwidth update failed: %s', e)
+            if self._stop.wait(self.interval):
+                return
+
+    def _set(self, value):
+        value = max(self.min_value, min(self.max_value, int(value)))
+        if value != self.value:
+            self.camera.set_control_value(zwoasi.ASI_BANDWIDTHOVERLOAD, value)
+            logger.debug('camera %d bandwidth %d -> %d (drop rate %.2f/s, %.1f fps)',
+                         self.camera.id, self.value, value, self.drop_rate, self.fps)
+            self.value = value
+            self.adjustments += 1
+
+    def update(self):
+        """Measure the dropped frame rate and adjust the bandwidth once. Returns the bandwidth setting.
+
+        The first call only records the starting counters."""
+        now = time.monotonic()
+        dropped = self.camera.get_dropped_frames()
+        frames = self.camera.video_frames
+        last = self._last
+        self._last = (now, dropped, frames)
+        if last is None or now <= last[0]:
+            return self.value
+        dt = now - last[0]
+        # The SDK counter restarts when video capture is restarted
+        self.drop_rate = max(dropped - last[1], 0) / dt
+        self.fps = max(frames - last[2], 0) / dt
+
+        if self._ceiling_hold:
+            self._ceiling_hold -= 1
+            if not self._ceiling_hold:
+                self._ceiling = None
+        if self._floor_hold:
+            self._floor_hold -= 1
+            if not self._floor_hold:
+                self._floor = None
+
+        probe = self._probe
+        self._probe = None
+        if self.fps == 0 and self.drop_rate == 0:
+            return self.value  # Video is not being read, so there is nothing to judge
+
+        if self.drop_rate > self.max_drop_rate:
+            self._clean_intervals = 0
+            if self.value > self.min_value:
+                self._ceiling = self.value
+                self._ceiling_hold = self.hold
+                self._set(self.value - self.decrease_step)
+            elif self.high_speed and self._has_high_speed:
+                if self.camera.get_control_value(zwoasi.ASI_HIGH_SPEED_MODE)[0]:
+                    self.camera.set_control_value(zwoasi.ASI_HIGH_SPEED_MODE, 0)
+                    logger.debug('camera %d high speed mode disabled', self.camera.id)
+                    self.adjustments += 1
+        elif probe is not None and self.value > probe[0] and self.fps < probe[1] * (1.0 + self.min_fps_gain):
+            # The increase did not deliver more frames; give the bandwidth back to the other cameras on the bus
+            self._clean_intervals = 0
+            self._ceiling = self.value
+            self._ceiling_hold = self.hold
+            self._set(probe[0])
+        elif probe is not None and self.value < probe[0] and self.fps < probe[1] * (1.0 - self.min_fps_gain):
+            # The decrease cost frames, so the previous value was the lowest worth keeping
+            self._clean_intervals = 0
+            self._floor = probe[0]
+            self._floor_hold = self.hold
+            self._set(probe[0])
+        elif self.drop_rate == 0:
+            self._clean_intervals += 1
+            if self._clean_intervals >= self.clean:
+                self._clean_intervals = 0
+                limit = self.max_value if self._ceiling is None else self._ceiling - 1
+                floor = self.min_value if self._floor is None else self._floor
+                if self.value < limit:
+                    self._probe = (self.value, self.fps)
+                    self._set(min(self.value + self.increase_step, limit))
+                elif self.value > floor:
+                    self._probe = (self.value, self.fps)
+                    self._set(max(self.value - self.increase_step, floor))
+        else:
+            self._clean_intervals = 0
+        return self.value
@@ -0,0 +1,89 @@
+"""Benchmarks for the :mod:`zwoasi` module.
+
+:func:`startup_benchmark()` measures the time taken to import :mod:`zwoasi` and enumerate the connected cameras in a
+fresh interpreter, as experienced by short-lived monitoring scripts."""
+
+import os
+import subprocess
+import sys
+import time
+
+__author__ = 'Steve Marple'
+__license__ = 'MIT'
+
+
+_startup_code = '''
+import sys
+import time
+t0 = time.perf_counter()
+import zwoasi
+t1 = time.perf_counter()
+try:
+    if len(sys.argv) > 1:
+        zwoasi.init(sys.argv[1])
+    zwoasi.list_cameras()
+    t2 = time.perf_counter() - t1
+except zwoasi.ZWO_Error:
+    t2 = -1
+print(t1 - t0, t2, int('numpy' in sys.modules))
+'''
+
+
+def _median(values):
+    values = sorted(values)
+    n = len(values)
+    if n % 2:
+        return values[n // 2]
+    return 0.5 * (values[n // 2 - 1] + values[n // 2])
+
+
+def startup_benchmark(repeat=10, library_file=None):
+    """Time ``import zwoasi`` followed by :func:`zwoasi.list_cameras()` in `repeat` fresh interpreters.
+
+    Returns a :class:`dict` with the minimum and median import time, enumeration time and total process run time
+    in seconds, and whether :mod:`numpy` was imported. The enumeration times are ``None`` if the SDK library could
+    not be loaded."""
+    cmd = [sys.executable, '-c', _startup_code]
+    if library_file:
+        cmd.append(library_file)
+    env = dict(os.environ)
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join([package_dir] + [p for p in [env.get('PYTHONPATH')] if p])
+
+    import_times = []
+    enumerate_times = []
+    process_times = []
+    numpy_imported = False
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        output = subprocess.check_output(cmd, env=env)
+        process_times.append(time.perf_counter() - t0)
+        import_time, enumerate_time, numpy_flag = output.decode().split()
+        import_times.append(float(import_time))
+        if float(enumerate_time) >= 0:
+            enumerate_times.append(float(enumerate_time))
+        numpy_imported = numpy_imported or bool(int(numpy_flag))
+
+    return {'repeat': repeat,
+            'import_min': min(import_times),
+            'import_median': _median(import_times),
+            'enumerate_min': min(enumerate_times) if enumerate_times else None,
+            'enumerate_median': _median(enumerate_times) if enumerate_times else None,
+            'process_min': min(process_times),
+            'process_median': _median(process_times),
+            'numpy_imported': numpy_imported}
+
+
+def print_results(name, results):
+    print('%s:' % name)
+    for k in sorted(results.keys()):
+        v = results[k]
+        if isinstance(v, float):
+            print('    %s: %.6f' % (k, v))
+        else:
+            print('    %s: %s' % (k, v))
+
+
+if __name__ == '__main__':
+    library = sys.argv[1] if len(sys.argv) > 1 else os.getenv('ZWO_ASI_LIB')
+    print_results('startup', startup_benchmark(library_file=library))
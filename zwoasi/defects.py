@@ -0,0 +1,226 @@
+"""Detection and correction of hot pixels and other sensor defects.
+
+:func:`find_defects()` locates pixels in a stack of dark frames which are much brighter (or, optionally, darker)
+than the rest of the sensor. A :class:`DefectMap` stores the defects as an array of flat pixel indices together with
+precomputed indices of their neighbours, so that :func:`DefectMap.correct()` can replace each defect by the median
+of its neighbours in place with a few vectorized array operations. For raw colour images the neighbours are taken
+from the same colour plane of the Bayer mosaic.
+
+Hot pixels depend on gain, sensor temperature and binning; a :class:`DefectLibrary` holds maps for several
+conditions and selects the closest one. Example::
+
+    defect_map = build_defect_map(camera, count=10)
+    library = DefectLibrary()
+    library.add(defect_map)
+    library.save('defects.npz')
+    ...
+    camera.start_video_capture()
+    while True:
+        img = camera.capture_video_frame()
+        defect_map.correct(img)
+"""
+
+import json
+import logging
+
+import numpy as np
+
+import zwoasi
+
+__author__ = 'Steve Marple'
+__license__ = 'MIT'
+
+logger = logging.getLogger(__name__)
+
+# Neighbour offsets (dy, dx) in units of the colour plane step
+_offsets = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+
+
+def _plane_step(camera_info, image_type):
+    # Raw images from colour sensors are Bayer mosaics; only pixels two apart share a colour
+    if camera_info.get('IsColorCam') and image_type in (zwoasi.ASI_IMG_RAW8, zwoasi.ASI_IMG_RAW16):
+        return 2
+    return 1
+
+
+def find_defects(darks, sigma=6.0, step=1, cold=False):
+    """Locate defective pixels in a stack of dark frames. Returns a :class:`numpy.ndarray` of flat pixel indices.
+
+    `darks` is a sequence of 2-d frames, or a 3-d array with the frame index as the first axis. The frames are
+    median combined, which removes cosmic rays and other transient signals, and pixels which deviate from the median
+    of their colour plane by more than `sigma` times the robust standard deviation are returned. Only hot pixels are
+    found unless `cold` is true. `step` is 2 for raw Bayer images so that each colour plane is treated separately."""
+    darks = np.asarray(darks)
+    if darks.ndim == 2:
+        master = darks
+    elif darks.ndim == 3:
+        master = np.median(darks, axis=0)
+    else:
+        raise ValueError('Dark frames must be 2-d images')
+    bad = np.zeros(master.shape, dtype=bool)
+    for y0 in range(step):
+        for x0 in range(step):
+            plane = master[y0::step, x0::step]
+            median = np.median(plane)
+            mad = np.median(np.abs(plane - median))
+            threshold = sigma * max(1.4826 * mad, 1.0)
+            plane_bad = bad[y0::step, x0::step]
+            plane_bad |= plane > median + threshold
+            if cold:
+                plane_bad |= plane < median - threshold
+    return np.flatnonzero(bad)
+
+
+class DefectMap(object):
+    """Defective pixels of images of `shape`, given as flat pixel `indices`.
+
+    `step` is 2 for raw Bayer images and 1 otherwise. `gain`, `temperature` (degrees Celsius) and `bins` record the
+    conditions under which the map was made and are used by :class:`DefectLibrary`."""
+    def __init__(self, indices, shape, step=1, gain=None, temperature=None, bins=None):
+        self.indices = np.asarray(indices, dtype=np.intp)
+        self.shape = tuple(shape[0:2])
+        self.step = step
+        self.gain = gain
+        self.temperature = temperature
+        self.bins = bins
+        self._neighbours = self._find_neighbours()
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __repr__(self):
+        return '<DefectMap %d defects, shape %s, gain %s, temperature %s, bins %s>' % \
+            (len(self.indices), self.shape, self.gain, self.temperature, self.bins)
+
+    def _find_neighbours(self):
+        height, width = self.shape
+        step = self.step
+        y, x = np.divmod(self.indices, width)
+        n = np.empty((len(self.indices), len(_offsets)), dtype=np.intp)
+        for i, (dy, dx) in enumerate(_offsets):
+            ny = y + dy * step
+            nx = x + dx * step
+            # Reflect at the edges, staying on the same colour plane
+            ny = np.where(ny < 0, ny + 2 * step, np.where(ny >= height, ny - 2 * step, ny))
+            nx = np.where(nx < 0, nx + 2 * step, np.where(nx >= width, nx - 2 * step, nx))
+            n[:, i] = ny * width + nx
+
+        # Replace neighbours which are themselves defects by a good neighbour of the same pixel, so that adjacent
+        # defects do not contaminate each other. Pixels with no good neighbour are left unchanged.
+        bad = np.isin(n, self.indices)
+        if bad.any():
+            good_count = len(_offsets) - bad.sum(axis=1)
+            for row in np.flatnonzero(bad.any(axis=1)):
+                good = n[row][~bad[row]]
+                if good_count[row]:
+                    n[row][bad[row]] = np.resize(good, bad[row].sum())
+                else:
+                    n[row] = self.indices[row]
+        return n
+
+    def correct(self, img):
+        """Replace each defective pixel of `img` in place by the median of its neighbours. Returns `img`.
+
+        `img` must be C-contiguous; colour (3-d) images are corrected in each channel."""
+        if img.shape[0:2] != self.shape:
+            raise ValueError('Image shape does not match defect map')
+        if not img.flags.c_contiguous:
+            raise ValueError('Image must be C-contiguous')
+        if not len(self.indices):
+            return img
+        flat = img.reshape((self.shape[0] * self.shape[1], -1))
+        values = flat[self._neighbours]  # Shape (defects, neighbours, channels)
+        values.sort(axis=1)
+        # Median of an even number of values is the mean of the middle pair
+        mid = len(_offsets) // 2
+        median = values[:, mid - 1].astype(np.uint32 if img.dtype.kind == 'u' else np.float64)
+        median += values[:, mid]
+        if img.dtype.kind == 'u':
+            median += 1
+            median >>= 1
+        else:
+            median *= 0.5
+        flat[self.indices] = median
+        return img
+
+    def get_dict(self):
+        return {'shape': list(self.shape),
+                'step': self.step,
+                'gain': self.gain,
+                'temperature': self.temperature,
+                'bins': self.bins}
+
+
+class DefectLibrary(object):
+    """Collection of defect maps made under different conditions."""
+    def __init__(self, maps=()):
+        self.maps = list(maps)
+
+    def add(self, defect_map):
+        """Add a defect map, replacing any existing map for the same gain, temperature, binning and shape."""
+        key = (defect_map.gain, defect_map.temperature, defect_map.bins, defect_map.shape, defect_map.step)
+        self.maps = [m for m in self.maps if (m.gain, m.temperature, m.bins, m.shape, m.step) != key]
+        self.maps.append(defect_map)
+
+    def find(self, shape, gain=None, temperature=None, bins=None, max_temperature_difference=5.0):
+        """Select the map for images of `shape` most suitable for the given conditions. Type :class:`DefectMap`.
+
+        Maps must match `shape` and, where given, `bins`. Among those, maps with the same `gain` are preferred, then
+        the map closest in temperature is chosen. Returns ``None`` if no map is within `max_temperature_difference`
+        degrees."""
+        best = None
+        best_score = None
+        for m in self.maps:
+            if m.shape != tuple(shape[0:2]) or (bins is not None and m.bins is not None and m.bins != bins):
+                continue
+            dt = 0.0
+            if temperature is not None and m.temperature is not None:
+                dt = abs(m.temperature - temperature)
+                if dt > max_temperature_difference:
+                    continue
+            dg = 0.0 if gain is None or m.gain is None else abs(m.gain - gain)
+            score = (dg, dt)
+            if best_score is None or score < best_score:
+                best = m
+                best_score = score
+        return best
+
+    def find_for_camera(self, camera, **kwargs):
+        """Select the map most suitable for the current settings and temperature of `camera`."""
+        width, height, bins, image_type = camera.get_roi_format()
+        gain = camera.get_control_value(zwoasi.ASI_GAIN)[0]
+        temperature = camera.get_control_value(zwoasi.ASI_TEMPERATURE)[0] / 10.0
+        return self.find((height, width), gain=gain, temperature=temperature, bins=bins, **kwargs)
+
+    def save(self, filename):
+        """Save all maps to a :func:`numpy.savez_compressed()` file."""
+        arrays = {'meta': np.array(json.dumps([m.get_dict() for m in self.maps]))}
+        for i, m in enumerate(self.maps):
+            arrays['indices%d' % i] = m.indices.astype(np.uint32)
+        np.savez_compressed(filename, **arrays)
+
+    @classmethod
+    def load(cls, filename):
+        """Load maps saved by :func:`save()`. Type :class:`DefectLibrary`."""
+        with np.load(filename) as data:
+            meta = json.loads(str(data['meta']))
+            return cls([DefectMap(data['indices%d' % i], **d) for i, d in enumerate(meta)])
+
+
+def build_defect_map(camera, count=5, sigma=6.0, cold=False, initial_sleep=0.01, poll=0.01):
+    """Capture `count` dark frames with `camera` at its current settings and find their defects.
+
+    Returns a :class:`DefectMap` recording the gain, sensor temperature and binning in use. For cameras with a
+    mechanical shutter the darks are taken with it closed; otherwise the sensor must be covered."""
+    width, height, bins, image_type = camera.get_roi_format()
+    step = _plane_step(camera.get_camera_property(), image_type)
+    if image_type == zwoasi.ASI_IMG_RGB24:
+        raise ValueError('Defect maps require raw or Y8 images')
+    gain = camera.get_control_value(zwoasi.ASI_GAIN)[0]
+    temperature = camera.get_control_value(zwoasi.ASI_TEMPERATURE)[0] / 10.0
+    darks = np.empty((count, height, width), dtype=np.uint16 if image_type == zwoasi.ASI_IMG_RAW16 else np.uint8)
+    for i, img in enumerate(camera.capture_sequence(count, initial_sleep=initial_sleep, poll=poll, is_dark=True)):
+        darks[i] = img
+    indices = find_defects(darks, sigma=sigma, step=step, cold=cold)
+    logger.info('found %d defects in %d dark frames', len(indices), count)
+    return DefectMap(indices, (height, width), step=step, gain=gain, temperature=temperature, bins=bins)
@@ -0,0 +1,246 @@
+"""Detection of meteors and other transients in a live video stream.
+
+:class:`TransientDetector` maintains a running background model of the scene on a decimated grid and flags frames
+where enough grid cells brighten significantly above the background. All working arrays, including a ring of the most
+recent frames and a buffer for the frames of an event, are allocated when the detector is created so memory use is
+fixed. Each detection is returned as a :class:`TransientEvent` containing the frames before, during and after the
+event. Example::
+
+    img = camera.capture_video_frame()
+    detector = TransientDetector(img.shape, img.dtype)
+    run_detector(camera, detector, lambda event: event.save('meteor_%d.npz' % event.sequence))
+"""
+
+import logging
+import time
+
+import numpy as np
+
+import zwoasi
+
+__author__ = 'Steve Marple'
+__license__ = 'MIT'
+
+logger = logging.getLogger(__name__)
+
+
+class TransientEvent(object):
+    """A detected transient together with the frames surrounding it.
+
+    ``frames`` is a :class:`numpy.ndarray` with the frame index as the first axis and ``timestamps`` the
+    corresponding wall-clock times. For events returned by :class:`TransientDetector` ``frames`` is a view of the
+    detector's event buffer, valid until the detector starts its next event; copy it if it must be kept longer.
+    ``trigger_index`` is the index into ``frames`` of the first frame in which the transient was detected.
+    ``sequence`` is the detector's frame number of that frame, ``peak`` the largest background-subtracted signal
+    seen, in units of the background noise, and ``bbox`` the bounding box ``(x0, y0, x1, y1)`` of the flagged pixels
+    in full-resolution coordinates."""
+    def __init__(self, frames, timestamps, trigger_index, sequence, peak, bbox):
+        self.frames = frames
+        self.timestamps = timestamps
+        self.trigger_index = trigger_index
+        self.sequence = sequence
+        self.peak = peak
+        self.bbox = bbox
+
+    def __repr__(self):
+        return '<TransientEvent sequence=%d frames=%d peak=%.1f bbox=%s>' % \
+            (self.sequence, len(self.frames), self.peak, self.bbox)
+
+    def save(self, filename):
+        """Save the event with :func:`numpy.savez_compressed()`."""
+        np.savez_compressed(filename, frames=self.frames, timestamps=self.timestamps,
+                            trigger_index=self.trigger_index, sequence=self.sequence, peak=self.peak,
+                            bbox=np.array(self.bbox))
+        logger.debug('wrote %s', filename)
+
+
+class TransientDetector(object):
+    """Streaming transient detector with a fixed memory footprint.
+
+    `shape` and `dtype` describe the frames which will be passed to :func:`process()`. Frames are reduced to a grid
+    of `decimate` x `decimate` pixel block sums; the background and its variance are exponential moving averages
+    with weight `alpha`, updated in place. A frame triggers when at least `min_cells` grid cells exceed the
+    background by more than `threshold` standard deviations. No detection is attempted until `warmup` frames have
+    been seen.
+
+    `pre_trigger` frames before the trigger are kept in a ring buffer; an event ends once `post_trigger` consecutive
+    frames have been processed without a detection, or when it reaches `max_frames` frames. The event buffer holds
+    `max_frames` frames; the operating system only commits its memory as events use it."""
+    def __init__(self, shape, dtype=np.uint8, decimate=4, alpha=0.02, threshold=6.0, min_cells=3,
+                 pre_trigger=25, post_trigger=25, max_frames=500, warmup=50):
+        shape = tuple(shape)
+        if decimate < 1:
+            raise ValueError('decimate must be at least 1')
+        if max_frames <= pre_trigger:
+            raise ValueError('max_frames must exceed pre_trigger')
+        self.shape = shape
+        self.dtype = np.dtype(dtype)
+        self.decimate = decimate
+        self.alpha = np.float32(alpha)
+        self.threshold = threshold
+        self.min_cells = min_cells
+        self.pre_trigger = pre_trigger
+        self.post_trigger = post_trigger
+        self.max_frames = max_frames
+        self.warmup = warmup
+
+        self.grid_shape = (shape[0] // decimate, shape[1] // decimate)
+        self._crop = (self.grid_shape[0] * decimate, self.grid_shape[1] * decimate)
+        self._grid = np.zeros(self.grid_shape, dtype=np.float32)
+        # Decimation accumulators: sums of every d-th row, then of every d-th column
+        acc_dtype = np.uint16 if self.dtype.itemsize == 1 and decimate <= 16 else np.uint32
+        self._rows = np.zeros((self.grid_shape[0], self._crop[1]) + shape[2:], dtype=acc_dtype)
+        if len(shape) == 2:
+            self._cols = self._grid
+        else:
+            self._cols = np.zeros(self.grid_shape + shape[2:], dtype=np.float32)
+        self._background = np.zeros(self.grid_shape, dtype=np.float32)
+        self._variance = np.zeros(self.grid_shape, dtype=np.float32)
+        self._diff = np.zeros(self.grid_shape, dtype=np.float32)
+        self._work = np.zeros(self.grid_shape, dtype=np.float32)
+        self._mask = np.zeros(self.grid_shape, dtype=bool)
+        self._positive = np.zeros(self.grid_shape, dtype=bool)
+        self._ring = np.zeros((pre_trigger + 1,) + shape, dtype=self.dtype)
+        self._ring_times = np.zeros(pre_trigger + 1)
+        self._event_frames = np.empty((max_frames,) + shape, dtype=self.dtype)
+        self._event_times = np.zeros(max_frames)
+        self.reset()
+
+    def reset(self):
+        """Discard the background model, recent frames and any event in progress."""
+        self.frames = 0
+        self.events = 0
+        self._ring_next = 0
+        self._event = None
+
+    def _reduce(self, img):
+        # Block sums from strided in-place additions, much faster than summing a 4-d view
+        h, w = self._crop
+        d = self.decimate
+        img = img[:h, :w]
+        rows = self._rows
+        cols = self._cols
+        np.copyto(rows, img[0::d])
+        for k in range(1, d):
+            np.add(rows, img[k::d], out=rows)
+        np.copyto(cols, rows[:, 0::d])
+        for k in range(1, d):
+            np.add(cols, rows[:, k::d], out=cols)
+        if cols is not self._grid:
+            np.sum(cols, axis=2, out=self._grid)
+
+    def process(self, img, timestamp=None):
+        """Process one frame. Returns a :class:`TransientEvent` when an event has finished, otherwise ``None``.
+
+        `timestamp` defaults to the current wall-clock time."""
+        if img.shape != self.shape:
+            raise ValueError('Frame shape does not match detector')
+        if img.dtype != self.dtype:
+            raise ValueError('Frame data type does not match detector')
+        if timestamp is None:
+            timestamp = time.time()
+        self.frames += 1
+
+        # Keep a copy of the most recent frames for pre-trigger context
+        slot = self._ring_next
+        np.copyto(self._ring[slot], img)
+        self._ring_times[slot] = timestamp
+        self._ring_next = (slot + 1) % len(self._ring)
+
+        self._reduce(img)
+        if self.frames == 1:
+            self._background[:] = self._grid
+            self._variance[:] = np.maximum(self._grid, 1.0)  # Poisson-like starting estimate
+            return None
+
+        diff = self._diff
+        work = self._work
+        mask = self._mask
+        np.subtract(self._grid, self._background, out=diff)
+        np.multiply(diff, diff, out=work)
+
+        detected = False
+        peak = 0.0
+        bbox = None
+        if self.frames > self.warmup:
+            # diff > threshold * sigma, evaluated without a square root
+            np.multiply(self._variance, np.float32(self.threshold ** 2), out=self._grid)
+            np.greater(work, self._grid, out=mask)
+            np.greater(diff, 0, out=self._positive)
+            np.logical_and(mask, self._positive, out=mask)
+            detected = np.count_nonzero(mask) >= self.min_cells
+
+        if detected:
+            ys, xs = np.nonzero(mask)
+            d = self.decimate
+            bbox = (int(xs.min()) * d, int(ys.min()) * d, (int(xs.max()) + 1) * d, (int(ys.max()) + 1) * d)
+            peak = float(np.sqrt((work[mask] / self._variance[mask]).max()))
+        else:
+            # Only learn the background from frames without a detection so events are not absorbed into it
+            np.multiply(diff, self.alpha, out=self._grid)
+            np.add(self._background, self._grid, out=self._background)
+            np.subtract(work, self._variance, out=work)
+            np.multiply(work, self.alpha, out=work)
+            np.add(self._variance, work, out=self._variance)
+
+        return self._update_event(img, timestamp, detected, peak, bbox)
+
+    def _update_event(self, img, timestamp, detected, peak, bbox):
+        event = self._event
+        if event is None:
+            if not detected:
+                return None
+            # Start a new event with the pre-trigger frames, oldest first
+            n = min(self.frames, len(self._ring))
+            order = (np.arange(self._ring_next - n, self._ring_next)) % len(self._ring)
+            np.take(self._ring, order, axis=0, out=self._event_frames[:n])
+            np.take(self._ring_times, order, out=self._event_times[:n])
+            self._event = event = {'count': n,
+                                   'trigger_index': n - 1,
+                                   'sequence': self.frames,
+                                   'peak': peak,
+                                   'bbox': bbox,
+                                   'quiet': 0}
+            return None
+
+        n = event['count']
+        np.copyto(self._event_frames[n], img)
+        self._event_times[n] = timestamp
+        event['count'] = n = n + 1
+        if detected:
+            event['quiet'] = 0
+            event['peak'] = max(event['peak'], peak)
+            b = event['bbox']
+            event['bbox'] = (min(b[0], bbox[0]), min(b[1], bbox[1]), max(b[2], bbox[2]), max(b[3], bbox[3]))
+        else:
+            event['quiet'] += 1
+        if event['quiet'] >= self.post_trigger or n >= self.max_frames:
+            self._event = None
+            self.events += 1
+            return TransientEvent(self._event_frames[:n], self._event_times[:n].copy(),
+                                  event['trigger_index'], event['sequence'], event['peak'], event['bbox'])
+        return None
+
+
+def run_detector(camera, detector, callback, timeout=None, stop=None):
+    """Run `detector` on the video stream from `camera`, calling ``callback(event)`` for each
+    :class:`TransientEvent`.
+
+    Video capture is started if it is not already active, in which case it is stopped again when the loop ends. A
+    single buffer is reused for every frame. The loop runs until `stop`, a :class:`threading.Event`, is set.
+    `timeout` is passed to :func:`zwoasi.Camera.capture_video_frame()`."""
+    whbi = camera.get_roi_format()
+    buffer_ = bytearray(zwoasi.buffer_size(whbi))
+    started = not camera.video_active
+    if started:
+        camera.start_video_capture()
+    try:
+        while stop is None or not stop.is_set():
+            img = camera.capture_video_frame(buffer_=buffer_, timeout=timeout)
+            event = detector.process(img, time.time())
+            if event is not None:
+                logger.info('transient detected: %s', event)
+                callback(event)
+    finally:
+        if started:
+            camera.stop_video_capture()
@@ -0,0 +1,111 @@
+"""Merging of exposure brackets into high dynamic range images.
+
+:class:`HDRMerger` accumulates images taken with different exposure times and gains into a single floating point
+image in units of ADU per second at unity gain. Each pixel is weighted by a triangular function of its value so that
+well-exposed pixels dominate, and saturated pixels are ignored. The merge is performed incrementally with in-place
+array operations on preallocated buffers so that only one frame need be held at a time. See
+:func:`zwoasi.Camera.capture_bracket()`."""
+
+import numpy as np
+
+__author__ = 'Steve Marple'
+__license__ = 'MIT'
+
+# Weight given to unsaturated pixels at the very ends of the range, so that they still contribute when no better
+# exposure is available
+MIN_WEIGHT = 1e-3
+
+
+def gain_factor(gain):
+    """Convert an ``ASI_GAIN`` value to a linear amplification factor. Type :class:`float`.
+
+    ZWO cameras specify gain in units of 0.1 dB."""
+    return 10.0 ** (gain / 200.0)
+
+
+class HDRMerger(object):
+    """Incrementally merge bracketed exposures of the given `shape`.
+
+    `max_value` is the full-scale pixel value (255 for 8 bit images, 65535 for 16 bit). Pixels at or above
+    `saturation` are excluded; it defaults to 98% of `max_value`."""
+    def __init__(self, shape, max_value=255, saturation=None):
+        self.shape = tuple(shape)
+        self.max_value = float(max_value)
+        if saturation is None:
+            saturation = 0.98 * max_value
+        self.saturation = saturation
+        self._numerator = np.zeros(self.shape, dtype=np.float32)
+        self._denominator = np.zeros(self.shape, dtype=np.float32)
+        self._weight = np.zeros(self.shape, dtype=np.float32)
+        self._work = np.zeros(self.shape, dtype=np.float32)
+        self._mask = np.zeros(self.shape, dtype=bool)
+        self._fallback = np.zeros(self.shape, dtype=np.float32)
+        self.reset()
+
+    def reset(self):
+        """Discard all accumulated images."""
+        self._numerator.fill(0)
+        self._denominator.fill(0)
+        self._fallback_scale = None
+        self.count = 0
+
+    def add(self, img, exposure, gain=0):
+        """Add an image taken with `exposure` (seconds) and `gain` (``ASI_GAIN`` units)."""
+        if img.shape != self.shape:
+            raise ValueError('Image shape does not match')
+        scale = exposure * gain_factor(gain)
+        if scale <= 0:
+            raise ValueError('Exposure must be positive')
+        w = self._weight
+        work = self._work
+
+        # Triangular weight w = 1 - |2v - 1| where v is the normalised pixel value
+        np.multiply(img, np.float32(2.0 / self.max_value), out=w)
+        np.subtract(w, np.float32(1.0), out=w)
+        np.abs(w, out=w)
+        np.subtract(np.float32(1.0), w, out=w)
+        np.maximum(w, np.float32(MIN_WEIGHT), out=w)
+        np.greater_equal(img, self.saturation, out=self._mask)
+        np.copyto(w, 0, where=self._mask)
+
+        # Accumulate weighted radiance estimates img / scale
+        np.multiply(img, np.float32(1.0 / scale), out=work)
+        if self._fallback_scale is None or scale < self._fallback_scale:
+            # Keep the shortest exposure for pixels saturated in every image
+            np.copyto(self._fallback, work)
+            self._fallback_scale = scale
+        np.multiply(work, w, out=work)
+        np.add(self._numerator, work, out=self._numerator)
+        np.add(self._denominator, w, out=self._denominator)
+        self.count += 1
+
+    def result(self, out=None):
+        """Compute the merged image. Type :class:`numpy.ndarray` of ``float32``.
+
+        If `out` is given the result is written into it."""
+        if not self.count:
+            raise ValueError('No images have been added')
+        if out is None:
+            out = np.empty(self.shape, dtype=np.float32)
+        np.greater(self._denominator, 0, out=self._mask)
+        np.divide(self._numerator, self._denominator, out=out, where=self._mask)
+        np.logical_not(self._mask, out=self._mask)
+        np.copyto(out, self._fallback, where=self._mask)
+        return out
+
+
+def merge_hdr(images, exposures, gains=None, max_value=None, saturation=None):
+    """Merge a list of images into a high dynamic range image. Type :class:`numpy.ndarray` of ``float32``.
+
+    `exposures` are in seconds and `gains` in ``ASI_GAIN`` units. `max_value` defaults to the maximum value of
+    the images' integer data type."""
+    if gains is None:
+        gains = [0] * len(images)
+    if len(images) != len(exposures) or len(images) != len(gains):
+        raise ValueError('images, exposures and gains must have the same length')
+    if max_value is None:
+        max_value = np.iinfo(images[0].dtype).max
+    merger = HDRMerger(images[0].shape, max_value, saturation)
+    for img, exposure, gain in zip(images, exposures, gains):
+        merger.add(img, exposure, gain)
+    return merger.result()
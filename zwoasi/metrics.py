@@ -0,0 +1,264 @@
+"""Optional instrumentation of calls into the ASI SDK library.
+
+When enabled with :func:`enable()` the library object used by :mod:`zwoasi` is replaced by a thin proxy that counts
+every ``ASI*`` call and records its latency in a histogram. Frame counts, bytes transferred, dropped frames and
+errors are accumulated per camera. :func:`disable()` restores the original library object so that there is no
+overhead at all when instrumentation is not in use.
+
+The statistics are available as a :class:`dict` from :func:`get_stats()`, in the Prometheus text exposition format
+from :func:`prometheus_text()`, and can be served over HTTP with :func:`start_http_server()`."""
+
+import bisect
+import logging
+import threading
+import time
+
+import zwoasi
+
+__author__ = 'Steve Marple'
+__license__ = 'MIT'
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency histogram buckets. A final +Inf bucket is implied.
+LATENCY_BUCKETS = (1e-5, 3e-5, 1e-4, 3e-4, 1e-3, 3e-3, 0.01, 0.03, 0.1, 0.3, 1.0, 3.0, 10.0, 30.0)
+
+# SDK functions which transfer image data, mapped to the position of the buffer size argument.
+_FRAME_FUNCTIONS = {'ASIGetVideoData': 2,
+                    'ASIGetDataAfterExp': 2}
+
+# Weight given to each new video frame interval in the exponential moving average used for the frame rate
+FPS_SMOOTHING = 0.1
+
+
+class _FunctionStats(object):
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def get_dict(self):
+        cumulative = []
+        n = 0
+        for le, count in zip(LATENCY_BUCKETS + (float('inf'),), self.buckets):
+            n += count
+            cumulative.append((le, n))
+        return {'calls': self.calls,
+                'errors': self.errors,
+                'total_time': self.total_time,
+                'mean_time': self.total_time / self.calls if self.calls else 0.0,
+                'max_time': self.max_time,
+                'histogram': cumulative}
+
+
+class _CameraStats(object):
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+        self.errors = 0
+        self.dropped_frames = 0
+        self.frame_bytes = 0
+        self.last_frame_time = None
+        self.mean_interval = None
+
+    def add_video_frame(self, size, now):
+        if self.last_frame_time is not None:
+            interval = now - self.last_frame_time
+            if self.mean_interval is None:
+                self.mean_interval = interval
+            else:
+                self.mean_interval += FPS_SMOOTHING * (interval - self.mean_interval)
+        self.last_frame_time = now
+        self.frame_bytes = size
+
+    def restart_video(self):
+        self.last_frame_time = None
+        self.mean_interval = None
+
+    def get_dict(self, now):
+        fps = 0.0
+        if self.mean_interval:
+            # Decay towards zero if frames stop arriving
+            fps = 1.0 / max(self.mean_interval, now - self.last_frame_time)
+        return {'frames': self.frames,
+                'bytes': self.bytes,
+                'errors': self.errors,
+                'dropped_frames': self.dropped_frames,
+                'fps': fps,
+                'bytes_per_second': fps * self.frame_bytes}
+
+
+class _Registry(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.functions = {}
+            self.cameras = {}
+
+    def record(self, name, args, r, elapsed, now):
+        id_ = zwoasi._camera_id(name, args)
+        with self.lock:
+            fs = self.functions.get(name)
+            if fs is None:
+                fs = self.functions[name] = _FunctionStats()
+            fs.calls += 1
+            fs.total_time += elapsed
+            if elapsed > fs.max_time:
+                fs.max_time = elapsed
+            fs.buckets[bisect.bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+
+            if id_ is None:
+                if r:
+                    fs.errors += 1
+                return
+            cs = self.cameras.get(id_)
+            if cs is None:
+                cs = self.cameras[id_] = _CameraStats()
+            if r:
+                fs.errors += 1
+                cs.errors += 1
+            elif name in _FRAME_FUNCTIONS:
+                size = int(args[_FRAME_FUNCTIONS[name]])
+                cs.frames += 1
+                cs.bytes += size
+                if name == 'ASIGetVideoData':
+                    cs.add_video_frame(size, now)
+            elif name == 'ASIStartVideoCapture':
+                cs.restart_video()
+            elif name == 'ASIGetDroppedFrames':
+                cs.dropped_frames = getattr(args[1], 'value', cs.dropped_frames)
+
+    def get_stats(self):
+        now = time.perf_counter()
+        with self.lock:
+            return {'functions': dict((k, v.get_dict()) for k, v in self.functions.items()),
+                    'cameras': dict((k, v.get_dict(now)) for k, v in self.cameras.items())}
+
+
+class _InstrumentedLibrary(zwoasi._LibraryProxy):
+    """Proxy for the SDK library which times every ``ASI*`` call."""
+    def __init__(self, library, registry):
+        zwoasi._LibraryProxy.__init__(self, library)
+        self._registry = registry
+
+    def _call(self, name, func, args):
+        t0 = time.perf_counter()
+        try:
+            r = func(*args)
+        except Exception:
+            t1 = time.perf_counter()
+            self._registry.record(name, args, -1, t1 - t0, t1)
+            raise
+        t1 = time.perf_counter()
+        self._registry.record(name, args, r, t1 - t0, t1)
+        return r
+
+
+_registry = _Registry()
+
+
+def enable():
+    """Start recording SDK call metrics."""
+    if isinstance(zwoasi.zwolib, _InstrumentedLibrary):
+        return
+    zwoasi.zwolib = _InstrumentedLibrary(zwoasi.zwolib, _registry)
+    logger.debug('SDK instrumentation enabled')
+
+
+def disable():
+    """Stop recording SDK call metrics and restore direct calls to the SDK library.
+
+    Statistics recorded so far are retained until :func:`reset()` is called."""
+    if isinstance(zwoasi.zwolib, _InstrumentedLibrary):
+        zwoasi.zwolib = zwoasi.zwolib._library
+        logger.debug('SDK instrumentation disabled')
+
+
+def is_enabled():
+    """Indicate if SDK call metrics are being recorded. Type :class:`bool`."""
+    return isinstance(zwoasi.zwolib, _InstrumentedLibrary)
+
+
+def reset():
+    """Discard all recorded statistics."""
+    _registry.reset()
+
+
+def get_stats():
+    """Retrieve the recorded statistics. Type :class:`dict`.
+
+    The ``functions`` key maps each SDK function name to a :class:`dict` of call count, error count, total, mean
+    and maximum latency (seconds) and a cumulative latency ``histogram`` given as a list of ``(upper_bound, count)``
+    pairs. The ``cameras`` key maps each camera ID to a :class:`dict` of frames, bytes, errors, dropped frames (as
+    last reported by the SDK), and the current video frame rate and data rate. The frame rate is an exponential
+    moving average over recent video frame intervals (see :data:`FPS_SMOOTHING`), restarted whenever video capture
+    is started; still images are counted but do not contribute to it."""
+    return _registry.get_stats()
+
+
+def prometheus_text(prefix='zwoasi'):
+    """Format the recorded statistics in the Prometheus text exposition format. Type :class:`str`."""
+    stats = get_stats()
+    lines = []
+
+    def metric(name, type_, help_):
+        lines.append('# HELP %s_%s %s' % (prefix, name, help_))
+        lines.append('# TYPE %s_%s %s' % (prefix, name, type_))
+
+    metric('sdk_calls_total', 'counter', 'Number of calls to each SDK function.')
+    for func, fs in sorted(stats['functions'].items()):
+        lines.append('%s_sdk_calls_total{function="%s"} %d' % (prefix, func, fs['calls']))
+    metric('sdk_errors_total', 'counter', 'Number of SDK calls returning an error.')
+    for func, fs in sorted(stats['functions'].items()):
+        lines.append('%s_sdk_errors_total{function="%s"} %d' % (prefix, func, fs['errors']))
+    metric('sdk_call_seconds', 'histogram', 'Latency of SDK calls.')
+    for func, fs in sorted(stats['functions'].items()):
+        for le, count in fs['histogram']:
+            le = '+Inf' if le == float('inf') else repr(le)
+            lines.append('%s_sdk_call_seconds_bucket{function="%s",le="%s"} %d' % (prefix, func, le, count))
+        lines.append('%s_sdk_call_seconds_sum{function="%s"} %r' % (prefix, func, fs['total_time']))
+        lines.append('%s_sdk_call_seconds_count{function="%s"} %d' % (prefix, func, fs['calls']))
+
+    for key, type_, help_ in (('frames', 'counter', 'Number of frames transferred.'),
+                              ('bytes', 'counter', 'Number of image bytes transferred.'),
+                              ('errors', 'counter', 'Number of SDK errors.'),
+                              ('dropped_frames', 'gauge', 'Dropped frame count reported by the SDK.'),
+                              ('fps', 'gauge', 'Current video frames per second.'),
+                              ('bytes_per_second', 'gauge', 'Current video image bytes per second.')):
+        name = 'camera_' + key + ('_total' if type_ == 'counter' else '')
+        metric(name, type_, help_)
+        for id_, cs in sorted(stats['cameras'].items()):
+            lines.append('%s_%s{camera="%s"} %r' % (prefix, name, id_, cs[key]))
+    return '\n'.join(lines) + '\n'
+
+
+def start_http_server(port=9100, address='127.0.0.1'):
+    """Serve the statistics in Prometheus text format over HTTP from a background thread.
+
+    Returns the :class:`http.server.HTTPServer` object; call its ``shutdown()`` method to stop serving. By default
+    the server only listens on the loopback interface."""
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = prometheus_text().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format, *args)
+
+    server = HTTPServer((address, port), Handler)
+    thread = threading.Thread(target=server.serve_forever, name='zwoasi-metrics')
+    thread.daemon = True
+    thread.start()
+    logger.debug('serving metrics on %s:%d', address, port)
+    return server
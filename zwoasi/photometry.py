@@ -0,0 +1,276 @@
+"""Differential aperture photometry of time series.
+
+:class:`AperturePhotometry` measures a set of stars in each frame of a sequence: the star flux within a circular
+aperture, with the sky background estimated from the median of a surrounding annulus, and the intensity-weighted
+centroid, which is used to track the stars from frame to frame. The aperture and annulus are precomputed as arrays of
+pixel offsets so that all stars are measured with a few vectorized gathers and reductions. The flux of the target
+relative to the sum of the comparison stars is also computed.
+
+Results are returned as a row of a structured array and can be streamed to a ``.npy`` or CSV file with
+:class:`PhotometryWriter`, so that raw frames need not be stored. Example::
+
+    phot = AperturePhotometry([(512.3, 380.1), (600.0, 421.7), (300.4, 500.2)], aperture=6, annulus=(10, 15))
+    with PhotometryWriter('transit.npy', phot.dtype) as writer:
+        run_photometry(camera, phot, writer, count=10000)
+"""
+
+import logging
+import os
+import time
+
+import numpy as np
+
+import zwoasi
+
+__author__ = 'Steve Marple'
+__license__ = 'MIT'
+
+logger = logging.getLogger(__name__)
+
+FLAG_EDGE = 1  # Aperture or annulus truncated by the edge of the image
+FLAG_NO_SIGNAL = 2  # Flux not positive; the star was not tracked
+
+
+class AperturePhotometry(object):
+    """Measure the stars at `positions`, a sequence of ``(x, y)`` pixel coordinates.
+
+    The flux is summed within `aperture` pixels of each star and the background is estimated from the annulus between
+    the radii given by `annulus`. `track` selects how the stars are followed: ``'common'`` moves all stars by the
+    median shift of their centroids (best for a rigid field), ``'individual'`` moves each star to its own centroid,
+    and ``None`` keeps the positions fixed. The shift per frame is limited to `max_shift` pixels. `target` is the
+    index of the target star and `comparisons` the indices of the comparison stars, by default all others; the
+    relative flux is NaN in frames where any of these stars is flagged. `gain` (in electrons per ADU) is used for the
+    error estimate."""
+    def __init__(self, positions, aperture=5.0, annulus=(8.0, 12.0), track='common', max_shift=3.0, target=0,
+                 comparisons=None, gain=1.0):
+        if annulus[0] < aperture or annulus[1] <= annulus[0]:
+            raise ValueError('Annulus must lie outside the aperture')
+        if track not in (None, 'common', 'individual'):
+            raise ValueError('Unknown tracking mode %s' % repr(track))
+        self.positions = np.array(positions, dtype=np.float64).reshape(-1, 2)
+        self.aperture = aperture
+        self.annulus = annulus
+        self.track = track
+        self.max_shift = max_shift
+        self.target = target
+        if comparisons is None:
+            comparisons = [i for i in range(len(self.positions)) if i != target]
+        self.comparisons = np.array(comparisons, dtype=np.intp)
+        self.gain = gain
+        self.frames = 0
+
+        n = len(self.positions)
+        self.radius = int(np.ceil(annulus[1]))
+        dy, dx = np.mgrid[-self.radius:self.radius + 1, -self.radius:self.radius + 1]
+        r = np.hypot(dx, dy).ravel()
+        self._dx = dx.ravel()
+        self._dy = dy.ravel()
+        self._aperture_pixels = np.flatnonzero(r <= aperture)
+        self._annulus_pixels = np.flatnonzero((r > annulus[0]) & (r <= annulus[1]))
+        self._ap_dx = self._dx[self._aperture_pixels].astype(np.float64)
+        self._ap_dy = self._dy[self._aperture_pixels].astype(np.float64)
+        self._width = None
+
+        self.dtype = np.dtype([('sequence', np.int64),
+                               ('timestamp', np.float64),
+                               ('x', np.float32, (n,)),
+                               ('y', np.float32, (n,)),
+                               ('flux', np.float64, (n,)),
+                               ('error', np.float32, (n,)),
+                               ('sky', np.float32, (n,)),
+                               ('flags', np.uint8, (n,)),
+                               ('relative_flux', np.float64),
+                               ('relative_error', np.float64)])
+        self._row = np.zeros(1, dtype=self.dtype)
+
+    def _offsets(self, width):
+        # Flat image offsets of the aperture and annulus pixels, which depend on the image width
+        if width != self._width:
+            offsets = self._dy * width + self._dx
+            self._ap_offsets = offsets[self._aperture_pixels]
+            self._an_offsets = offsets[self._annulus_pixels]
+            self._width = width
+        return self._ap_offsets, self._an_offsets
+
+    def process(self, img, timestamp=None, sequence=None):
+        """Measure the stars in `img`, a 2-d :class:`numpy.ndarray`, and update their tracked positions.
+
+        Returns a row of a structured array with dtype :attr:`dtype`; it is overwritten by the next call."""
+        if img.ndim != 2:
+            raise ValueError('Photometry requires a 2-d image')
+        height, width = img.shape
+        ap_offsets, an_offsets = self._offsets(width)
+        flat = img.reshape(-1)
+        r = self.radius
+
+        # Integer centres, kept far enough from the edges that every offset is inside the image
+        cx = np.rint(self.positions[:, 0]).astype(np.intp)
+        cy = np.rint(self.positions[:, 1]).astype(np.intp)
+        flags = ((cx < r) | (cx >= width - r) | (cy < r) | (cy >= height - r)).astype(np.uint8) * FLAG_EDGE
+        np.clip(cx, r, width - r - 1, out=cx)
+        np.clip(cy, r, height - r - 1, out=cy)
+        centres = cy * width + cx
+
+        ap = flat[centres[:, None] + ap_offsets].astype(np.float64)
+        an = flat[centres[:, None] + an_offsets].astype(np.float64)
+        sky = np.median(an, axis=1)
+        sky_std = an.std(axis=1)
+        ap -= sky[:, None]
+        flux = ap.sum(axis=1)
+        n_ap = len(ap_offsets)
+        n_an = len(an_offsets)
+        error = np.sqrt(np.maximum(flux, 0) / self.gain + n_ap * sky_std ** 2 * (1.0 + float(n_ap) / n_an))
+
+        # Intensity-weighted centroids from the background-subtracted aperture
+        np.maximum(ap, 0, out=ap)
+        weight = ap.sum(axis=1)
+        good = weight > 0
+        flags[~(flux > 0)] |= FLAG_NO_SIGNAL
+        with np.errstate(invalid='ignore', divide='ignore'):
+            x = cx + np.dot(ap, self._ap_dx) / weight
+            y = cy + np.dot(ap, self._ap_dy) / weight
+        x[~good] = self.positions[~good, 0]
+        y[~good] = self.positions[~good, 1]
+
+        if self.track is not None:
+            tracked = good & (flags == 0)  # Centroids of truncated or faint stars are unreliable
+            shift_x = x - self.positions[:, 0]
+            shift_y = y - self.positions[:, 1]
+            if self.track == 'common':
+                if tracked.any():
+                    shift_x[:] = np.median(shift_x[tracked])
+                    shift_y[:] = np.median(shift_y[tracked])
+                else:
+                    shift_x[:] = shift_y[:] = 0
+            else:
+                shift_x[~tracked] = 0
+                shift_y[~tracked] = 0
+            np.clip(shift_x, -self.max_shift, self.max_shift, out=shift_x)
+            np.clip(shift_y, -self.max_shift, self.max_shift, out=shift_y)
+            self.positions[:, 0] += shift_x
+            self.positions[:, 1] += shift_y
+
+        row = self._row[0]
+        row['sequence'] = self.frames if sequence is None else sequence
+        row['timestamp'] = np.nan if timestamp is None else timestamp
+        row['x'] = x
+        row['y'] = y
+        row['flux'] = flux
+        row['error'] = error
+        row['sky'] = sky
+        row['flags'] = flags
+        reference = flux[self.comparisons].sum() if len(self.comparisons) else np.nan
+        if flags[self.target] or flags[self.comparisons].any():
+            reference = np.nan  # Relative flux is unreliable if any star involved is flagged
+        with np.errstate(invalid='ignore', divide='ignore'):
+            relative = flux[self.target] / reference
+            row['relative_flux'] = relative
+            row['relative_error'] = abs(relative) * np.sqrt(
+                (error[self.target] / flux[self.target]) ** 2 +
+                np.sum(error[self.comparisons] ** 2) / reference ** 2)
+        self.frames += 1
+        return row
+
+
+class PhotometryWriter(object):
+    """Stream photometry results with the structured `dtype` to `filename`.
+
+    Files ending in ``.csv`` are written as comma separated text with one column per star and quantity; otherwise
+    a ``.npy`` file is written which can be read with :func:`numpy.load()`. The ``.npy`` header is updated every
+    `flush_interval` rows so that the file remains readable if the program stops unexpectedly."""
+    def __init__(self, filename, dtype, flush_interval=100):
+        self.filename = filename
+        self.dtype = np.dtype(dtype)
+        self.flush_interval = flush_interval
+        self.rows = 0
+        self._csv = os.path.splitext(filename)[1].lower() == '.csv'
+        if self._csv:
+            self._file = open(filename, 'w')
+            columns = []
+            for name in self.dtype.names:
+                shape = self.dtype[name].shape
+                if shape:
+                    columns.extend('%s_%d' % (name, i) for i in range(shape[0]))
+                else:
+                    columns.append(name)
+            self._file.write(','.join(columns) + '\n')
+        else:
+            self._file = open(filename, 'wb')
+            self._header_size = None
+            self._write_npy_header()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def _write_npy_header(self):
+        header = "{'descr': %s, 'fortran_order': False, 'shape': (%d,), }" % \
+            (repr(np.lib.format.dtype_to_descr(self.dtype)), self.rows)
+        if self._header_size is None:
+            # Leave room for the row count to grow, and align the data to 64 bytes as numpy does
+            self._header_size = len(header) + 21
+            self._header_size += -(self._header_size + 10) % 64
+        header = header.ljust(self._header_size - 1) + '\n'
+        self._file.seek(0)
+        self._file.write(b'\x93NUMPY\x01\x00' + np.uint16(len(header)).tobytes() + header.encode('latin1'))
+        self._file.seek(0, os.SEEK_END)
+
+    def write(self, row):
+        """Append a result row, as returned by :func:`AperturePhotometry.process()`."""
+        if self._csv:
+            values = []
+            for name in self.dtype.names:
+                value = row[name]
+                if np.ndim(value):
+                    values.extend('%.10g' % v for v in value)
+                else:
+                    values.append('%.10g' % value if name != 'sequence' else '%d' % value)
+            self._file.write(','.join(values) + '\n')
+        else:
+            self._file.write(np.asarray(row, dtype=self.dtype).tobytes())
+        self.rows += 1
+        if self.rows % self.flush_interval == 0:
+            self.flush()
+
+    def flush(self):
+        if not self._csv:
+            self._write_npy_header()
+        self._file.flush()
+
+    def close(self):
+        if self._file is None:
+            return
+        self.flush()
+        self._file.close()
+        self._file = None
+
+
+def run_photometry(camera, photometry, writer=None, count=None, callback=None, timeout=None, stop=None):
+    """Run `photometry` on the video stream from `camera`, writing each result to `writer` and passing it to
+    ``callback(row)`` if given.
+
+    Video capture is started if necessary and a single buffer is reused for every frame. Each row is timestamped
+    with the wall-clock time at which the frame was received and numbered by :attr:`AperturePhotometry.frames`; no
+    other metadata is read, so there are no SDK calls per frame beyond retrieving the image. The loop runs for
+    `count` frames or until `stop`, a :class:`threading.Event`, is set. Returns the number of frames processed."""
+    whbi = camera.get_roi_format()
+    buffer_ = bytearray(zwoasi.buffer_size(whbi))
+    started = not camera.video_active
+    if started:
+        camera.start_video_capture()
+    n = 0
+    try:
+        while (count is None or n < count) and (stop is None or not stop.is_set()):
+            img = camera.capture_video_frame(buffer_=buffer_, timeout=timeout)
+            row = photometry.process(img, time.time())
+            if writer is not None:
+                writer.write(row)
+            if callback is not None:
+                callback(row)
+            n += 1
+    finally:
+        if started:
+            camera.stop_video_capture()
+    return n
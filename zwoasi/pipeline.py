@@ -0,0 +1,285 @@
+"""Frame processing in a pool of worker processes.
+
+CPU-bound processing such as debayering, calibration or frame scoring does not run in parallel in threads because of
+the global interpreter lock. :class:`FramePipeline` allocates a ring of frame slots in shared memory; each frame is
+captured directly into a free slot and only the slot index is sent to a worker process, which runs a list of stages
+on a :class:`numpy.ndarray` view of the slot. Pixel data is never pickled, only the value returned by the last stage.
+Results are returned in the order in which the frames were captured. Example::
+
+    def calibrate(img):
+        img -= np.minimum(img, dark)
+        return img
+
+    def score(img):
+        return float(img.std())
+
+    if __name__ == '__main__':
+        with FramePipeline.for_camera(camera, [calibrate, score]) as pipeline:
+            for frame, result in pipeline.run(camera, count=1000):
+                print(frame.sequence, result)
+
+Stages are called as ``value = stage(value)``, the first receiving the image. They run in other processes so must be
+picklable, for instance functions defined at module level or :func:`functools.partial` objects, and any global data
+they use must be available in the workers. The first stage may modify the image in place. Requires Python 3.8 or
+later for :mod:`multiprocessing.shared_memory`.
+"""
+
+import collections
+import concurrent.futures
+import logging
+import os
+import queue
+import threading
+
+import numpy as np
+
+import zwoasi
+
+__author__ = 'Steve Marple'
+__license__ = 'MIT'
+
+logger = logging.getLogger(__name__)
+
+# State of a worker process: the shared memory, the array of all slots and the stages
+_worker = None
+
+
+def _init_worker(name, shape, dtype, stages):
+    global _worker
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(name=name)
+    _worker = (shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf), stages)
+
+
+def _ping():
+    return os.getpid()
+
+
+def _process(slot):
+    shm, frames, stages = _worker
+    value = frames[slot]
+    for stage in stages:
+        value = stage(value)
+    return value
+
+
+def frame_format(whbi):
+    """Shape and data type of the images for the ROI format `whbi`, as returned by :func:`Camera.get_roi_format()`.
+    Returns ``(shape, dtype)``."""
+    width, height, bins, image_type = whbi
+    if image_type == zwoasi.ASI_IMG_RAW16:
+        return (height, width), np.dtype(np.uint16)
+    elif image_type == zwoasi.ASI_IMG_RGB24:
+        return (height, width, 3), np.dtype(np.uint8)
+    elif image_type in (zwoasi.ASI_IMG_RAW8, zwoasi.ASI_IMG_Y8):
+        return (height, width), np.dtype(np.uint8)
+    raise ValueError('Unsupported image type')
+
+
+class FramePipeline(object):
+    """Process images of `shape` and `dtype` with `stages` in `workers` processes.
+
+    `workers` defaults to the number of CPUs and `slots`, the number of frames which can be held in shared memory,
+    to twice the number of workers. When all slots are in use :func:`acquire()` blocks until a worker has finished
+    with one. `mp_context` is passed to :class:`concurrent.futures.ProcessPoolExecutor` to select how the workers
+    are started."""
+    def __init__(self, shape, dtype, stages, workers=None, slots=None, mp_context=None):
+        from multiprocessing import shared_memory
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.stages = list(stages)
+        self.workers = workers or os.cpu_count() or 1
+        self.slots = slots or 2 * self.workers
+        self.frame_size = int(np.prod(self.shape)) * self.dtype.itemsize
+        self.submitted = 0
+        self.completed = 0
+        self._shm = shared_memory.SharedMemory(create=True, size=self.frame_size * self.slots)
+        self._frames = np.ndarray((self.slots,) + self.shape, dtype=self.dtype, buffer=self._shm.buf)
+        self._free = queue.Queue()
+        for i in range(self.slots):
+            self._free.put(i)
+        self._pending = collections.deque()
+        self._condition = threading.Condition()
+        self._executor = None
+        try:
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                self.workers, mp_context=mp_context, initializer=_init_worker,
+                initargs=(self._shm.name, self._frames.shape, self.dtype, self.stages))
+            # Start the workers now so that errors, such as stages which cannot be pickled, are reported here and
+            # not from the capture thread
+            for f in [self._executor.submit(_ping) for i in range(self.workers)]:
+                f.result()
+        except BaseException:
+            self.close()
+            raise
+        logger.debug('started %d workers with %d slots of %d bytes', self.workers, self.slots, self.frame_size)
+
+    @classmethod
+    def for_camera(cls, camera, stages, **kwargs):
+        """Create a pipeline for the images of `camera` at its current ROI format. Type :class:`FramePipeline`."""
+        shape, dtype = frame_format(camera.get_roi_format())
+        return cls(shape, dtype, stages, **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def __len__(self):
+        """Number of frames submitted whose results have not been retrieved."""
+        with self._condition:
+            return len(self._pending)
+
+    def acquire(self, timeout=None):
+        """Reserve a free slot and return its index, waiting up to `timeout` seconds.
+
+        Fill the slot through :func:`array()` or :func:`buffer()`, then pass it to :func:`submit_slot()` or return
+        it with :func:`release()`. Raises :class:`queue.Empty` if no slot became free in time."""
+        return self._free.get(timeout=timeout)
+
+    def release(self, slot):
+        """Return an unused slot obtained from :func:`acquire()`."""
+        self._free.put(slot)
+
+    def array(self, slot):
+        """View of `slot` as an image. Type :class:`numpy.ndarray`."""
+        return self._frames[slot]
+
+    def buffer(self, slot):
+        """View of `slot` as bytes, suitable as the `buffer_` argument of :func:`Camera.capture_video_frame()`.
+        Type :class:`memoryview`."""
+        return self._shm.buf[slot * self.frame_size:(slot + 1) * self.frame_size]
+
+    def submit_slot(self, slot, info=None):
+        """Queue the frame in `slot` for processing. `info` is returned with its result.
+
+        The slot is released automatically once the stages have run."""
+        future = self._executor.submit(_process, slot)
+        future.add_done_callback(lambda f: self._free.put(slot))
+        with self._condition:
+            self._pending.append((info, future))
+            self.submitted += 1
+            self._condition.notify_all()
+
+    def submit(self, img, info=None, timeout=None):
+        """Copy `img` into a free slot and queue it for processing.
+
+        Waits up to `timeout` seconds for a slot to become free."""
+        slot = self.acquire(timeout)
+        try:
+            np.copyto(self._frames[slot], img)
+        except BaseException:
+            self.release(slot)
+            raise
+        self.submit_slot(slot, info)
+
+    def capture(self, camera, timeout=None):
+        """Capture a video frame from `camera` directly into a free slot and queue it for processing.
+
+        Video capture must already be active. The :class:`Frame` metadata, without its image, is returned and is
+        also passed on with the result."""
+        slot = self.acquire()
+        try:
+            frame = camera.capture_video_frame(buffer_=self.buffer(slot), timeout=timeout, metadata=True)
+        except BaseException:
+            self.release(slot)
+            raise
+        frame.image = None  # The image is a view of the slot, which is reused once the stages have run
+        self.submit_slot(slot, frame)
+        return frame
+
+    def get(self, timeout=None):
+        """Retrieve the result of the oldest frame, waiting up to `timeout` seconds for it to be processed.
+
+        Returns ``(info, result)``, or ``None`` if no frames are pending. Exceptions raised by a stage are raised
+        here."""
+        with self._condition:
+            if not self._pending:
+                return None
+            info, future = self._pending[0]
+        try:
+            result = future.result(timeout)
+        finally:
+            if future.done():
+                with self._condition:
+                    self._pending.popleft()
+                    self.completed += 1
+        return info, result
+
+    def results(self, block=True):
+        """Generator of ``(info, result)`` for the pending frames, in order.
+
+        If `block` is false stop at the first frame which has not yet been processed."""
+        while True:
+            with self._condition:
+                if not self._pending or not (block or self._pending[0][1].done()):
+                    return
+            yield self.get()
+
+    def run(self, camera, count=None, timeout=None, stop=None):
+        """Capture video from `camera` in a separate thread and generate ``(frame, result)`` in order.
+
+        `frame` is the :class:`Frame` metadata of each image, without the image. Video capture is started if
+        necessary. Capture runs for `count` frames, until `stop`, a :class:`threading.Event`, is set, or until the
+        generator is closed; when all slots are busy the thread waits and the SDK drops frames, as recorded in
+        ``frame.dropped_frames``."""
+        shape, dtype = frame_format(camera.get_roi_format())
+        if shape != self.shape or dtype != self.dtype:
+            raise ValueError('Camera image format does not match pipeline')
+        finished = threading.Event()
+        halt = threading.Event()
+        errors = []
+
+        def capture():
+            n = 0
+            try:
+                while (count is None or n < count) and not halt.is_set() and (stop is None or not stop.is_set()):
+                    self.capture(camera, timeout)
+                    n += 1
+            except Exception as e:
+                errors.append(e)
+            finally:
+                with self._condition:
+                    finished.set()
+                    self._condition.notify_all()
+
+        started = not camera.video_active
+        if started:
+            camera.start_video_capture()
+        thread = threading.Thread(target=capture, name='zwoasi-pipeline')
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                with self._condition:
+                    while not self._pending and not finished.is_set():
+                        self._condition.wait()
+                    if not self._pending:
+                        break
+                yield self.get()
+            if errors:
+                raise errors[0]
+        finally:
+            halt.set()
+            thread.join()
+            if started:
+                camera.stop_video_capture()
+
+    def close(self, wait=True):
+        """Shut down the workers and free the shared memory.
+
+        Results not yet retrieved are discarded. If `wait` is true the workers finish their current frames first."""
+        if self._shm is None:
+            return
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+        self._pending.clear()
+        self._frames = None
+        try:
+            self._shm.close()
+        except BufferError:
+            logger.warning('shared memory still in use; views of slots must be deleted before closing')
+        self._shm.unlink()
+        self._shm = None
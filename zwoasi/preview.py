@@ -0,0 +1,209 @@
+"""Live preview of camera images in a web browser.
+
+:class:`PreviewServer` serves a Motion JPEG stream over HTTP. The acquisition loop hands each frame to
+:func:`PreviewServer.publish()`, which never blocks: frames arriving faster than the preview rate, or while the
+encoder is busy, are simply skipped. Accepted frames are decimated with a strided view, copied, and then stretched
+and JPEG-encoded in a worker thread. Each client is sent the most recent JPEG when it is ready for one, so a slow
+client misses frames rather than delaying other clients or the capture. Requires :mod:`PIL`. Example::
+
+    server = PreviewServer(port=8080)
+    server.start()
+    camera.start_video_capture()
+    while True:
+        server.publish(camera.capture_video_frame())
+
+Then browse to ``http://localhost:8080/``."""
+
+import concurrent.futures
+import io
+import logging
+import threading
+import time
+
+import numpy as np
+
+__author__ = 'Steve Marple'
+__license__ = 'MIT'
+
+logger = logging.getLogger(__name__)
+
+_BOUNDARY = 'zwoasi-frame'
+
+_index_html = '''<!DOCTYPE html>
+<html><head><title>zwoasi preview</title></head>
+<body style="margin:0;background:#000"><img src="stream.mjpg" style="max-width:100%;max-height:100vh"></body>
+</html>
+'''
+
+
+def autostretch(img, low=0.5, high=99.5, out=None):
+    """Linearly stretch `img` to 8 bits between the `low` and `high` percentiles. Type :class:`numpy.ndarray`.
+
+    The percentiles are estimated from a subsample of at most about 64k pixels."""
+    step = max(1, int(np.sqrt(img.size / 65536.0)))
+    lo, hi = np.percentile(img[::step, ::step], (low, high))
+    if hi <= lo:
+        hi = lo + 1
+    if out is None:
+        out = np.empty(img.shape, dtype=np.uint8)
+    work = np.subtract(img, np.float32(lo), dtype=np.float32)
+    np.multiply(work, np.float32(255.0 / (hi - lo)), out=work)
+    np.clip(work, 0, 255, out=work)
+    np.copyto(out, work, casting='unsafe')
+    return out
+
+
+class PreviewServer(object):
+    """Serve a decimated, stretched Motion JPEG preview stream.
+
+    At most `max_fps` frames per second are encoded. Images are decimated by taking every `decimate` th pixel in
+    each direction. `stretch` enables :func:`autostretch()`; otherwise 16 bit images are reduced to 8 bits by
+    discarding the least significant byte. By default the server only listens on the loopback interface."""
+    def __init__(self, port=8080, address='127.0.0.1', max_fps=5.0, decimate=4, stretch=True, quality=75,
+                 workers=1):
+        self.port = port
+        self.address = address
+        self.max_fps = max_fps
+        self.decimate = decimate
+        self.stretch = stretch
+        self.quality = quality
+        self.published = 0
+        self.encoded = 0
+        self.skipped = 0
+        self._workers = workers
+        self._busy = 0
+        self._last_accept = None
+        self._jpeg = None
+        self._jpeg_sequence = 0
+        self._condition = threading.Condition()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._server = None
+
+    def start(self):
+        """Start the HTTP server and encoder threads."""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        preview = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                if path in ('/', '/index.html'):
+                    self._send(_index_html.encode(), 'text/html')
+                elif path == '/snapshot.jpg':
+                    jpeg, sequence = preview.wait_for_jpeg(0, timeout=10)
+                    if jpeg is None:
+                        self.send_error(503, 'No image available')
+                    else:
+                        self._send(jpeg, 'image/jpeg')
+                elif path == '/stream.mjpg':
+                    self._stream()
+                else:
+                    self.send_error(404)
+
+            def _send(self, body, content_type):
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _stream(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=' + _BOUNDARY)
+                self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
+                sequence = 0
+                try:
+                    while preview._server is not None:
+                        jpeg, sequence = preview.wait_for_jpeg(sequence, timeout=1)
+                        if jpeg is None:
+                            continue
+                        self.wfile.write(('--%s\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n'
+                                          % (_BOUNDARY, len(jpeg))).encode())
+                        self.wfile.write(jpeg)
+                        self.wfile.write(b'\r\n')
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+        self._executor = concurrent.futures.ThreadPoolExecutor(self._workers, thread_name_prefix='zwoasi-preview')
+        self._server = ThreadingHTTPServer((self.address, self.port), Handler)
+        self._server.daemon_threads = True
+        thread = threading.Thread(target=self._server.serve_forever, name='zwoasi-preview-http')
+        thread.daemon = True
+        thread.start()
+        logger.info('preview server listening on http://%s:%d/', self.address, self.port)
+
+    def stop(self):
+        """Stop the HTTP server and encoder threads."""
+        server = self._server
+        self._server = None
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        with self._condition:
+            self._condition.notify_all()
+
+    def publish(self, img):
+        """Offer a frame for preview. Returns ``True`` if it was accepted for encoding.
+
+        This never blocks; if the frame rate limit has been reached or all encoder threads are busy the frame is
+        skipped. Only a decimated copy of the image is retained so the caller may reuse its buffer."""
+        self.published += 1
+        now = time.monotonic()
+        with self._lock:
+            if self._executor is None or self._busy >= self._workers or \
+                    (self._last_accept is not None and now - self._last_accept < 1.0 / self.max_fps):
+                self.skipped += 1
+                return False
+            self._busy += 1
+            self._last_accept = now
+        d = self.decimate
+        small = np.array(img[::d, ::d], copy=True)
+        try:
+            self._executor.submit(self._encode, small)
+        except RuntimeError:
+            with self._lock:
+                self._busy -= 1  # Executor shut down
+            return False
+        return True
+
+    def _encode(self, img):
+        from PIL import Image
+        try:
+            if self.stretch:
+                img = autostretch(img)
+            elif img.dtype != np.uint8:
+                img = (img >> 8).astype(np.uint8)
+            if img.ndim == 3:
+                img = img[:, :, ::-1]  # Convert BGR to RGB
+            f = io.BytesIO()
+            Image.fromarray(np.ascontiguousarray(img)).save(f, format='JPEG', quality=self.quality)
+            with self._condition:
+                self._jpeg = f.getvalue()
+                self._jpeg_sequence += 1
+                self.encoded += 1
+                self._condition.notify_all()
+        except Exception:
+            logger.exception('could not encode preview image')
+        finally:
+            with self._lock:
+                self._busy -= 1
+
+    def wait_for_jpeg(self, sequence, timeout=None):
+        """Wait for a JPEG newer than `sequence`. Returns a tuple ``(jpeg, sequence)``.
+
+        `jpeg` is ``None`` if no new image became available within `timeout` seconds."""
+        with self._condition:
+            if self._jpeg_sequence <= sequence:
+                self._condition.wait(timeout)
+            if self._jpeg_sequence <= sequence:
+                return None, sequence
+            return self._jpeg, self._jpeg_sequence
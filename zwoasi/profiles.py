@@ -0,0 +1,162 @@
+"""Named camera configuration profiles.
+
+A profile is a :class:`dict` describing a camera configuration: ``roi`` as ``[start_x, start_y, width, height]``,
+``bins``, ``image_type``, ``mode`` (for trigger cameras) and ``controls``, a :class:`dict` mapping control names to
+``[value, auto]``. Any key may be omitted to leave that part of the configuration unchanged. Profiles can be read
+from the camera with :func:`get_profile()` and stored in a JSON file with :func:`save_profiles()`.
+
+:class:`ProfileSwitcher` applies profiles to a camera. It keeps a copy of the camera configuration so that only
+the settings which differ are sent to the SDK, in an order the SDK accepts. Example::
+
+    switcher = ProfileSwitcher(camera)
+    profiles = load_profiles('profiles.json')
+    switcher.apply(profiles['planetary'])
+    ...
+    switcher.apply(profiles['deep-sky'])
+"""
+
+import json
+import logging
+import os
+import time
+
+import zwoasi
+
+__author__ = 'Steve Marple'
+__license__ = 'MIT'
+
+logger = logging.getLogger(__name__)
+
+
+def _writable_controls(camera):
+    return dict((k, v) for k, v in camera.get_controls().items() if v['IsWritable'])
+
+
+def get_profile(camera, controls=None):
+    """Read the current configuration of `camera` as a profile. Type :class:`dict`.
+
+    `controls` is a list of the control names to include; by default all writable controls are included."""
+    caps = _writable_controls(camera)
+    if controls is None:
+        controls = sorted(caps)
+    whbi = camera.get_roi_format()
+    profile = {'roi': camera.get_roi_start_position() + whbi[0:2],
+               'bins': whbi[2],
+               'image_type': whbi[3],
+               'controls': {}}
+    if camera.get_camera_property().get('IsTriggerCam'):
+        profile['mode'] = camera.get_camera_mode()
+    for name in controls:
+        value, auto = camera.get_control_value(caps[name]['ControlType'])
+        profile['controls'][name] = [value, auto]
+    return profile
+
+
+def load_profiles(filename):
+    """Load profiles from a JSON file. Returns a :class:`dict` mapping profile names to profiles."""
+    with open(filename) as f:
+        return json.load(f)
+
+
+def save_profiles(filename, profiles):
+    """Save `profiles`, a :class:`dict` mapping profile names to profiles, to a JSON file.
+
+    The file is replaced atomically so that an interrupted save does not lose existing profiles."""
+    tmp = '%s.tmp' % filename
+    with open(tmp, 'w') as f:
+        json.dump(profiles, f, indent=2, sort_keys=True)
+    os.replace(tmp, filename)
+
+
+class ProfileSwitcher(object):
+    """Apply profiles to `camera`, issuing only the SDK calls needed.
+
+    The current configuration is read once when the switcher is created and then tracked as profiles are applied.
+    If the camera is reconfigured by other means call :func:`refresh()` before applying the next profile."""
+    def __init__(self, camera):
+        self.camera = camera
+        self._caps = _writable_controls(camera)
+        self._is_trigger_cam = bool(camera.get_camera_property().get('IsTriggerCam'))
+        self.calls = 0
+        self.refresh()
+
+    def refresh(self):
+        """Re-read the camera configuration."""
+        self.state = get_profile(self.camera)
+
+    def diff(self, profile):
+        """Determine which settings of `profile` differ from the current configuration.
+
+        Returns a :class:`dict` containing only the differing entries; ``controls`` is omitted if no control
+        differs."""
+        state = self.state
+        changes = {}
+        for key in ('roi', 'bins', 'image_type', 'mode'):
+            if key == 'mode' and not self._is_trigger_cam:
+                continue
+            value = profile.get(key)
+            if key == 'roi' and value is not None:
+                value = list(value)
+            if value is not None and value != state[key]:
+                changes[key] = value
+        controls = {}
+        for name, (value, auto) in profile.get('controls', {}).items():
+            if name not in self._caps:
+                raise ValueError('Unknown or read-only control %s' % repr(name))
+            current = state['controls'].get(name)
+            # The value of a control under automatic adjustment is irrelevant
+            if current is None or bool(auto) != current[1] or (not auto and value != current[0]):
+                controls[name] = [value, bool(auto)]
+        if controls:
+            changes['controls'] = controls
+        return changes
+
+    def apply(self, profile):
+        """Apply `profile` to the camera. Returns the changes made, as given by :func:`diff()`.
+
+        Video capture is stopped while the ROI size, binning, image type or camera mode are changed and then
+        restarted."""
+        t0 = time.monotonic()
+        camera = self.camera
+        state = self.state
+        changes = self.diff(profile)
+        roi = list(changes.get('roi', state['roi']))
+        format_changed = 'mode' in changes or 'bins' in changes or 'image_type' in changes or \
+            roi[2:] != state['roi'][2:]
+        restart_video = format_changed and camera.video_active
+        if restart_video:
+            camera.stop_video_capture()
+            self.calls += 1
+        try:
+            if 'mode' in changes:
+                camera.set_camera_mode(changes['mode'])
+                state['mode'] = changes['mode']
+                self.calls += 1
+            if format_changed:
+                bins = changes.get('bins', state['bins'])
+                image_type = changes.get('image_type', state['image_type'])
+                camera.set_roi_format(roi[2], roi[3], bins, image_type)
+                state['roi'][2:] = roi[2:]
+                state['bins'] = bins
+                state['image_type'] = image_type
+                self.calls += 1
+            if roi[0:2] != state['roi'][0:2] or format_changed:
+                # The SDK may move the start position when the ROI size changes, so always set it afterwards
+                camera.set_roi_start_position(roi[0], roi[1])
+                state['roi'][0:2] = roi[0:2]
+                self.calls += 1
+            for name, (value, auto) in changes.get('controls', {}).items():
+                if auto and value is None:
+                    value = state['controls'].get(name, [self._caps[name]['DefaultValue']])[0]
+                camera.set_control_value(self._caps[name]['ControlType'], value, auto)
+                state['controls'][name] = [value, auto]
+                self.calls += 1
+        except Exception:
+            self.refresh()  # Configuration only partially applied
+            raise
+        finally:
+            if restart_video:
+                camera.start_video_capture()
+                self.calls += 1
+        logger.debug('profile applied in %.3f s: %s', time.monotonic() - t0, changes)
+        return changes
@@ -0,0 +1,86 @@
+"""Tracing of the capture path using the :class:`zwoasi.Camera` hooks.
+
+:class:`TraceRecorder` attaches to one or more cameras with :func:`zwoasi.Camera.add_hook()` and converts the hook
+timestamps into duration events for each stage of a capture (exposure, data transfer, conversion to
+:class:`numpy.ndarray` and saving). The trace can be written as Chrome trace JSON for viewing with
+``chrome://tracing`` or Perfetto."""
+
+import collections
+import json
+import logging
+import os
+import threading
+import time
+
+import zwoasi
+
+__author__ = 'Steve Marple'
+__license__ = 'MIT'
+
+logger = logging.getLogger(__name__)
+
+# Each stage is delimited by the hook event which starts it and the one which ends it.
+_stages = {zwoasi.HOOK_EXPOSURE_END: ('exposure', zwoasi.HOOK_EXPOSURE_START),
+           zwoasi.HOOK_TRANSFER_END: ('transfer', zwoasi.HOOK_TRANSFER_START),
+           zwoasi.HOOK_CONVERT_END: ('convert', zwoasi.HOOK_TRANSFER_END),
+           zwoasi.HOOK_SAVE_END: ('save', zwoasi.HOOK_CONVERT_END)}
+
+
+class TraceRecorder(object):
+    """Record capture path stages as Chrome trace events.
+
+    Attach cameras with :func:`attach()`, capture as normal, then call :func:`save()`. Timestamps in the trace are
+    microseconds relative to the creation of the recorder. At most `max_events` events are kept; older events are
+    discarded once the limit is reached."""
+    def __init__(self, max_events=1000000):
+        self.max_events = max_events
+        self.events = collections.deque(maxlen=max_events)
+        self._lock = threading.Lock()
+        self._origin = time.monotonic()
+        self._pid = os.getpid()
+
+    def attach(self, camera):
+        """Register the recorder's hooks with `camera`."""
+        for event in zwoasi._hook_events:
+            camera.add_hook(event, self._hook)
+
+    def detach(self, camera):
+        """Unregister the recorder's hooks from `camera`."""
+        for event in zwoasi._hook_events:
+            camera.remove_hook(event, self._hook)
+
+    def _hook(self, camera, event, timestamp, info):
+        stamps = info.setdefault('timestamps', {})
+        stamps[event] = timestamp
+        if event not in _stages:
+            return
+        name, start_event = _stages[event]
+        start = stamps.get(start_event)
+        if start is None:
+            return
+        record = {'name': name,
+                  'cat': info.get('mode', 'capture'),
+                  'ph': 'X',
+                  'ts': (start - self._origin) * 1e6,
+                  'dur': (timestamp - start) * 1e6,
+                  'pid': self._pid,
+                  'tid': threading.current_thread().name,
+                  'args': {'camera': camera.id, 'sequence': info.get('sequence')}}
+        with self._lock:
+            self.events.append(record)
+
+    def clear(self):
+        """Discard all recorded events."""
+        with self._lock:
+            self.events.clear()
+
+    def get_trace(self):
+        """Retrieve the trace in Chrome trace format. Type :class:`dict`."""
+        with self._lock:
+            return {'traceEvents': list(self.events), 'displayTimeUnit': 'ms'}
+
+    def save(self, filename):
+        """Write the trace as Chrome trace JSON to `filename`."""
+        with open(filename, 'w') as f:
+            json.dump(self.get_trace(), f)
+        logger.debug('wrote %s', filename)
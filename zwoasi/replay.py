@@ -0,0 +1,219 @@
+"""Recording and replay of SDK sessions.
+
+:func:`start_recording()` replaces the library object used by :mod:`zwoasi` with a proxy that logs every ``ASI*``
+call to a file: the arguments, the values returned through pointer arguments, the return code and the time taken.
+Image data can optionally be recorded too. :class:`ReplayLibrary` reads such a file and acts as the SDK library,
+returning the recorded results, so that a session can be re-run on a computer without cameras, for instance to
+benchmark changes to the code calling the SDK. Example::
+
+    # With cameras connected
+    zwoasi.replay.start_recording('session.rec', frames=True)
+    run_session()
+    zwoasi.replay.stop_recording()
+
+    # Elsewhere, before the library is used
+    zwoasi.init(zwoasi.replay.ReplayLibrary('session.rec', speed=0))
+    run_session()
+
+The file is a stream of :mod:`pickle` records; only open recordings from trusted sources."""
+
+import collections
+import ctypes as c
+import logging
+import pickle
+import threading
+import time
+
+import zwoasi
+
+__author__ = 'Steve Marple'
+__license__ = 'MIT'
+
+logger = logging.getLogger(__name__)
+
+_FORMAT = 'zwoasi-replay'
+_VERSION = 1
+
+# Kinds of recorded argument
+_VALUE = 0  # Passed by value, not recorded
+_SIMPLE = 1  # ctypes simple type passed by reference, its value after the call
+_STRUCT = 2  # ctypes structure, its contents after the call
+_DATA = 3  # Image buffer, its size and optionally its contents after the call
+
+
+def _encode_args(args, frames):
+    encoded = []
+    for a in args:
+        if isinstance(a, c._SimpleCData):
+            encoded.append((_SIMPLE, a.value))
+        elif isinstance(a, c.Structure):
+            encoded.append((_STRUCT, c.string_at(c.addressof(a), c.sizeof(a))))
+        elif isinstance(a, c.Array):
+            encoded.append((_DATA, c.sizeof(a), c.string_at(c.addressof(a), c.sizeof(a)) if frames else None))
+        else:
+            encoded.append((_VALUE, a))
+    return encoded
+
+
+class _RecordingLibrary(zwoasi._LibraryProxy):
+    """Proxy for the SDK library which records every ``ASI*`` call."""
+    def __init__(self, library, file, frames):
+        zwoasi._LibraryProxy.__init__(self, library)
+        self._file = file
+        self._frames = frames
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter()
+        self.calls = 0
+
+    def _call(self, name, func, args):
+        t0 = time.perf_counter()
+        r = func(*args)
+        t1 = time.perf_counter()
+        self._record(name, args, r, t0, t1 - t0)
+        return r
+
+    def _record(self, name, args, r, t0, elapsed):
+        record = (name, _encode_args(args, self._frames), r, t0 - self._t0, elapsed,
+                  threading.current_thread().name)
+        with self._lock:
+            if self._file is None:
+                return
+            pickle.dump(record, self._file, pickle.HIGHEST_PROTOCOL)
+            self.calls += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+            self._file = None
+
+
+def start_recording(filename, frames=False):
+    """Record all subsequent SDK calls to `filename`.
+
+    If `frames` is true the image data transferred is recorded as well, otherwise only its size is kept. Recording
+    can be combined with :mod:`zwoasi.metrics` but they must be disabled in the reverse order of enabling."""
+    if is_recording():
+        raise zwoasi.ZWO_Error('SDK calls are already being recorded')
+    f = open(filename, 'wb')
+    pickle.dump({'format': _FORMAT, 'version': _VERSION, 'created': time.time(), 'frames': frames}, f,
+                pickle.HIGHEST_PROTOCOL)
+    zwoasi.zwolib = _RecordingLibrary(zwoasi.zwolib, f, frames)
+    logger.debug('recording SDK calls to %s', filename)
+
+
+def stop_recording():
+    """Stop recording SDK calls and close the recording. Returns the number of calls recorded."""
+    if not is_recording():
+        return 0
+    recorder = zwoasi.zwolib
+    zwoasi.zwolib = recorder._library
+    recorder.close()
+    logger.debug('recorded %d SDK calls', recorder.calls)
+    return recorder.calls
+
+
+def is_recording():
+    """Indicate if SDK calls are being recorded. Type :class:`bool`."""
+    return isinstance(zwoasi.zwolib, _RecordingLibrary)
+
+
+def read_recording(filename):
+    """Read a recording. Returns a tuple of the header :class:`dict` and a generator of the calls.
+
+    Each call is a :class:`dict` with the keys ``name``, ``args``, ``return``, ``time`` (seconds since recording
+    started), ``duration`` and ``thread``."""
+    f = open(filename, 'rb')
+    header = pickle.load(f)
+    if not isinstance(header, dict) or header.get('format') != _FORMAT:
+        f.close()
+        raise ValueError('%s is not a zwoasi recording' % filename)
+    if header['version'] > _VERSION:
+        f.close()
+        raise ValueError('Unsupported recording version %s' % header['version'])
+
+    def calls():
+        with f:
+            while True:
+                try:
+                    name, args, r, t, duration, thread = pickle.load(f)
+                except EOFError:
+                    return
+                yield {'name': name, 'args': args, 'return': r, 'time': t, 'duration': duration,
+                       'thread': thread}
+
+    return header, calls()
+
+
+class ReplayLibrary(object):
+    """Replay a recorded SDK session in place of the SDK library, see :func:`zwoasi.init()`.
+
+    Calls are matched to the recording by function name and camera ID, in the order they were recorded, so calls
+    made from several threads need not be interleaved exactly as they were. Values are written back to pointer
+    arguments and image buffers (if image data was recorded) and the recorded return code is returned.
+
+    Each call takes the recorded time divided by `speed`; use ``speed=1`` for the original timing, a larger value to
+    accelerate, or ``0`` to return immediately. Time spent outside the SDK is not simulated since that is what is
+    being measured.
+
+    Code under test may make more calls than were recorded, for instance to poll the exposure status. Once the
+    recorded calls of a function are exhausted the last one is repeated; if there is none error code 1 (invalid
+    index) is returned. If `strict` is true :class:`zwoasi.ZWO_Error` is raised instead in both cases."""
+    def __init__(self, filename, speed=1.0, strict=False):
+        self.filename = filename
+        self.speed = speed
+        self.strict = strict
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._queues = collections.defaultdict(collections.deque)
+        self._last = {}
+        self.header, calls = read_recording(filename)
+        n = 0
+        for call in calls:
+            args = call['args']
+            key = (call['name'], zwoasi._camera_id(call['name'], [a[1] for a in args]))
+            self._queues[key].append((args, call['return'], call['duration']))
+            n += 1
+        logger.debug('loaded %d SDK calls from %s', n, filename)
+
+    def __getattr__(self, name):
+        if not name.startswith('ASI'):
+            raise AttributeError(name)
+
+        def replay(*args):
+            return self._replay(name, args)
+
+        replay.__name__ = name
+        return replay
+
+    def remaining(self):
+        """Number of recorded calls not yet replayed. Type :class:`int`."""
+        with self._lock:
+            return sum(len(q) for q in self._queues.values())
+
+    def _replay(self, name, args):
+        key = (name, zwoasi._camera_id(name, [getattr(a, 'value', a) for a in args]))
+        with self._lock:
+            queue = self._queues.get(key)
+            if queue:
+                entry = self._last[key] = queue.popleft()
+            elif self.strict:
+                entry = None
+            else:
+                entry = self._last.get(key)
+            self.calls += 1
+        if entry is None:
+            if self.strict:
+                raise zwoasi.ZWO_Error('No recorded call %s for camera %s' % (name, key[1]))
+            return 1
+        recorded, r, duration = entry
+        t0 = time.perf_counter()
+        for a, (kind, value) in zip(args, [(e[0], e[-1]) for e in recorded]):
+            if kind == _SIMPLE:
+                a.value = value
+            elif kind == _STRUCT or (kind == _DATA and value is not None):
+                c.memmove(c.addressof(a), value, min(len(value), c.sizeof(a)))
+        if self.speed:
+            delay = duration / self.speed - (time.perf_counter() - t0)
+            if delay > 0:
+                time.sleep(delay)
+        return r
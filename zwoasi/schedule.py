@@ -0,0 +1,187 @@
+"""Drift-free interval (timelapse) capture.
+
+:class:`IntervalScheduler` starts still exposures at deadlines computed from a fixed origin on the monotonic clock,
+so that variations in exposure, readout and processing time do not accumulate. Completed frames are passed to a
+writer callback running in its own thread. Example::
+
+    def write(frame):
+        numpy.save('frame_%06d.npy' % frame.sequence, frame.image)
+
+    scheduler = IntervalScheduler(camera, 10.0, align=True, writer=write)
+    scheduler.run(count=360)
+    print(scheduler.get_stats())
+"""
+
+import logging
+import math
+import queue
+import threading
+import time
+
+import zwoasi
+
+__author__ = 'Steve Marple'
+__license__ = 'MIT'
+
+logger = logging.getLogger(__name__)
+
+
+class IntervalScheduler(object):
+    """Capture still images from `camera` every `interval` seconds.
+
+    If `align` is true the first exposure starts on a wall-clock time which is a whole multiple of `interval`
+    (e.g. on the minute for ``interval=60``), otherwise it starts immediately. Each exposure is started at its
+    deadline by sleeping until `spin` seconds beforehand and then busy-waiting. If a deadline has already passed
+    when the camera becomes free the slot is skipped and counted in ``missed``, keeping later exposures on the
+    original cadence.
+
+    `writer` is called as ``writer(frame)`` with a :class:`zwoasi.Frame` for each image, from a separate thread.
+    Frames are held in a pool of `buffers` preallocated buffers; the image data is only valid until the writer
+    returns. If the writer falls behind the scheduler waits for a free buffer before reading out the image, which
+    may cause later slots to be missed."""
+    def __init__(self, camera, interval, align=False, writer=None, buffers=4, spin=0.002, poll=0.001,
+                 is_dark=False):
+        if interval <= 0:
+            raise ValueError('interval must be positive')
+        self.camera = camera
+        self.interval = float(interval)
+        self.align = align
+        self.writer = writer
+        self.buffers = buffers
+        self.spin = spin
+        self.poll = poll
+        self.is_dark = is_dark
+        self._stop = threading.Event()
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Reset the lateness statistics."""
+        self.frames = 0
+        self.missed = 0
+        self._lateness_mean = 0.0
+        self._lateness_m2 = 0.0
+        self._lateness_max = 0.0
+
+    def _record_lateness(self, lateness):
+        # Welford's running mean and variance
+        self.frames += 1
+        delta = lateness - self._lateness_mean
+        self._lateness_mean += delta / self.frames
+        self._lateness_m2 += delta * (lateness - self._lateness_mean)
+        if lateness > self._lateness_max:
+            self._lateness_max = lateness
+
+    def get_stats(self):
+        """Retrieve exposure start lateness statistics. Type :class:`dict`.
+
+        Lateness is the difference (seconds) between the deadline and the moment ``ASIStartExposure`` was called."""
+        std = math.sqrt(self._lateness_m2 / (self.frames - 1)) if self.frames > 1 else 0.0
+        return {'frames': self.frames,
+                'missed': self.missed,
+                'lateness_mean': self._lateness_mean,
+                'lateness_std': std,
+                'lateness_max': self._lateness_max}
+
+    def stop(self):
+        """Request :func:`run()` to return after the current exposure."""
+        self._stop.set()
+
+    def _first_deadline(self):
+        now = time.monotonic()
+        if not self.align:
+            return now
+        wall = time.time()
+        aligned = math.ceil(wall / self.interval) * self.interval
+        return now + (aligned - wall)
+
+    def _wait_until(self, deadline):
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            if remaining > self.spin:
+                # Wake early in case of stop requests and to absorb sleep overshoot
+                if self._stop.wait(min(remaining - self.spin, 1.0)):
+                    return
+
+    def run(self, count=None, duration=None):
+        """Capture frames until `count` frames have been taken, `duration` seconds have elapsed or :func:`stop()`
+        is called. Returns the statistics from :func:`get_stats()`."""
+        camera = self.camera
+        whbi = camera.get_roi_format()
+        metadata = zwoasi.FrameMetadata(camera, whbi, video=False)
+        if metadata.exposure / 1e6 >= self.interval:
+            logger.warning('exposure (%g s) is not shorter than interval (%g s)', metadata.exposure / 1e6,
+                           self.interval)
+
+        sz = zwoasi.buffer_size(whbi)
+        free = queue.Queue()
+        for i in range(self.buffers):
+            free.put(bytearray(sz))
+        pending = queue.Queue()
+        writer_error = []
+
+        def write():
+            while True:
+                item = pending.get()
+                if item is None:
+                    return
+                frame, buf = item
+                try:
+                    if self.writer is not None and not writer_error:
+                        self.writer(frame)
+                except Exception as e:
+                    writer_error.append(e)
+                    self._stop.set()
+                free.put(buf)
+
+        writer_thread = threading.Thread(target=write, name='zwoasi-schedule-writer')
+        writer_thread.daemon = True
+        writer_thread.start()
+
+        self._stop.clear()
+        origin = self._first_deadline()
+        end = None if duration is None else origin + duration
+        slot = 0
+        taken = 0
+        try:
+            while not self._stop.is_set() and (count is None or taken < count):
+                deadline = origin + slot * self.interval
+                if end is not None and deadline >= end:
+                    break
+                self._wait_until(deadline)
+                if self._stop.is_set():
+                    break
+                t_start = time.monotonic()
+                camera.start_exposure(self.is_dark)
+                self._record_lateness(t_start - deadline)
+
+                while camera.get_exposure_status() == zwoasi.ASI_EXP_WORKING:
+                    if self.poll:
+                        time.sleep(self.poll)
+                status = camera.get_exposure_status()
+                if status != zwoasi.ASI_EXP_SUCCESS:
+                    raise zwoasi.ZWO_CaptureError('Could not capture image', status)
+                buf = free.get()
+                camera.get_data_after_exposure(buf)
+                t_end = time.monotonic()
+                wall_clock = time.time()
+                taken += 1
+                frame = metadata.frame(zwoasi.image_from_buffer(buf, whbi), t_start, t_end, wall_clock,
+                                       sequence=camera.next_frame_sequence())
+                pending.put((frame, buf))
+
+                # Next slot whose deadline has not yet passed
+                next_slot = slot + 1
+                late_slot = int(math.floor((time.monotonic() - origin) / self.interval)) + 1
+                if late_slot > next_slot:
+                    self.missed += late_slot - next_slot
+                    logger.debug('missed %d slot(s)', late_slot - next_slot)
+                    next_slot = late_slot
+                slot = next_slot
+        finally:
+            pending.put(None)
+            writer_thread.join()
+        if writer_error:
+            raise writer_error[0]
+        return self.get_stats()
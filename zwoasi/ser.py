@@ -0,0 +1,128 @@
+"""Writing of SER video files.
+
+SER is a simple uncompressed video format widely used for planetary imaging. The file holds a fixed size header,
+the frames in order and a trailer of per-frame timestamps. :class:`SerWriter` accepts frames as raw buffers from
+:func:`zwoasi.Camera.get_video_data()` so that no conversion is needed while recording. Example::
+
+    camera.start_video_capture()
+    buffer_ = bytearray(camera.get_roi_format()[0] * camera.get_roi_format()[1] * 2)
+    with SerWriter.for_camera(camera, 'capture.ser') as ser:
+        for n in range(1000):
+            ser.write(camera.get_video_data(buffer_=buffer_))
+"""
+
+import logging
+import struct
+import time
+
+import zwoasi
+
+__author__ = 'Steve Marple'
+__license__ = 'MIT'
+
+logger = logging.getLogger(__name__)
+
+SER_MONO = 0
+SER_BAYER_RGGB = 8
+SER_BAYER_GRBG = 9
+SER_BAYER_GBRG = 10
+SER_BAYER_BGGR = 11
+SER_RGB = 100
+SER_BGR = 101
+
+_bayer_color_ids = {zwoasi.ASI_BAYER_RG: SER_BAYER_RGGB,
+                    zwoasi.ASI_BAYER_BG: SER_BAYER_BGGR,
+                    zwoasi.ASI_BAYER_GR: SER_BAYER_GRBG,
+                    zwoasi.ASI_BAYER_RB: SER_BAYER_GBRG}  # ASI_BAYER_RB is the GB pattern
+
+_header = struct.Struct('<14siiiiiii40s40s40sqq')
+
+# Offset of the SER epoch (0001-01-01) from the Unix epoch, in seconds
+_EPOCH_OFFSET = 62135596800
+
+
+def _ser_time(t):
+    # SER timestamps count 100 ns intervals since 0001-01-01
+    return int((t + _EPOCH_OFFSET) * 10000000)
+
+
+def ser_color_id(camera_info, image_type):
+    """Determine the SER colour ID for images of `image_type` from a camera with properties `camera_info`."""
+    if image_type == zwoasi.ASI_IMG_RGB24:
+        return SER_BGR
+    if image_type == zwoasi.ASI_IMG_Y8 or not camera_info.get('IsColorCam'):
+        return SER_MONO
+    return _bayer_color_ids.get(camera_info.get('BayerPattern'), SER_MONO)
+
+
+class SerWriter(object):
+    """Write frames of `width` by `height` pixels to the SER file `filename`.
+
+    `depth` is the number of bits per pixel and colour plane (8 or 16) and `color_id` one of the ``SER_*``
+    constants. Frame timestamps are recorded unless `timestamps` is false. The frame count in the header is written
+    when the file is closed."""
+    def __init__(self, filename, width, height, depth=8, color_id=SER_MONO, observer='', instrument='',
+                 telescope='', timestamps=True):
+        self.filename = filename
+        self.width = width
+        self.height = height
+        self.depth = depth
+        self.color_id = color_id
+        self.observer = observer
+        self.instrument = instrument
+        self.telescope = telescope
+        planes = 3 if color_id in (SER_RGB, SER_BGR) else 1
+        self.frame_size = width * height * planes * (2 if depth > 8 else 1)
+        self.frames = 0
+        self._timestamps = [] if timestamps else None
+        self._start_time = time.time()
+        self._file = open(filename, 'wb')
+        self._write_header()
+
+    @classmethod
+    def for_camera(cls, camera, filename, **kwargs):
+        """Create a writer matching the current ROI and image type of `camera`."""
+        width, height, bins, image_type = camera.get_roi_format()
+        info = camera.get_camera_property()
+        depth = 16 if image_type == zwoasi.ASI_IMG_RAW16 else 8
+        kwargs.setdefault('instrument', info['Name'])
+        return cls(filename, width, height, depth=depth, color_id=ser_color_id(info, image_type), **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def _write_header(self):
+        self._file.seek(0)
+        # The LittleEndian field is set to 0 for little-endian data; the original specification has the sense of
+        # this flag reversed but all common software follows this convention
+        # Local time, at the UTC offset in force at the start of the recording
+        local_time = self._start_time + time.localtime(self._start_time).tm_gmtoff
+        self._file.write(_header.pack(b'LUCAM-RECORDER', 0, self.color_id, 0, self.width, self.height, self.depth,
+                                      self.frames, self.observer.encode()[:40], self.instrument.encode()[:40],
+                                      self.telescope.encode()[:40], _ser_time(local_time), _ser_time(self._start_time)))
+
+    def write(self, data, timestamp=None):
+        """Append a frame. `data` is a bytes-like object, for example a :class:`bytearray` from
+        :func:`zwoasi.Camera.get_video_data()` or a :class:`numpy.ndarray`.
+
+        `timestamp` is the time (seconds since the epoch) the frame was captured; by default the current time."""
+        if memoryview(data).nbytes != self.frame_size:
+            raise ValueError('Frame size does not match SER image size')
+        self._file.write(data)
+        if self._timestamps is not None:
+            self._timestamps.append(_ser_time(time.time() if timestamp is None else timestamp))
+        self.frames += 1
+
+    def close(self):
+        """Write the timestamp trailer, update the header and close the file."""
+        if self._file is None:
+            return
+        if self._timestamps:
+            self._file.write(struct.pack('<%dq' % len(self._timestamps), *self._timestamps))
+        self._write_header()
+        self._file.close()
+        self._file = None
+        logger.debug('wrote %d frames to %s', self.frames, self.filename)
@@ -0,0 +1,214 @@
+"""Frame statistics and histograms computed in a single pass.
+
+:class:`StatisticsEngine` counts the pixel values of an 8 or 16 bit image with :func:`numpy.bincount` and derives
+the minimum, maximum, mean, standard deviation, percentiles, saturated pixel count and a histogram from the counts,
+so the image is read only once however many statistics are wanted. The image may be subsampled on a regular grid to
+reduce the cost further. Working buffers are allocated once and reused. Example::
+
+    engine = StatisticsEngine(percentiles=(1, 50, 99.5), step=2)
+    stats = engine.compute(camera.capture_video_frame())
+    print(stats.mean, stats.percentiles[99.5])
+
+:class:`BackgroundStatistics` runs the engine in a separate thread for use from an acquisition loop."""
+
+import logging
+import threading
+
+import numpy as np
+
+__author__ = 'Steve Marple'
+__license__ = 'MIT'
+
+logger = logging.getLogger(__name__)
+
+# Number of pixels counted per call to bincount; keeps the temporary index array small enough to stay in cache
+_CHUNK = 1 << 18
+
+
+class FrameStatistics(object):
+    """Statistics of one frame, as returned by :func:`StatisticsEngine.compute()`.
+
+    The attributes are ``count`` (number of pixels used), ``min``, ``max``, ``mean``, ``std``, ``percentiles`` (a
+    :class:`dict` mapping each requested percentile to a pixel value), ``saturated`` (number of pixels at or above
+    the saturation level), ``histogram`` (a :class:`numpy.ndarray` of counts) and ``bin_width`` (the range of pixel
+    values counted in each histogram bin)."""
+    def __init__(self, count, min_, max_, mean, std, percentiles, saturated, histogram, bin_width):
+        self.count = count
+        self.min = min_
+        self.max = max_
+        self.mean = mean
+        self.std = std
+        self.percentiles = percentiles
+        self.saturated = saturated
+        self.histogram = histogram
+        self.bin_width = bin_width
+
+    def __repr__(self):
+        return '<FrameStatistics count=%d min=%d max=%d mean=%.2f std=%.2f>' % \
+            (self.count, self.min, self.max, self.mean, self.std)
+
+    def get_dict(self):
+        return {'count': self.count,
+                'min': self.min,
+                'max': self.max,
+                'mean': self.mean,
+                'std': self.std,
+                'percentiles': dict(self.percentiles),
+                'saturated': self.saturated}
+
+
+class StatisticsEngine(object):
+    """Compute statistics of 8 or 16 bit images in a single pass.
+
+    `percentiles` lists the percentiles (0 to 100) to report. Only every `step` th pixel in each direction is
+    counted. The histogram returned has `histogram_bins` bins spanning the full range of the data type; it must
+    divide the number of possible values. A lock serializes calls to :func:`compute()` since the working buffers
+    are shared.
+
+    Pixels are counted as saturated at the largest value the sensor can produce. ZWO cameras left-justify data from
+    sensors with fewer than 16 bits, so for 16 bit images of a `bit_depth` bit sensor this is below 65535 (65520 for
+    12 bits); by default the full range of the data type is assumed. See :func:`for_camera()`."""
+    def __init__(self, percentiles=(1, 50, 99), step=1, histogram_bins=256, bit_depth=None):
+        self.percentiles = tuple(percentiles)
+        self.step = step
+        self.histogram_bins = histogram_bins
+        self.bit_depth = bit_depth
+        self._counts = {}
+        self._values = {}
+        self._subsample = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_camera(cls, camera, **kwargs):
+        """Create an engine with the saturation level of `camera`, from its ``BitDepth`` property.
+        Type :class:`StatisticsEngine`."""
+        return cls(bit_depth=camera.get_camera_property()['BitDepth'], **kwargs)
+
+    def saturation_level(self, dtype):
+        """Smallest pixel value counted as saturated in images of `dtype`. Type :class:`int`."""
+        bits = 8 * np.dtype(dtype).itemsize
+        unused = 0
+        if self.bit_depth and bits > 8:
+            unused = max(bits - self.bit_depth, 0)  # 8 bit images hold the most significant bits so use all values
+        return ((1 << bits) - 1) & ~((1 << unused) - 1)
+
+    def _buffers(self, dtype):
+        if dtype not in self._counts:
+            if dtype not in (np.uint8, np.uint16):
+                raise TypeError('Only 8 and 16 bit unsigned images are supported')
+            n = 1 << (8 * dtype.itemsize)
+            if n % self.histogram_bins:
+                raise ValueError('histogram_bins must divide %d' % n)
+            values = np.arange(n, dtype=np.float64)
+            self._counts[dtype] = np.zeros(n, dtype=np.int64)
+            self._values[dtype] = (values, values * values)
+        return self._counts[dtype], self._values[dtype]
+
+    def _count(self, img, counts):
+        counts.fill(0)
+        if self.step > 1:
+            sub = img[::self.step, ::self.step]
+            if self._subsample is None or self._subsample.shape != sub.shape or self._subsample.dtype != sub.dtype:
+                self._subsample = np.empty(sub.shape, dtype=sub.dtype)
+            np.copyto(self._subsample, sub)
+            img = self._subsample
+        data = img.reshape(-1) if img.flags.c_contiguous else img.ravel()
+        for i in range(0, len(data), _CHUNK):
+            counts += np.bincount(data[i:i + _CHUNK], minlength=len(counts))
+        return len(data)
+
+    def compute(self, img):
+        """Compute the statistics of `img`, a :class:`numpy.ndarray`. Type :class:`FrameStatistics`.
+
+        Colour images are treated as a single set of values."""
+        with self._lock:
+            counts, (values, squares) = self._buffers(img.dtype)
+            n = self._count(img, counts)
+            if n == 0:
+                raise ValueError('Image is empty')
+            nonzero = np.flatnonzero(counts)
+            total = np.dot(counts, values)
+            mean = total / n
+            variance = max(np.dot(counts, squares) / n - mean * mean, 0.0)
+            cumulative = np.cumsum(counts)
+            percentiles = {}
+            for p in self.percentiles:
+                # Nearest-rank percentile
+                rank = min(max(int(np.ceil(p / 100.0 * n)), 1), n)
+                percentiles[p] = int(np.searchsorted(cumulative, rank))
+            bin_width = len(counts) // self.histogram_bins
+            histogram = counts.reshape(self.histogram_bins, bin_width).sum(axis=1)
+            return FrameStatistics(n, int(nonzero[0]), int(nonzero[-1]), float(mean), float(np.sqrt(variance)),
+                                   percentiles, int(counts[self.saturation_level(img.dtype):].sum()), histogram,
+                                   bin_width)
+
+
+class BackgroundStatistics(object):
+    """Compute statistics with `engine` in a background thread.
+
+    :func:`submit()` never blocks: if the previous frame is still being processed the new frame is skipped. The most
+    recent result is available from :func:`latest()`, and `callback`, if given, is called with each result from the
+    background thread."""
+    def __init__(self, engine=None, callback=None):
+        self.engine = engine if engine is not None else StatisticsEngine()
+        self.callback = callback
+        self.skipped = 0
+        self._frame = None
+        self._result = None
+        self._busy = False
+        self._condition = threading.Condition()
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name='zwoasi-stats')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, img):
+        """Queue `img` for processing. Returns ``True`` if accepted.
+
+        A copy of the (subsampled) image is taken so the caller may reuse its buffer."""
+        with self._condition:
+            if self._busy or self._frame is not None:
+                self.skipped += 1
+                return False
+        step = self.engine.step
+        frame = np.array(img[::step, ::step] if step > 1 else img, copy=True)
+        with self._condition:
+            self._frame = frame
+            self._condition.notify()
+        return True
+
+    def latest(self):
+        """Retrieve the most recent result. Type :class:`FrameStatistics`, or ``None`` if there is none yet."""
+        with self._condition:
+            return self._result
+
+    def stop(self):
+        """Stop the background thread."""
+        with self._condition:
+            self._stop = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _run(self):
+        # The frame has already been subsampled
+        engine = StatisticsEngine(self.engine.percentiles, 1, self.engine.histogram_bins, self.engine.bit_depth)
+        while True:
+            with self._condition:
+                while self._frame is None and not self._stop:
+                    self._condition.wait()
+                if self._stop:
+                    return
+                frame = self._frame
+                self._frame = None
+                self._busy = True
+            try:
+                result = engine.compute(frame)
+                with self._condition:
+                    self._result = result
+                if self.callback is not None:
+                    self.callback(result)
+            except Exception:
+                logger.exception('could not compute frame statistics')
+            finally:
+                with self._condition:
+                    self._busy = False
@@ -0,0 +1,181 @@
+"""Several software regions of interest within one hardware ROI.
+
+The SDK reads out a single rectangular region of interest. :class:`SubWindows` manages a set of rectangular windows
+(for instance around several stars) by setting the hardware ROI to the smallest bounding box allowed by the SDK, which
+raises the frame rate, and extracting the windows from each frame as zero-copy views or as copies packed into a
+preallocated array. Per-window statistics are computed with vectorized reductions. Example::
+
+    windows = SubWindows(camera, [(100, 200, 32, 32), (900, 640, 32, 32)])
+    windows.apply()
+    camera.start_video_capture()
+    while True:
+        stars = windows.extract(windows.capture_video_frame())
+        stats = windows.statistics()
+"""
+
+import logging
+
+import numpy as np
+
+import zwoasi
+
+__author__ = 'Steve Marple'
+__license__ = 'MIT'
+
+logger = logging.getLogger(__name__)
+
+_stats_dtype = np.dtype([('sum', np.float64), ('mean', np.float64), ('min', np.int64), ('max', np.int64),
+                         ('peak_x', np.int32), ('peak_y', np.int32)])
+
+
+def bounding_roi(windows, max_width, max_height, even_start=False):
+    """Compute the smallest hardware ROI containing all `windows`. Returns ``(start_x, start_y, width, height)``.
+
+    Each window is ``(x, y, width, height)``. The ROI width is rounded up to a multiple of 8 and the height to a
+    multiple of 2 as required by the SDK, and the ROI is shifted if necessary to stay within the `max_width` by
+    `max_height` (binned) sensor. Windows must lie within the largest such ROI, the sensor size rounded down to
+    those multiples; :class:`ValueError` is raised otherwise. If `even_start` is true the start position is made
+    even so that the Bayer pattern of raw colour images is unchanged."""
+    if not windows:
+        raise ValueError('No windows given')
+    # The ROI can only cover whole multiples of 8 columns and 2 rows, so windows must lie within those
+    max_width -= max_width % 8
+    max_height -= max_height % 2
+    for x, y, w, h in windows:
+        if x < 0 or y < 0 or w <= 0 or h <= 0 or x + w > max_width or y + h > max_height:
+            raise ValueError('Window %s outside usable area of sensor' % repr((x, y, w, h)))
+    x0 = min(w[0] for w in windows)
+    y0 = min(w[1] for w in windows)
+    x1 = max(w[0] + w[2] for w in windows)
+    y1 = max(w[1] + w[3] for w in windows)
+    if even_start:
+        x0 -= x0 % 2
+        y0 -= y0 % 2
+    width = max(x1 - x0, 8)
+    width += -width % 8
+    height = max(y1 - y0, 2)
+    height += height % 2
+    if width > max_width or height > max_height:
+        raise ValueError('Windows do not fit in a valid ROI')
+    # Shift back inside the sensor, by an even amount if required
+    x0 = min(x0, max_width - width)
+    y0 = min(y0, max_height - height)
+    if even_start:
+        x0 -= x0 % 2
+        y0 -= y0 % 2
+    return x0, y0, width, height
+
+
+class SubWindows(object):
+    """Extract the rectangular `windows` from the frames captured by `camera`.
+
+    Each window is ``(x, y, width, height)`` in binned sensor coordinates, for the binning currently in use. Call
+    :func:`apply()` to set the hardware ROI before starting capture."""
+    def __init__(self, camera, windows):
+        self.camera = camera
+        self.windows = [tuple(int(v) for v in w) for w in windows]
+        self.roi = None
+        self._offsets = None
+        self._buffer = None
+        self._packed = None
+        self._packed_views = None
+        self._packed_dtype = None
+        self._uniform = len(set((w[2], w[3]) for w in self.windows)) == 1
+        self._stats = np.zeros(len(self.windows), dtype=_stats_dtype)
+        self._last = None
+
+    def apply(self):
+        """Set the hardware ROI to the bounding box of the windows. Returns the ROI as
+        ``(start_x, start_y, width, height)``.
+
+        The image type and binning are unchanged. Video capture must be stopped."""
+        info = self.camera.get_camera_property()
+        width, height, bins, image_type = self.camera.get_roi_format()
+        even_start = bool(info['IsColorCam']) and image_type in (zwoasi.ASI_IMG_RAW8, zwoasi.ASI_IMG_RAW16)
+        roi = bounding_roi(self.windows, info['MaxWidth'] // bins, info['MaxHeight'] // bins, even_start)
+        self.camera.set_roi(*roi)
+        self.roi = roi
+        self._offsets = [(x - roi[0], y - roi[1], w, h) for x, y, w, h in self.windows]
+        self._buffer = bytearray(zwoasi.buffer_size(self.camera.get_roi_format()))
+        self._packed = None
+        logger.debug('hardware ROI set to %s for %d windows', roi, len(self.windows))
+        return roi
+
+    def _check(self):
+        if self._offsets is None:
+            raise zwoasi.ZWO_Error('apply() must be called first')
+
+    def capture_video_frame(self, timeout=None):
+        """Capture a video frame into an internal buffer. Type :class:`numpy.ndarray`.
+
+        The image, and any views of it from :func:`views()`, are only valid until the next frame is captured."""
+        self._check()
+        return self.camera.capture_video_frame(buffer_=self._buffer, timeout=timeout)
+
+    def views(self, img):
+        """Return a list of views of `img`, one per window. No data is copied."""
+        self._check()
+        self._last = [img[y:y + h, x:x + w] for x, y, w, h in self._offsets]
+        return self._last
+
+    def extract(self, img):
+        """Copy the windows of `img` into a preallocated array which is reused for every frame.
+
+        If all windows are the same size the result is an array with the window index as its first axis, otherwise
+        it is a list of arrays which share one contiguous buffer."""
+        self._check()
+        views = self.views(img)
+        if self._packed is None or self._packed_dtype != (img.dtype, img.shape[2:]):
+            self._allocate(img)
+        for src, dst in zip(views, self._packed_views):
+            np.copyto(dst, src)
+        self._last = self._packed_views
+        return self._packed if self._uniform else self._packed_views
+
+    def _allocate(self, img):
+        extra = img.shape[2:]
+        self._packed_dtype = (img.dtype, extra)
+        if self._uniform:
+            w, h = self._offsets[0][2:]
+            self._packed = np.empty((len(self._offsets), h, w) + extra, dtype=img.dtype)
+            self._packed_views = list(self._packed)
+        else:
+            sizes = [w * h * int(np.prod(extra)) for x, y, w, h in self._offsets]
+            self._packed = np.empty(sum(sizes), dtype=img.dtype)
+            self._packed_views = []
+            start = 0
+            for (x, y, w, h), size in zip(self._offsets, sizes):
+                self._packed_views.append(self._packed[start:start + size].reshape((h, w) + extra))
+                start += size
+
+    def statistics(self, img=None):
+        """Compute the sum, mean, minimum, maximum and peak position of each window.
+
+        Uses `img` if given, otherwise the windows from the last call to :func:`views()` or :func:`extract()`.
+        Returns a structured :class:`numpy.ndarray` with fields ``sum``, ``mean``, ``min``, ``max``, ``peak_x`` and
+        ``peak_y``; peak positions are in sensor coordinates. The array is reused on the next call."""
+        windows = self.views(img) if img is not None else self._last
+        if windows is None:
+            raise zwoasi.ZWO_Error('No frame available')
+        stats = self._stats
+        if self._uniform and windows is self._packed_views and self._packed.ndim == 3:
+            stack = self._packed
+            stats['sum'] = stack.sum(axis=(1, 2), dtype=np.float64)
+            stats['min'] = stack.min(axis=(1, 2))
+            stats['max'] = stack.max(axis=(1, 2))
+            peaks = stack.reshape(len(stack), -1).argmax(axis=1)
+            w = stack.shape[2]
+        else:
+            peaks = np.empty(len(windows), dtype=np.intp)
+            for i, win in enumerate(windows):
+                stats['sum'][i] = win.sum(dtype=np.float64)
+                stats['min'][i] = win.min()
+                stats['max'][i] = win.max()
+                peaks[i] = win.argmax() if win.ndim == 2 else win.sum(axis=2).argmax()
+            w = None
+        widths = np.array([o[2] for o in self._offsets]) if w is None else w
+        stats['mean'] = stats['sum'] / np.array([win.size for win in windows])
+        stats['peak_y'], stats['peak_x'] = np.divmod(peaks, widths)
+        stats['peak_x'] += [wd[0] for wd in self.windows]
+        stats['peak_y'] += [wd[1] for wd in self.windows]
+        return stats
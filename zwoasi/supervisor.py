@@ -0,0 +1,219 @@
+"""Automatic recovery of cameras which are disconnected or reset.
+
+:class:`CameraSupervisor` wraps a :class:`zwoasi.Camera` and can be used in its place. It keeps a snapshot of the
+camera configuration (ROI, binning, image type, camera mode and writable control values) which is refreshed whenever
+a setting is changed through the supervisor. When a call fails because the camera has been removed, or a background
+monitor notices that the camera has disappeared, the supervisor waits for the same physical camera (matched by
+serial number) to reappear, reopens it, restores the configuration and restarts video capture if it was running.
+The failed call is then retried once. Example::
+
+    camera = CameraSupervisor(zwoasi.Camera(0))
+    camera.start_video_capture()
+    while True:
+        img = camera.capture_video_frame(timeout=2000)
+"""
+
+import logging
+import threading
+import time
+import traceback
+
+import zwoasi
+
+__author__ = 'Steve Marple'
+__license__ = 'MIT'
+
+logger = logging.getLogger(__name__)
+
+# Camera methods which change the configuration; the affected part of the snapshot is refreshed after they succeed
+_setters = ('set_roi', 'set_roi_format', 'set_roi_start_position', 'set_image_type', 'set_control_value',
+            'set_camera_mode', 'auto_exposure', 'auto_wb', 'start_video_capture', 'stop_video_capture')
+
+
+class CameraSupervisor(object):
+    """Supervise `camera`, reconnecting it automatically after removal.
+
+    A monitor thread checks every `poll_interval` seconds that the camera is still connected. While the camera is
+    missing, reconnection is attempted every `retry_interval` seconds, for at most `max_wait` seconds (``None`` to
+    wait indefinitely) after which the original error is raised to the caller. `on_lost` and `on_recovered` are
+    optional callbacks called with the supervisor as argument."""
+    def __init__(self, camera, poll_interval=2.0, retry_interval=0.5, max_wait=None, on_lost=None,
+                 on_recovered=None):
+        self.camera = camera
+        self.poll_interval = poll_interval
+        self.retry_interval = retry_interval
+        self.max_wait = max_wait
+        self.on_lost = on_lost
+        self.on_recovered = on_recovered
+        self.reconnects = 0
+        self.last_recovery_time = None
+        self._lock = threading.RLock()
+        self._generation = 0
+        self._stop = threading.Event()
+
+        try:
+            self.serial = camera.get_serial_number()
+        except zwoasi.ZWO_IOError:
+            self.serial = None  # Older models have no serial number; match on model only
+        self.model = camera.get_camera_property()['Name']
+        self._num_cameras = zwoasi.get_num_cameras()
+        self._controls = dict((v['ControlType'], v) for v in camera.get_controls().values() if v['IsWritable'])
+        self._control_types = dict((v['Name'], k) for k, v in self._controls.items())
+        self.snapshot()
+
+        self._thread = None
+        if poll_interval:
+            self._thread = threading.Thread(target=self._monitor, name='zwoasi-supervisor-%s' % self.serial)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def close(self):
+        """Stop monitoring and close the camera."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.camera.close()
+
+    def snapshot(self):
+        """Record the current camera configuration, to be restored after reconnection."""
+        camera = self.camera
+        whbi = camera.get_roi_format()
+        state = {'whbi': whbi,
+                 'start': camera.get_roi_start_position(),
+                 'mode': None,
+                 'video_active': camera.video_active,
+                 'controls': {}}
+        if camera.get_camera_property().get('IsTriggerCam'):
+            state['mode'] = camera.get_camera_mode()
+        for control_type in self._controls:
+            state['controls'][control_type] = camera.get_control_value(control_type)
+        self.state = state
+        return state
+
+    def _update_snapshot(self, name, args, kwargs, r):
+        # Refresh only the part of the snapshot changed by setter `name`
+        camera = self.camera
+        state = self.state
+        if name in ('start_video_capture', 'stop_video_capture'):
+            state['video_active'] = camera.video_active
+        elif name == 'set_camera_mode':
+            state['mode'] = camera.get_camera_mode()
+        elif name in ('set_control_value', 'auto_exposure', 'auto_wb'):
+            if name == 'set_control_value':
+                control_types = [kwargs['control_type'] if 'control_type' in kwargs else args[0]]
+            else:
+                control_types = [self._control_types[n] for n in r if n in self._control_types]
+            for control_type in control_types:
+                if control_type in self._controls:
+                    state['controls'][control_type] = camera.get_control_value(control_type)
+        else:
+            state['whbi'] = camera.get_roi_format()
+            state['start'] = camera.get_roi_start_position()
+
+    def restore(self):
+        """Apply the recorded configuration to the camera."""
+        camera = self.camera
+        state = self.state
+        if state['mode'] is not None:
+            camera.set_camera_mode(state['mode'])
+        camera.set_roi_format(*state['whbi'])
+        camera.set_roi_start_position(*state['start'])
+        for control_type, (value, auto) in state['controls'].items():
+            try:
+                camera.set_control_value(control_type, value, auto)
+            except zwoasi.ZWO_IOError as e:
+                logger.debug('could not restore control %s: %s', self._controls[control_type]['Name'], e)
+        if state['video_active']:
+            camera.start_video_capture()
+
+    def __getattr__(self, name):
+        attr = getattr(self.camera, name)
+        if not callable(attr) or name.startswith('_'):
+            return attr
+
+        def wrapper(*args, **kwargs):
+            r = self._call(name, args, kwargs)
+            if name in _setters:
+                self._update_snapshot(name, args, kwargs, r)
+            return r
+
+        wrapper.__name__ = name
+        return wrapper
+
+    def _call(self, name, args, kwargs):
+        generation = self._generation
+        try:
+            return getattr(self.camera, name)(*args, **kwargs)
+        except zwoasi.ZWO_CameraRemovedError as e:
+            logger.warning('camera %s: %s during %s()', self.serial, e, name)
+            if not self.recover(generation):
+                raise
+        return getattr(self.camera, name)(*args, **kwargs)
+
+    def is_connected(self):
+        """Check that the supervised camera is still connected. Type :class:`bool`.
+
+        Only the number of connected cameras is queried unless it has changed, so that the check does not interfere
+        with calls in progress on the camera."""
+        n = zwoasi.get_num_cameras()
+        if n <= self.camera.id:
+            return False
+        if n == self._num_cameras:
+            return True
+        self._num_cameras = n
+        try:
+            zwoasi.rescan_cameras()
+            info = zwoasi.get_camera_info(self.camera.id, identify=True)
+        except zwoasi.ZWO_CameraRemovedError:
+            return False
+        return info['property']['Name'] == self.model and (self.serial is None or info['serial'] == self.serial)
+
+    def recover(self, generation=None):
+        """Reconnect to the camera and restore its configuration. Returns ``True`` on success.
+
+        If `generation` is given and a recovery has completed since it was read no further action is taken."""
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return True  # Another thread already recovered the camera
+            t0 = time.monotonic()
+            if self.on_lost is not None:
+                self.on_lost(self)
+            try:
+                self.camera.close()  # Release the stale handle so the camera can be identified when it returns
+            except zwoasi.ZWO_Error:
+                pass
+            while not self._stop.is_set():
+                try:
+                    zwoasi.rescan_cameras()
+                    id_ = zwoasi.find_camera(name=self.model, serial=self.serial)
+                    self.camera.reopen(id_)
+                    self.restore()
+                    self._num_cameras = zwoasi.get_num_cameras()
+                    break
+                except (zwoasi.ZWO_Error, ValueError):
+                    logger.debug(traceback.format_exc())
+                if self.max_wait is not None and time.monotonic() - t0 > self.max_wait:
+                    logger.error('camera %s did not reappear within %g s', self.serial, self.max_wait)
+                    return False
+                self._stop.wait(self.retry_interval)
+            else:
+                return False
+            self._generation += 1
+            self.reconnects += 1
+            self.last_recovery_time = time.monotonic() - t0
+            logger.info('camera %s recovered in %.3f s', self.serial, self.last_recovery_time)
+        if self.on_recovered is not None:
+            self.on_recovered(self)
+        return True
+
+    def _monitor(self):
+        while not self._stop.wait(self.poll_interval):
+            generation = self._generation
+            try:
+                connected = self.is_connected()
+            except zwoasi.ZWO_Error:
+                logger.debug(traceback.format_exc())
+                continue
+            if not connected:
+                logger.warning('camera %s disconnected', self.serial)
+                self.recover(generation)
@@ -0,0 +1,190 @@
+"""Background sampling of camera telemetry such as sensor temperature and cooler power.
+
+:class:`TelemetrySampler` reads a set of controls at a fixed rate in a background thread and stores them in
+preallocated ring buffers. The most recent values are available without an SDK call. A second, coarser ring buffer
+holds averages over blocks of samples to provide a long history at low memory cost.
+
+:func:`cooling_ramp()` changes the cooler target temperature in steps to avoid thermal shock to the sensor."""
+
+import logging
+import threading
+import time
+
+import numpy as np
+
+import zwoasi
+
+__author__ = 'Steve Marple'
+__license__ = 'MIT'
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONTROLS = (zwoasi.ASI_TEMPERATURE, zwoasi.ASI_COOLER_POWER_PERC, zwoasi.ASI_TARGET_TEMP)
+
+
+def _scale(control_type, value):
+    if control_type == zwoasi.ASI_TEMPERATURE:
+        return value / 10.0  # SDK returns 10 * temperature
+    return float(value)
+
+
+class _Ring(object):
+    def __init__(self, size, width):
+        self.times = np.zeros(size)
+        self.values = np.zeros((size, width), dtype=np.float32)
+        self.next = 0
+        self.count = 0
+
+    def append(self, t, values):
+        i = self.next
+        self.times[i] = t
+        self.values[i] = values
+        self.next = (i + 1) % len(self.times)
+        self.count = min(self.count + 1, len(self.times))
+
+    def get(self):
+        # Oldest first
+        idx = np.arange(self.next - self.count, self.next) % len(self.times)
+        return self.times[idx], self.values[idx]
+
+
+class TelemetrySampler(object):
+    """Sample `controls` from `camera` every `interval` seconds.
+
+    The most recent `size` samples are kept at full resolution. Every `downsample` samples are also averaged into a
+    history ring holding `history_size` entries. Values are floats; ``ASI_TEMPERATURE`` is converted to degrees
+    Celsius. Controls which the camera does not support, and failed reads, are recorded as NaN; history averages
+    only include valid samples and are NaN if there were none. `camera` may be a
+    :class:`zwoasi.threadsafe.ThreadSafeCamera` when it is shared with other threads."""
+    def __init__(self, camera, controls=DEFAULT_CONTROLS, interval=1.0, size=3600, downsample=60,
+                 history_size=1440):
+        self.camera = camera
+        self.controls = tuple(controls)
+        self.interval = interval
+        self.downsample = downsample
+        self._recent = _Ring(size, len(self.controls))
+        self._history = _Ring(history_size, len(self.controls))
+        self._sum = np.zeros(len(self.controls))
+        self._valid = np.zeros(len(self.controls), dtype=np.int64)  # Number of non-NaN samples in each sum
+        self._sum_time = 0.0
+        self._sum_count = 0
+        self._sample = np.zeros(len(self.controls), dtype=np.float32)
+        self._latest = None
+        self._latest_time = None
+        self._unsupported = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start sampling in a background thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='zwoasi-telemetry-%d' % self.camera.id)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def sample(self):
+        """Read all controls now and record them. Returns the values as a :class:`dict`."""
+        sample = self._sample
+        for i, control_type in enumerate(self.controls):
+            if control_type in self._unsupported:
+                sample[i] = np.nan
+                continue
+            try:
+                sample[i] = _scale(control_type, self.camera.get_control_value(control_type)[0])
+            except zwoasi.ZWO_IOError as e:
+                if e.error_code == 3:  # Invalid control type
+                    self._unsupported.add(control_type)
+                sample[i] = np.nan
+        t = time.time()
+        with self._lock:
+            self._recent.append(t, sample)
+            self._latest = dict(zip(self.controls, sample.tolist()))
+            self._latest_time = t
+            # Failed reads are NaN; leave them out of the block average rather than let one poison it
+            valid = ~np.isnan(sample)
+            self._sum[valid] += sample[valid]
+            self._valid += valid
+            self._sum_time += t
+            self._sum_count += 1
+            if self._sum_count >= self.downsample:
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    self._history.append(self._sum_time / self._sum_count, self._sum / self._valid)
+                self._sum[:] = 0
+                self._valid[:] = 0
+                self._sum_time = 0.0
+                self._sum_count = 0
+        return self._latest
+
+    def _run(self):
+        next_time = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                self.sample()
+            except zwoasi.ZWO_Error as e:
+                logger.warning('telemetry sample failed: %s', e)
+            next_time += self.interval
+            delay = next_time - time.monotonic()
+            if delay < 0:
+                next_time = time.monotonic()  # Fell behind, do not try to catch up
+                delay = 0
+            self._stop.wait(delay)
+
+    def latest(self):
+        """Retrieve the most recent values without calling the SDK.
+
+        Returns a tuple ``(timestamp, values)`` where `values` is a :class:`dict` keyed by control type, or
+        ``(None, None)`` if no sample has been taken."""
+        with self._lock:
+            return self._latest_time, self._latest
+
+    def get_recent(self):
+        """Retrieve the full resolution samples, oldest first.
+
+        Returns a tuple of a :class:`numpy.ndarray` of timestamps and a 2-d array of values, one column per
+        control."""
+        with self._lock:
+            return self._recent.get()
+
+    def get_history(self):
+        """Retrieve the downsampled history, oldest first, in the same form as :func:`get_recent()`."""
+        with self._lock:
+            return self._history.get()
+
+
+def cooling_ramp(camera, target, step=2, interval=30.0, stop=None):
+    """Move the cooler target temperature to `target` (degrees Celsius) in steps of at most `step` degrees.
+
+    The cooler is switched on and the target is changed every `interval` seconds, starting from the current sensor
+    temperature, so the sensor is cooled or warmed gradually. Blocks until the final target has been set or `stop`, a
+    :class:`threading.Event`, is set. Returns the last target temperature set. ``ASI_TARGET_TEMP`` only accepts
+    whole degrees, so `target` and each intermediate target are rounded to the nearest degree."""
+    if step <= 0:
+        raise ValueError('step must be positive')
+    target = int(round(target))
+    current = camera.get_control_value(zwoasi.ASI_TEMPERATURE)[0] / 10.0
+    camera.set_control_value(zwoasi.ASI_COOLER_ON, 1)
+    setpoint = int(round(current))
+    while True:
+        if setpoint < target:
+            setpoint = int(round(min(setpoint + step, target)))
+        else:
+            setpoint = int(round(max(setpoint - step, target)))
+        camera.set_control_value(zwoasi.ASI_TARGET_TEMP, setpoint)
+        logger.debug('cooler target set to %d C', setpoint)
+        if setpoint == target:
+            return setpoint
+        if stop is not None:
+            if stop.wait(interval):
+                return setpoint
+        else:
+            time.sleep(interval)
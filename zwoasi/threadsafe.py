@@ -0,0 +1,107 @@
+"""Sharing a camera between threads.
+
+:class:`ThreadSafeCamera` wraps a :class:`zwoasi.Camera` so that it can be used from several threads at once (for
+instance acquisition, guiding and telemetry). Each wrapped camera owns a worker thread which makes every SDK call;
+method calls from other threads are placed in a command queue and block until the worker has executed them. Calls
+which read controls or status are placed in a high priority lane so that they are executed ahead of any queued
+captures. Example::
+
+    camera = ThreadSafeCamera(zwoasi.Camera(0))
+    # In a telemetry thread
+    temperature = camera.get_control_value(zwoasi.ASI_TEMPERATURE)[0] / 10.0
+"""
+
+import concurrent.futures
+import itertools
+import logging
+import queue
+import threading
+
+__author__ = 'Steve Marple'
+__license__ = 'MIT'
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+
+# Camera methods which only read state, executed in the high priority lane
+high_priority_methods = frozenset(['get_control_value', 'get_control_values', 'get_controls', 'get_num_controls',
+                                   'get_dropped_frames', 'get_exposure_status', 'get_camera_property',
+                                   'get_camera_mode', 'get_roi', 'get_roi_format', 'get_roi_start_position',
+                                   'get_bin', 'get_image_type', 'get_id', 'get_serial_number'])
+
+_shutdown = object()
+
+
+class ThreadSafeCamera(object):
+    """Serialize all access to `camera` through a dedicated worker thread.
+
+    Public methods of the camera are available with the same arguments and return values. Calls made from the
+    worker thread itself (e.g. from capture hooks) are executed directly. A call already being executed is never
+    interrupted, so a control read may wait for a video read in progress; give
+    :func:`zwoasi.Camera.capture_video_frame()` a `timeout` to bound this delay.
+
+    :func:`zwoasi.Camera.capture_sequence()` runs its own acquisition thread and must not be used through this
+    wrapper."""
+    def __init__(self, camera):
+        self.camera = camera
+        self._queue = queue.PriorityQueue()
+        self._counter = itertools.count()  # Keeps calls of equal priority in order
+        self._thread = threading.Thread(target=self._run, name='zwoasi-camera-%d' % camera.id)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def __getattr__(self, name):
+        attr = getattr(self.camera, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+        priority = PRIORITY_HIGH if name in high_priority_methods else PRIORITY_NORMAL
+
+        def wrapper(*args, **kwargs):
+            return self.submit(priority, name, *args, **kwargs).result()
+
+        wrapper.__name__ = name
+        wrapper.__doc__ = attr.__doc__
+        # Cache so that subsequent lookups do not pass through __getattr__
+        setattr(self, name, wrapper)
+        return wrapper
+
+    def submit(self, priority, name, *args, **kwargs):
+        """Queue a call of the camera method `name`. Returns a :class:`concurrent.futures.Future`.
+
+        `priority` is ``PRIORITY_HIGH`` or ``PRIORITY_NORMAL``."""
+        future = concurrent.futures.Future()
+        func = getattr(self.camera, name)
+        if threading.current_thread() is self._thread:
+            future.set_result(func(*args, **kwargs))
+            return future
+        if not self._thread.is_alive():
+            raise RuntimeError('Camera worker thread has stopped')
+        self._queue.put((priority, next(self._counter), func, args, kwargs, future))
+        return future
+
+    def close(self):
+        """Execute all queued calls, stop the worker thread and close the camera."""
+        if self._thread.is_alive():
+            self._queue.put((PRIORITY_NORMAL + 1, next(self._counter), _shutdown, None, None, None))
+            self._thread.join()
+        self.camera.close()
+
+    def _run(self):
+        while True:
+            priority, n, func, args, kwargs, future = self._queue.get()
+            if func is _shutdown:
+                return
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(func(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
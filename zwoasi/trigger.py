@@ -0,0 +1,194 @@
+"""Acquisition of frames from trigger-capable cameras.
+
+:class:`TriggeredAcquisition` puts a camera into one of the ``ASI_MODE_TRIG_*`` modes, starts video capture and runs a
+reader thread which collects every triggered frame with :func:`zwoasi.Camera.get_video_data()` into a bounded queue
+of timestamped :class:`zwoasi.Frame` objects. Example::
+
+    with TriggeredAcquisition(camera, zwoasi.ASI_MODE_TRIG_RISE_EDGE) as acq:
+        for frame in acq:
+            process(frame)
+"""
+
+import logging
+import queue
+import threading
+import time
+import traceback
+
+import zwoasi
+
+__author__ = 'Steve Marple'
+__license__ = 'MIT'
+
+logger = logging.getLogger(__name__)
+
+_trigger_modes = (zwoasi.ASI_MODE_TRIG_SOFT_EDGE,
+                  zwoasi.ASI_MODE_TRIG_RISE_EDGE,
+                  zwoasi.ASI_MODE_TRIG_FALL_EDGE,
+                  zwoasi.ASI_MODE_TRIG_SOFT_LEVEL,
+                  zwoasi.ASI_MODE_TRIG_HIGH_LEVEL,
+                  zwoasi.ASI_MODE_TRIG_LOW_LEVEL)
+
+_soft_trigger_modes = (zwoasi.ASI_MODE_TRIG_SOFT_EDGE, zwoasi.ASI_MODE_TRIG_SOFT_LEVEL)
+
+# Error code returned by ASIGetVideoData when no trigger arrived within the timeout
+_TIMEOUT_ERROR = 11
+
+
+class TriggeredAcquisition(object):
+    """Collect frames from a camera operating in a hardware or software trigger mode.
+
+    `mode` is one of the ``ASI_MODE_TRIG_*`` constants. Frames are placed in a queue holding at most `queue_size`
+    frames; if the consumer falls behind the oldest frame is discarded and :attr:`overflows` is incremented so that
+    the reader thread never stalls. `timeout` is the time in milliseconds the reader waits for each trigger; a
+    timeout is not an error, it merely lets the thread check whether it should stop. `output`, if given, is a
+    ``(pin, pin_high, delay, duration)`` tuple passed to :func:`zwoasi.Camera.set_trigger_output_io_conf()`.
+
+    The ``monotonic_end`` and ``timestamp`` attributes of each frame are taken as soon as the SDK returns the
+    frame; ``monotonic_start`` is when the reader began waiting for the trigger.
+
+    The camera is returned to ``ASI_MODE_NORMAL`` by :func:`stop()`."""
+    def __init__(self, camera, mode=zwoasi.ASI_MODE_TRIG_RISE_EDGE, queue_size=64, timeout=1000, output=None):
+        if mode not in _trigger_modes:
+            raise ValueError('Not a trigger mode')
+        self.camera = camera
+        self.mode = mode
+        self.timeout = timeout
+        self.output = output
+        self.queue = queue.Queue(queue_size)
+        self.frames = 0
+        self.overflows = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.error = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.stop()
+
+    def __iter__(self):
+        while True:
+            try:
+                yield self.get(timeout=self.timeout / 1000.0)
+            except queue.Empty:
+                if not self.is_running():
+                    if self.error is not None:
+                        raise self.error
+                    return
+
+    def is_running(self):
+        """Indicate if the reader thread is active. Type :class:`bool`."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Configure the trigger mode, arm the camera and start the reader thread."""
+        if self.is_running():
+            raise zwoasi.ZWO_Error('Triggered acquisition already running')
+        supported = self.camera.get_camera_support_mode()['SupportedCameraMode']
+        if self.mode not in supported:
+            raise ValueError('Trigger mode %d not supported by camera' % self.mode)
+        self.camera.set_camera_mode(self.mode)
+        if self.output is not None:
+            self.camera.set_trigger_output_io_conf(*self.output)
+
+        self._whbi = self.camera.get_roi_format()
+        self._metadata = zwoasi.FrameMetadata(self.camera, self._whbi, dropped_frames=0)
+        self.error = None
+        self._stop.clear()
+        self.camera.start_video_capture()
+        self._thread = threading.Thread(target=self._run, name='zwoasi-trigger-%d' % self.camera.id)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the reader thread, leave video mode and return the camera to ``ASI_MODE_NORMAL``.
+
+        Frames already queued remain available from :func:`get()`."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        try:
+            self.camera.stop_video_capture()
+            self.camera.set_camera_mode(zwoasi.ASI_MODE_NORMAL)
+        except zwoasi.ZWO_Error:
+            logger.debug(traceback.format_exc())
+
+    def send_soft_trigger(self, start=True):
+        """Trigger the camera when in a software trigger mode.
+
+        For ``ASI_MODE_TRIG_SOFT_LEVEL`` call with ``start=True`` to begin the exposure and ``start=False`` to end
+        it."""
+        if self.mode not in _soft_trigger_modes:
+            raise zwoasi.ZWO_Error('Camera is not in a software trigger mode')
+        self.camera.send_soft_trigger(start)
+
+    def get(self, block=True, timeout=None):
+        """Retrieve the next triggered frame. Type :class:`zwoasi.Frame`.
+
+        Raises :class:`queue.Empty` if no frame is available within `timeout` seconds."""
+        return self.queue.get(block, timeout)
+
+    def _rearm(self):
+        self.camera.stop_video_capture()
+        self.camera.start_video_capture()
+        self._metadata.dropped_frames = 0  # The SDK restarts its count
+
+    def _put(self, frame):
+        while True:
+            try:
+                self.queue.put_nowait(frame)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.overflows += 1
+                except queue.Empty:
+                    pass
+
+    def _run(self):
+        camera = self.camera
+        whbi = self._whbi
+        sz = zwoasi.buffer_size(whbi)
+        while not self._stop.is_set():
+            buf = bytearray(sz)
+            t_start = time.monotonic()
+            try:
+                camera.get_video_data(timeout=self.timeout, buffer_=buf)
+            except zwoasi.ZWO_IOError as e:
+                if e.error_code == _TIMEOUT_ERROR:
+                    self.timeouts += 1
+                    continue
+                self.errors += 1
+                logger.error('trigger acquisition error: %s', e)
+                if isinstance(e, zwoasi.ZWO_CameraRemovedError):
+                    self.error = e  # No point trying to re-arm a camera which has gone away
+                    return
+                try:
+                    self._rearm()
+                except zwoasi.ZWO_Error as e2:
+                    self.error = e2
+                    return
+                continue
+            except Exception as e:
+                self.errors += 1
+                self.error = e
+                logger.debug(traceback.format_exc())
+                return
+            t_end = time.monotonic()
+            wall_clock = time.time()
+            self.frames += 1
+            try:
+                frame = self._metadata.frame(zwoasi.image_from_buffer(buf, whbi), t_start, t_end, wall_clock,
+                                             sequence=self.frames)
+            except zwoasi.ZWO_Error as e:
+                # Keep the frame even if the dropped frame count could not be read
+                logger.debug('could not read frame metadata: %s', e)
+                frame = zwoasi.Frame(zwoasi.image_from_buffer(buf, whbi), sequence=self.frames,
+                                     monotonic_start=t_start, monotonic_end=t_end, timestamp=wall_clock)
+            self._put(frame)